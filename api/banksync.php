@@ -1,10 +1,16 @@
 <?php
-// Note: PYTHON_EXECUTABLE is provided via `ini.php`.
+// Note: PYTHON_EXECUTABLE and BANKSYNC_WORKER_SOCKET are provided via `ini.php`.
 const PYTHON_SCRIPT_DIR = __DIR__ . '/banksync';
-const PYTHON_SCRIPT_SPARKASSE = PYTHON_SCRIPT_DIR . '/sparkasse.py';
-const PYTHON_SCRIPT_DKB = PYTHON_SCRIPT_DIR . '/dkb_via_api.py';
+// Script names as understood by the worker; the file is <name>.py.
+const PYTHON_SCRIPT_SPARKASSE = 'sparkasse';
+const PYTHON_SCRIPT_DKB = 'dkb_via_api';
+const PYTHON_SCRIPT_CHECKPOINTS = 'checkpoints';
+// Syncs can take minutes (captcha, waiting for MFA approval on the phone).
+const WORKER_TIMEOUT_SECONDS = 600;
 
 const EMPTY_RESULT_PLACEHOLDER = '<EMPTY_RESULT_SET>';
+// Output formats of the scripts (see banksync/imported_rows.py).
+const OUTPUT_FORMATS = ['csv', 'ndjson', 'protobuf'];
 
 /** Returns the name of a temporary file that will be cleaned up automagically. */
 function make_tempfile() {
@@ -30,93 +36,300 @@ function run_process($command, $cwd, $stdin, &$stdout=null, &$stderr=null) {
   return proc_close($proc);
 }
 
-// Assumes valid input, runs on a single account.
-function run_sparkasse($bankUrl, $loginName, $loginPassword, $fromStr, $toStr, $accountIndex, $verbose) {
-  $scriptArgs = [
-    PYTHON_EXECUTABLE,
-    escapeshellarg(PYTHON_SCRIPT_SPARKASSE),
-    '--base', escapeshellarg($bankUrl),
-    '--from', escapeshellarg($fromStr),
-    '--to', escapeshellarg($toStr),
-  ];
+function read_exactly($stream, $length) {
+  $data = '';
+  while (strlen($data) < $length) {
+    $chunk = fread($stream, $length - strlen($data));
+    if ($chunk === false || $chunk === '') {
+      return false;
+    }
+    $data .= $chunk;
+  }
+  return $data;
+}
+
+function write_all($stream, $data) {
+  while (strlen($data) > 0) {
+    $written = fwrite($stream, $data);
+    if ($written === false || $written === 0) {
+      return false;
+    }
+    $data = substr($data, $written);
+  }
+  return true;
+}
+
+/**
+ * Sends a job to the banksync worker (see banksync/worker_client.py for the
+ * protocol), to run in the same directory and environment as a subprocess
+ * would. Returns the exit code, or null if the worker could not be connected
+ * to. Only then has the job not started, so that it may run elsewhere; any
+ * later failure (timeout, worker died, invalid response) is returned as a
+ * failed job, since the sync may already have reached the bank.
+ */
+function run_worker_job($socketPath, $scriptName, $args, $stdin, &$stdout=null, &$stderr=null) {
+  $request = json_encode([
+    'script' => $scriptName,
+    'args' => $args,
+    'stdin' => $stdin,
+    'cwd' => PYTHON_SCRIPT_DIR,
+    'env' => (object)getenv(),
+  ]);
+  if ($request === false) {
+    return null;
+  }
+  $sock = @stream_socket_client('unix://' . $socketPath, $errno, $errstr, 5);
+  if ($sock === false) {
+    error_log('Could not connect to banksync worker: ' . $errstr);
+    return null;
+  }
+  stream_set_timeout($sock, WORKER_TIMEOUT_SECONDS);
+
+  $response = null;
+  if (write_all($sock, pack('N', strlen($request)) . $request)) {
+    $header = read_exactly($sock, 4);
+    if ($header !== false) {
+      $body = read_exactly($sock, unpack('N', $header)[1]);
+      if ($body !== false) {
+        $response = json_decode($body, true);
+      }
+    }
+  }
+  $timedOut = stream_get_meta_data($sock)['timed_out'];
+  fclose($sock);
+
+  if (!is_array($response) || !isset($response['exit_code'])) {
+    $error = $timedOut
+        ? 'The banksync worker did not finish the job within ' . WORKER_TIMEOUT_SECONDS . ' seconds.'
+        : 'The banksync worker failed during the job (no or an invalid response).';
+    error_log($error);
+    $stdout = '';
+    $stderr = $error;
+    return 1;
+  }
+  $stdout = base64_decode($response['stdout']);
+  $stderr = $response['stderr'];
+  return (int)$response['exit_code'];
+}
+
+/**
+ * Returns the arguments shared by all scripts that relate to persistent state.
+ * $checkpointToken is set for incremental syncs, see new_checkpoint_token().
+ */
+function state_args($checkpointToken, $dedupStorageId, $dedupAccountIds) {
+  $args = [];
+  if ($checkpointToken !== null) {
+    // The checkpoints only advance once the client confirms the import.
+    $args = [
+      '--checkpoint-dir', BANKSYNC_STATE_DIR . '/checkpoints',
+      '--incremental',
+      '--checkpoint-token', $checkpointToken,
+    ];
+  }
+  // Drop rows that are already in the user's stored database (see banksync/dedup.py).
+  if ($dedupStorageId !== null && file_exists(getFileFromId($dedupStorageId))) {
+    $args[] = '--dedup-storage';
+    $args[] = getFileFromId($dedupStorageId);
+    if (BANKSYNC_STATE_DIR !== null) {
+      $args[] = '--dedup-cache-dir';
+      $args[] = BANKSYNC_STATE_DIR . '/dedup-index';
+    }
+    // Like the app's import, only compare rows that belong to the target account.
+    if ($dedupAccountIds !== null) {
+      foreach ($dedupAccountIds as $accountId) {
+        $args[] = '--dedup-account-id';
+        $args[] = (string)$accountId;
+      }
+    }
+  }
+  return $args;
+}
+
+/**
+ * Returns the token under which an incremental sync records its checkpoint
+ * updates as pending (see banksync/checkpoints.py), or null if the request is
+ * not incremental or there is no state directory.
+ */
+function new_checkpoint_token($incremental) {
+  if (!$incremental || BANKSYNC_STATE_DIR === null) {
+    return null;
+  }
+  return bin2hex(random_bytes(16));
+}
+
+/**
+ * Converts the rows a script wrote in one of the row output formats to the
+ * 'data' of a result. NDJSON is plain ASCII and returned as is, protobuf is
+ * base64-encoded. Returns null if the account has no transactions.
+ */
+function rows_result_data($rowData, $outputFormat) {
+  if ($rowData === '') {
+    return null;
+  }
+  return $outputFormat === 'protobuf' ? base64_encode($rowData) : $rowData;
+}
+
+/** Logs the timings and counters a script wrote to $metricsFile (see banksync/metrics.py). */
+function log_metrics($scriptName, $metricsFile, $exitCode) {
+  $metrics = @file_get_contents($metricsFile);
+  if ($metrics === false || trim($metrics) === '') {
+    return;
+  }
+  error_log('Banksync metrics for ' . $scriptName . ' (exit code ' . $exitCode . '): ' . trim($metrics));
+}
+
+/**
+ * Runs a banksync script, on the warm worker if one is configured and
+ * otherwise as a fresh Python process. Returns the exit code; $command
+ * receives a description of what was run for logging. The metrics of the run
+ * are always logged, also in production mode.
+ */
+function run_script($scriptName, $args, $stdin, &$stdout=null, &$stderr=null, &$command=null) {
+  $metricsFile = make_tempfile();
+  $args = array_merge($args, ['--metrics-file', $metricsFile]);
+  $exitCode = run_script_process($scriptName, $args, $stdin, $stdout, $stderr, $command);
+  log_metrics($scriptName, $metricsFile, $exitCode);
+  return $exitCode;
+}
+
+function run_script_process($scriptName, $args, $stdin, &$stdout=null, &$stderr=null, &$command=null) {
+  if (BANKSYNC_WORKER_SOCKET !== null) {
+    $command = 'worker:' . $scriptName . ' ' . implode(' ', array_map('escapeshellarg', $args));
+    $exitCode = run_worker_job(BANKSYNC_WORKER_SOCKET, $scriptName, $args, $stdin, $stdout, $stderr);
+    if ($exitCode !== null) {
+      return $exitCode;
+    }
+    // The job never reached the worker, so it is safe to run it here.
+    error_log('Banksync worker unavailable, falling back to a subprocess.');
+  }
+
+  $command = implode(' ', array_merge(
+    [PYTHON_EXECUTABLE, escapeshellarg(PYTHON_SCRIPT_DIR . '/' . $scriptName . '.py')],
+    array_map('escapeshellarg', $args)
+  ));
+  return run_process($command, PYTHON_SCRIPT_DIR, $stdin, $stdout, $stderr);
+}
+
+// Assumes valid input, runs on multiple accounts.
+// All accounts are exported from a single session, so there is only one login.
+function run_sparkasse($bankUrl, $loginName, $loginPassword, $fromStr, $toStr, $accountIndices, $checkpointToken, $dedupStorageId, $dedupAccountIds, $outputFormat, $verbose) {
+  $scriptArgs = array_merge([
+    '--base', $bankUrl,
+    '--from', $fromStr,
+    '--to', $toStr,
+    '--format', $outputFormat,
+  ], state_args($checkpointToken, $dedupStorageId, $dedupAccountIds));
   if ($verbose) {
     $scriptArgs[] = '-v';
   }
-  $scriptCommand = implode(' ', $scriptArgs);
+
+  $tempFiles = [];
+  foreach ($accountIndices as $accountIndex) {
+    $tmp = make_tempfile();
+    $tempFiles[] = $tmp;
+    // One output file per account, in the order of the indices.
+    $scriptArgs[] = '--output';
+    $scriptArgs[] = $tmp;
+  }
 
   // Call Python script.
-  error_log('Calling script: ' . $scriptCommand);
-  $scriptInput = $loginName . "\n" . $loginPassword . "\n" . $accountIndex . "\n";
-  $exitCode = run_process($scriptCommand, PYTHON_SCRIPT_DIR, $scriptInput, $stdout, $stderr);
+  error_log('Calling script: ' . PYTHON_SCRIPT_SPARKASSE . ' ' . implode(' ', $scriptArgs));
+  $scriptInput = $loginName . "\n" . $loginPassword . "\n" . implode(',', $accountIndices) . "\n";
+  $exitCode = run_script(PYTHON_SCRIPT_SPARKASSE, $scriptArgs, $scriptInput, $stdout, $stderr, $scriptCommand);
 
-  if ($exitCode !== 0 || empty($stdout)) {
+  if ($exitCode !== 0) {
     return [
       'error' => trim($stdout) ?: 'An unknown error occured! Unfortunately we do not know more.',
-      'errorDetails' => 'Account index: ' . $accountIndex .
+      'errorDetails' => 'Account indices: ' . implode(', ', $accountIndices) .
           "\nExit code: " . $exitCode .
           (DEBUG_MODE ? "\nCommand: " . $scriptCommand . "\n" . $stderr : ''),
     ];
   }
 
-  $csvData = $stdout;
-  if (trim($stdout) === EMPTY_RESULT_PLACEHOLDER) {
-    // Successful, but no transactions exist in this account. Return null.
-    $csvData = null;
-  }
-
-  // JSON silently fails for invalid characters, so check early to avoid
-  // zeroing out the entire response later.
-  if (!json_encode([$csvData])) {
-    return [
-      'error' => 'An error occured trying to encode the exported file to JSON!',
-      'errorDetails' => 'The server\'s character encoding settings may be wrong.',
+  $results = [];
+  foreach ($tempFiles as $tmp) {
+    $csvData = file_get_contents($tmp);
+    if ($csvData !== false && $outputFormat !== 'csv') {
+      $results[] = [
+        'data' => rows_result_data($csvData, $outputFormat),
+        'log' => (DEBUG_MODE ? $stderr : ''),
+      ];
+      continue;
+    }
+    if ($csvData === false || $csvData === '') {
+      return [
+        'error' => 'An error occured after exporting the transactions!',
+        'errorDetails' => 'Could not read temporary file.' . (DEBUG_MODE ? "\n\n" . $stderr : ''),
+      ];
+    }
+    if (trim($csvData) === EMPTY_RESULT_PLACEHOLDER) {
+      // Successful, but no transactions exist in this account. Return null.
+      $csvData = null;
+    }
+    // JSON silently fails for invalid characters, so check early to avoid
+    // zeroing out the entire response later.
+    if (!json_encode([$csvData])) {
+      return [
+        'error' => 'An error occured trying to encode the exported file to JSON!',
+        'errorDetails' => 'The server\'s character encoding settings may be wrong.',
+      ];
+    }
+    $results[] = [
+      'data' => $csvData,
+      'log' => (DEBUG_MODE ? $stderr : ''),
     ];
   }
-
-  return [
-    'data' => $csvData,
-    'log' => (DEBUG_MODE ? $stderr : ''),
-  ];
+  return $results;
 }
 
 // Assumes valid input, runs on multiple accounts.
-function run_dkb($unusedBankUrl, $loginName, $loginPassword, $fromStrIso, $accountIndices, $verbose) {
-  if (count($accountIndices) > 1) {
-    return [
-      'error' => 'Importing multiple accounts is not supported yet for DKB! ' . 
-                 'Please open an issue on GitHub if you need this feature.',
-    ];
-  }
-
-  $scriptArgs = [
-    PYTHON_EXECUTABLE,
-    escapeshellarg(PYTHON_SCRIPT_DKB),
-    $verbose ? '--verbose' : '',
+// All accounts are exported from a single browser session, so the captcha and
+// MFA login only happen once.
+function run_dkb($unusedBankUrl, $loginName, $loginPassword, $fromStrIso, $accountIndices, $checkpointToken, $dedupStorageId, $dedupAccountIds, $outputFormat, $verbose) {
+  $scriptArgs = array_merge([
     // DKB's login requires solving a Friendly Captcha in a real browser.
     // On a headless server, run it inside a virtual framebuffer (xvfb).
     '--captcha-xvfb',
-    '--username', escapeshellarg($loginName),
-    '--from-date', escapeshellarg($fromStrIso),
-  ];
+    '--username', $loginName,
+    '--from-date', $fromStrIso,
+    '--format', $outputFormat,
+  ], state_args($checkpointToken, $dedupStorageId, $dedupAccountIds));
+  // Lease a pre-launched browser if the pool manager (browser_pool.py) runs.
+  if (BANKSYNC_STATE_DIR !== null && is_dir(BANKSYNC_STATE_DIR . '/browser-pool')) {
+    $scriptArgs[] = '--browser-pool';
+    $scriptArgs[] = BANKSYNC_STATE_DIR . '/browser-pool';
+  }
+  // Keep the browser's caches between syncs if the folder was created.
+  if (BANKSYNC_STATE_DIR !== null && is_dir(BANKSYNC_STATE_DIR . '/profile-cache')) {
+    $scriptArgs[] = '--profile-cache';
+    $scriptArgs[] = BANKSYNC_STATE_DIR . '/profile-cache';
+  }
+  // Reuse the user's login of an earlier sync if the folder was created.
+  if (BANKSYNC_STATE_DIR !== null && is_dir(BANKSYNC_STATE_DIR . '/tokens')) {
+    $scriptArgs[] = '--token-store';
+    $scriptArgs[] = BANKSYNC_STATE_DIR . '/tokens';
+  }
+  if ($verbose) {
+    $scriptArgs[] = '--verbose';
+  }
 
   $tempFiles = [];
   foreach ($accountIndices as $accountIndex) {
     $tmp = make_tempfile();
     $tempFiles[] = $tmp;
-    // Append 1 pair of index + output file per account. Untested for >1.
+    // Append 1 pair of index + output file per account.
     $scriptArgs = array_merge($scriptArgs, [
-      '--account-index', escapeshellarg($accountIndex),
-      '--output', escapeshellarg($tmp),
+      '--account-index', (string)$accountIndex,
+      '--output', $tmp,
     ]);
   }
 
-  $scriptCommand = implode(' ', $scriptArgs);
-  $redactedScriptCommand = str_replace($loginName, '***', $scriptCommand);
-
   // Call Python script.
-  error_log('Calling script: ' . $redactedScriptCommand);
+  error_log('Calling script: ' . PYTHON_SCRIPT_DKB . ' ' .
+      str_replace($loginName, '***', implode(' ', $scriptArgs)));
   $scriptInput = $loginPassword . "\n";
-  $exitCode = run_process($scriptCommand, PYTHON_SCRIPT_DIR, $scriptInput, $stdout, $stderr);
+  $exitCode = run_script(PYTHON_SCRIPT_DKB, $scriptArgs, $scriptInput, $stdout, $stderr, $scriptCommand);
+  $redactedScriptCommand = str_replace($loginName, '***', $scriptCommand);
   $scriptLog = $stdout . "\n" . $stderr;
 
   if ($exitCode !== 0) {
@@ -138,6 +351,13 @@ function run_dkb($unusedBankUrl, $loginName, $loginPassword, $fromStrIso, $accou
         'errorDetails' => 'Could not read temporary file.',
       ];
     }
+    if ($outputFormat !== 'csv') {
+      $results[] = [
+        'data' => rows_result_data($csvData, $outputFormat),
+        'log' => (DEBUG_MODE ? $scriptLog : ''),
+      ];
+      continue;
+    }
     // JSON silently fails for invalid characters, so check early to avoid
     // zeroing out the entire response later.
     if (!json_encode([$csvData])) {
@@ -165,6 +385,14 @@ Flight::route('POST /banksync', function() {
   $loginPassword = (string)$data->loginPassword;
   $maxTransactionAge = (int)$data->maxTransactionAge;
   $accountIndices = $data->accountIndices;
+  // Only return transactions that were not returned by a previous sync.
+  $incremental = (bool)$data->incremental;
+  // Optional: id of the user's stored database to drop already imported rows.
+  $dedupStorageId = $data->dedupStorageId ?: null;
+  // Optional: ids of the local accounts that the accounts are imported into.
+  $dedupAccountIds = $data->dedupAccountIds ?: null;
+  // Optional: 'ndjson' or 'protobuf' to get ImportedRow records instead of CSV.
+  $outputFormat = $data->outputFormat ?: 'csv';
   $verbose = $data->verbose;
   
   // Validate input.
@@ -184,6 +412,27 @@ Flight::route('POST /banksync', function() {
       return;
     }
   }
+  if ($dedupStorageId !== null && (!is_string($dedupStorageId)
+      || !preg_match('/^[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}$/', $dedupStorageId))) {
+    Flight::json(['error' => 'Invalid storage id!']);
+    return;
+  }
+  if ($dedupAccountIds !== null) {
+    if (!is_array($dedupAccountIds) || count($dedupAccountIds) !== count($accountIndices)) {
+      Flight::json(['error' => 'Invalid dedup account ids!']);
+      return;
+    }
+    foreach ($dedupAccountIds as $accountId) {
+      if (!is_int($accountId) || $accountId < 0) {
+        Flight::json(['error' => 'Invalid dedup account ids!']);
+        return;
+      }
+    }
+  }
+  if (!in_array($outputFormat, OUTPUT_FORMATS, true)) {
+    Flight::json(['error' => 'Unsupported output format!']);
+    return;
+  }
 
   // Infer and format dates as required by Python script.
   $tz = new DateTimeZone('Europe/Berlin');
@@ -199,22 +448,20 @@ Flight::route('POST /banksync', function() {
   // Note that the client assumes that $results ALWAYS has the same length as
   // $accountIndices and that entries correspond to the input accordingly!
   $results = [];
+  $checkpointToken = new_checkpoint_token($incremental);
 
   switch ($bankType) {
     case 'sparkasse':
-      foreach($accountIndices as $accountIndex) {
-        $result = run_sparkasse($bankUrl, $loginName, $loginPassword, $fromStr, $toStr, $accountIndex, $verbose);
-        if (isset($result['error'])) {
-          // Immediately abort on error, the client cannot handle partial errors.
-          Flight::json($result);
-          return;
-        }
-        $results[] = $result;
+      $results = run_sparkasse($bankUrl, $loginName, $loginPassword, $fromStr, $toStr, $accountIndices, $checkpointToken, $dedupStorageId, $dedupAccountIds, $outputFormat, $verbose);
+      if (isset($results['error'])) {
+        // The client cannot handle partial errors.
+        Flight::json($results);
+        return;
       }
       break;
     
     case 'dkb':
-      $results = run_dkb($bankUrl, $loginName, $loginPassword, $fromStrIso, $accountIndices, $verbose);
+      $results = run_dkb($bankUrl, $loginName, $loginPassword, $fromStrIso, $accountIndices, $checkpointToken, $dedupStorageId, $dedupAccountIds, $outputFormat, $verbose);
       if (isset($results['error'])) {
         Flight::json($results);
         return;
@@ -227,8 +474,57 @@ Flight::route('POST /banksync', function() {
       return;
   }
 
-  Flight::json([
+  $response = [
     'success' => true,
     'results' => $results,
-  ]);
+  ];
+  if ($checkpointToken !== null) {
+    // To be sent back to /banksync/checkpoint once the results were imported.
+    $response['checkpointToken'] = $checkpointToken;
+  }
+  Flight::json($response);
+});
+
+// Confirms which results of an incremental sync the client imported, so that
+// the next incremental sync continues after them (see banksync/checkpoints.py).
+Flight::route('POST /banksync/checkpoint', function() {
+  $data = Flight::request()->data;
+  $checkpointToken = $data->checkpointToken;
+  $accountIndices = $data->accountIndices;
+
+  if (BANKSYNC_STATE_DIR === null) {
+    Flight::json(['error' => 'Checkpoints are not enabled!']);
+    return;
+  }
+  if (!is_string($checkpointToken) || !preg_match('/^[0-9a-f]{32}$/', $checkpointToken)) {
+    Flight::json(['error' => 'Invalid checkpoint token!']);
+    return;
+  }
+  if (!is_array($accountIndices)) {
+    Flight::json(['error' => 'Incomplete request!']);
+    return;
+  }
+  $scriptArgs = [
+    'commit',
+    '--checkpoint-dir', BANKSYNC_STATE_DIR . '/checkpoints',
+    '--token', $checkpointToken,
+  ];
+  foreach ($accountIndices as $i) {
+    if (!is_int($i)) {
+      Flight::json(['error' => 'Invalid account index!']);
+      return;
+    }
+    $scriptArgs[] = '--account-index';
+    $scriptArgs[] = (string)$i;
+  }
+
+  $exitCode = run_script_process(PYTHON_SCRIPT_CHECKPOINTS, $scriptArgs, '', $stdout, $stderr);
+  if ($exitCode !== 0) {
+    Flight::json([
+      'error' => trim($stdout) ?: 'Could not commit the checkpoints!',
+      'errorDetails' => DEBUG_MODE ? $stderr : '',
+    ]);
+    return;
+  }
+  Flight::json(['success' => true]);
 });
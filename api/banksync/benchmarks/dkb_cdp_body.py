@@ -0,0 +1,175 @@
+#!/usr/bin/python3
+"""
+Compares time and peak memory of reading large DKB responses from the browser.
+
+- "envelope": the previous implementation, which had the page JSON.stringify
+              the whole result including the body, so Python decoded the CDP
+              message, then the envelope, then the body's JSON.
+- "chunked":  DkbBrowser.request, which gets only the metadata in the
+              envelope and reads the body back in chunks of
+              dkb_captcha.BODY_CHUNK_CHARS, each as a plain string.
+
+There is no browser: a stand-in page answers the evaluations with the CDP
+messages Chrome would send, which are prepared before measuring. So measured
+is the Python side of the bridge, plus --rtt-ms per CDP round trip: up to the
+response's text ("bridge"), and including the parsed JSON of
+dkb_via_api._parse ("total"), which dominates the peak memory of both. Also
+reported is the largest CDP message. The payloads are synthetic transaction
+pages (see synthetic.py) of the given sizes. Peak memory is measured with
+tracemalloc.
+
+    python dkb_cdp_body.py --sizes 2,8,32 --rtt-ms 1
+"""
+from __future__ import annotations
+
+import argparse
+import gc
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+import dkb_via_api  # noqa: E402
+from dkb_captcha import BODY_CHUNK_CHARS, DkbBrowser, _Response  # noqa: E402
+from synthetic import make_dkb_transactions  # noqa: E402
+
+CONTENT_TYPE = "application/vnd.api+json"
+
+
+def _message(value: str) -> bytes:
+    """A CDP Runtime.evaluate response returning a string, as sent by Chrome."""
+    result = {"id": 1, "result": {"result": {"type": "string", "value": value}}}
+    return json.dumps(result).encode("utf-8")
+
+
+def _receive(message: bytes) -> str:
+    """What the CDP client does with a message: decode it as JSON."""
+    return json.loads(message)["result"]["result"]["value"]
+
+
+class _Loop:
+    def run_until_complete(self, result):
+        return result
+
+
+class _Page:
+    """Stand-in for the DKB page, with a fetch that returns `body`.
+
+    Mirrors dkbResult in dkb_captcha.py. The synthetic bodies have no
+    characters outside the BMP, so Python's string length is the JS one.
+    """
+
+    def __init__(self, body: str, rtt: float):
+        self.rtt = rtt
+        self.legacy = _message(json.dumps({"status": 200, "body": body, "ct": CONTENT_TYPE}))
+        chunks = [body[i : i + BODY_CHUNK_CHARS] for i in range(0, len(body), BODY_CHUNK_CHARS)]
+        if len(chunks) > 1:
+            meta = {"status": 200, "body": None, "ct": CONTENT_TYPE, "bodyId": 1}
+            meta.update(chunks=len(chunks), size=len(body))
+        else:
+            meta, chunks = {"status": 200, "body": body, "ct": CONTENT_TYPE}, []
+        self.meta = _message(json.dumps(meta))
+        self.chunks = [_message(chunk) for chunk in chunks]
+        self.next_chunk = 0
+
+    def evaluate(self, script: str, await_promise: bool = False, return_by_value: bool = True):
+        """The fetch of the await transport."""
+        time.sleep(self.rtt)
+        self.next_chunk = 0
+        return _receive(self.meta)
+
+    def read_chunk(self) -> str:
+        time.sleep(self.rtt)
+        self.next_chunk += 1
+        return _receive(self.chunks[self.next_chunk - 1])
+
+
+class _Cdp:
+    def __init__(self, page: _Page):
+        self.page = page
+        self.loop = _Loop()
+
+    def evaluate(self, expression: str) -> str:
+        """Only used to read chunks."""
+        return self.page.read_chunk()
+
+
+def envelope(page: _Page) -> _Response:
+    time.sleep(page.rtt)
+    result = json.loads(_receive(page.legacy))
+    return _Response(result["status"], result["body"], result["ct"])
+
+
+def chunked(page: _Page) -> _Response:
+    browser = DkbBrowser()
+    browser.cdp = _Cdp(page)
+    return browser.request("GET", "/accounts/accounts/1/transactions")
+
+
+VARIANTS = {"envelope": envelope, "chunked": chunked}
+
+
+def make_body(size: int) -> str:
+    """A transactions page of about `size` bytes."""
+    sample = len(json.dumps({"data": make_dkb_transactions(100)})) / 100
+    return json.dumps({"data": make_dkb_transactions(max(1, int(size / sample)))})
+
+
+def max_message(name: str, page: _Page) -> int:
+    if name == "envelope":
+        return len(page.legacy)
+    return max(len(message) for message in [page.meta, *page.chunks])
+
+
+def measure(fn, page: _Page, repeat: int) -> tuple[float, int]:
+    """Median seconds and peak traced bytes of one call."""
+    fn(page)  # Warm-up.
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        fn(page)
+        times.append(time.perf_counter() - start)
+    gc.collect()
+    tracemalloc.start()
+    fn(page)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return statistics.median(times), peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", default="2,8,32", help="Comma-separated body sizes in MB.")
+    parser.add_argument("--rtt-ms", type=float, default=1.0, help="Latency of a CDP round trip.")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(
+        f"{'MB':>6} {'chunks':>6} {'variant':<9} {'max msg MB':>10} {'bridge s':>8} "
+        f"{'bridge MB':>9} {'total s':>8} {'total MB':>8}"
+    )
+    for size in (float(s) for s in args.sizes.split(",")):
+        body = make_body(int(size * 2**20))
+        page = _Page(body, args.rtt_ms / 1000)
+        if envelope(page).text != chunked(page).text:
+            raise RuntimeError("The variants return different responses.")
+        for name, fn in VARIANTS.items():
+            bridge_seconds, bridge_peak = measure(fn, page, args.repeat)
+            total_seconds, total_peak = measure(
+                lambda page: dkb_via_api._parse(fn(page)), page, args.repeat
+            )
+            print(
+                f"{len(body) / 2**20:>6.1f} {len(page.chunks):>6} {name:<9} "
+                f"{max_message(name, page) / 2**20:>10.1f} {bridge_seconds:>8.3f} "
+                f"{bridge_peak / 2**20:>9.1f} {total_seconds:>8.3f} {total_peak / 2**20:>8.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
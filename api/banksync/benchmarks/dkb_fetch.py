@@ -0,0 +1,113 @@
+#!/usr/bin/python3
+"""
+Measures bytes transferred and peak memory of fetching DKB transactions.
+
+Runs dkb_via_api.load_transactions against an in-memory stand-in for the DKB
+API that holds one synthetic account with many transactions, in three server
+behaviours:
+
+- "full":     no date filter and no pagination, i.e. everything in one
+              response. This is what every sync downloaded before the date
+              bound was pushed to the server.
+- "filtered": the server applies the booking date filter and paginates.
+- "paged":    the server ignores the filter but paginates, so the client has
+              to stop early once a page is entirely older than --from-date.
+
+Bytes are the sizes of the response bodies; peak memory is measured with
+tracemalloc over fetching and parsing.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+from datetime import date, timedelta
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+import dkb_via_api  # noqa: E402
+from dkb_captcha import _Response  # noqa: E402
+from synthetic import make_dkb_transactions  # noqa: E402
+
+ACCOUNT_ID = "synthetic-account"
+
+
+class FakeDkbApi:
+    """Serves transaction pages like DKB's JSON:API, counting bytes sent."""
+
+    def __init__(self, transactions: list[dict], page_size: int | None, honors_filter: bool):
+        self.transactions = transactions
+        self.page_size = page_size
+        self.honors_filter = honors_filter
+        self.bytes_sent = 0
+        self.requests = 0
+
+    def request(self, method: str, path: str, data=None, json_body=None) -> _Response:
+        parts = urlsplit(path)
+        query = {k: v[0] for k, v in parse_qs(parts.query).items()}
+        transactions = self.transactions
+        from_date = query.get("filter[bookingDate][GE]")
+        if self.honors_filter and from_date:
+            transactions = [
+                t for t in transactions if t["attributes"]["bookingDate"] >= from_date
+            ]
+        body: dict = {}
+        if self.page_size:
+            page = int(query.get("page[number]", "0"))
+            start = page * self.page_size
+            body["data"] = transactions[start : start + self.page_size]
+            if start + self.page_size < len(transactions):
+                query["page[number]"] = str(page + 1)
+                body["links"] = {"next": "/api" + parts.path + "?" + urlencode(query)}
+        else:
+            body["data"] = transactions
+        text = json.dumps(body)
+        self.bytes_sent += len(text.encode("utf-8"))
+        self.requests += 1
+        return _Response(200, text, "application/vnd.api+json")
+
+    def request_many(self, calls: list[dict]) -> list[_Response]:
+        return [self.request(**call) for call in calls]
+
+
+def run_scenario(name: str, api: FakeDkbApi, from_date: str) -> None:
+    dkb_via_api.browser = api
+    tracemalloc.start()
+    start = time.perf_counter()
+    (transactions,) = list(dkb_via_api.load_transactions([ACCOUNT_ID], 1, from_date))
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(
+        f"{name:<9} {api.requests:>8} {api.bytes_sent / 1e6:>10.2f} "
+        f"{peak / 1e6:>10.1f} {elapsed * 1000:>9.0f} {len(transactions):>13}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--transactions", type=int, default=50000)
+    parser.add_argument("--years", type=int, default=10, help="Age of the oldest transaction.")
+    parser.add_argument("--window-days", type=int, default=90, help="maxTransactionAge.")
+    parser.add_argument("--page-size", type=int, default=500)
+    args = parser.parse_args()
+
+    transactions = make_dkb_transactions(args.transactions, days=args.years * 365)
+    from_date = (date.today() - timedelta(days=args.window_days)).isoformat()
+    print(
+        f"{args.transactions} transactions over {args.years} years, "
+        f"exporting since {from_date}, page size {args.page_size}\n"
+    )
+    print(f"{'scenario':<9} {'requests':>8} {'MB sent':>10} {'peak MB':>10} {'time ms':>9} {'transactions':>13}")
+    run_scenario("full", FakeDkbApi(transactions, None, False), from_date)
+    run_scenario("filtered", FakeDkbApi(transactions, args.page_size, True), from_date)
+    run_scenario("paged", FakeDkbApi(transactions, args.page_size, False), from_date)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/python3
+"""
+Measures the effect of the resource policy and the profile cache on the DKB
+login page.
+
+Opens the real login page (https://banking.dkb.de/login) in a fresh browser
+and waits until the Friendly Captcha widget is ready to be clicked, without
+solving it. With --compare policy (the default), alternately with and without
+the resource policy:
+
+- "off":     everything is loaded, like a normal browser. The requests are
+             still counted through the same CDP connection, but none is
+             blocked.
+- "default": resource_policy.ResourcePolicy(), i.e. images, fonts, the
+             consent manager, trackers and other third parties are blocked.
+
+With --compare profile-cache, alternately with a fresh profile ("cold") and
+with a profile of a ProfileCache in a temporary directory ("warm"), which is
+filled by an unmeasured run first. Both load everything (policy "off"), so
+that the cache is the only difference.
+
+Reported are the medians of the seconds until the login page is loaded and
+until the captcha is ready (both from the browser being ready), the number of
+requests, how many were blocked, and the KiB received. Needs Chrome and
+network access to DKB.
+
+    python dkb_login_page.py --runs 5 --xvfb
+    python dkb_login_page.py --runs 5 --xvfb --compare profile-cache
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+import metrics  # noqa: E402
+from dkb_captcha import DkbBrowser  # noqa: E402
+from resource_policy import ResourcePolicy  # noqa: E402
+
+POLICIES = {"off": ResourcePolicy.allow_all(), "default": ResourcePolicy()}
+
+
+class _LoginPageBrowser(DkbBrowser):
+    """Stops once the captcha widget is ready, without solving it."""
+
+    def _solve_captcha(self) -> None:
+        self._wait_for_widget()
+        self._mark_startup("captcha_ready")
+
+
+def run_once(
+    args: argparse.Namespace, policy: ResourcePolicy, profile_cache_dir: str | None = None
+) -> dict:
+    metrics.reset()
+    browser = _LoginPageBrowser(
+        headless=args.headless,
+        xvfb=args.xvfb,
+        binary_location=args.chrome_binary,
+        resource_policy=policy,
+        profile_cache_dir=profile_cache_dir,
+    )
+    with browser:
+        pass
+    captcha = next(span for span in metrics.run.spans if span["name"] == "captcha")
+    if not captcha.get("resource_policy"):
+        raise RuntimeError("The network filter could not be attached to the browser.")
+    browser_ready = browser.startup_timings["browser"]
+    return {
+        "login_page": browser.startup_timings["login_page"] - browser_ready,
+        "captcha_ready": browser.startup_timings["captcha_ready"] - browser_ready,
+        "requests": captcha["page_requests"],
+        "blocked": captcha["page_blocked"],
+        "kib": captcha["page_bytes"] / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--compare", choices=["policy", "profile-cache"], default="policy")
+    parser.add_argument("--runs", type=int, default=3, help="Runs per variant.")
+    parser.add_argument("--xvfb", action="store_true")
+    parser.add_argument("--headless", action="store_true")
+    parser.add_argument("--chrome-binary", default=os.environ.get("FT_CHROME_BINARY"))
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="dkb_profile_cache_") as profile_cache_dir:
+        if args.compare == "policy":
+            variants = {name: (policy, None) for name, policy in POLICIES.items()}
+        else:
+            variants = {
+                "cold": (POLICIES["off"], None),
+                "warm": (POLICIES["off"], profile_cache_dir),
+            }
+            run_once(args, POLICIES["off"], profile_cache_dir)
+
+        results: dict[str, list[dict]] = {name: [] for name in variants}
+        # Alternate the variants, so that both see the same network conditions.
+        for _ in range(args.runs):
+            for name, (policy, cache_dir) in variants.items():
+                results[name].append(run_once(args, policy, cache_dir))
+
+    print(
+        f"{'variant':<8} {'page s':>7} {'captcha s':>9} {'requests':>8} "
+        f"{'blocked':>7} {'KiB':>8}"
+    )
+    for name, runs in results.items():
+        median = {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+        print(
+            f"{name:<8} {median['login_page']:>7.2f} {median['captcha_ready']:>9.2f} "
+            f"{median['requests']:>8.0f} {median['blocked']:>7.0f} {median['kib']:>8.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+#!/usr/bin/python3
+"""
+Compares time and peak memory of the DKB export transform.
+
+- "legacy":    the previous implementation, which flattened every transaction's
+               full attribute tree into a DataFrame of all keys, derived
+               other.name and other.iban with two row-wise df.apply() calls and
+               only then selected and filtered the exported rows.
+- "extractor": dkb_via_api._to_export_frame, which extracts only the exported
+               attributes in one pass, drops pending and old transactions
+               before building the frame and picks the other party with
+               vectorized column operations.
+
+Both run on the same synthetic transactions (see synthetic.py); half of them
+are older than --from-date's default, like in a sync with a short window over a
+paged history. Peak memory is measured with tracemalloc, which also tracks
+the allocations of numpy and pandas.
+
+    python dkb_transform.py --count 100000
+"""
+from __future__ import annotations
+
+import argparse
+import gc
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+import dkb_via_api  # noqa: E402
+from synthetic import make_dkb_transactions  # noqa: E402
+
+
+def flatten_dict(d: dict, parent_key: str = "", sep: str = ".") -> dict:
+    """
+    Flattens a nested dictionary into a single level dictionary.
+    """
+    items = []
+    for k, v in d.items():
+        new_key = f"{parent_key}{sep}{k}" if parent_key else k
+        if isinstance(v, dict):
+            items.extend(flatten_dict(v, new_key, sep=sep).items())
+        else:
+            items.append((new_key, v))
+    return dict(items)
+
+
+def legacy(transactions: list[dict], from_date: str):
+    import pandas as pd
+
+    df = pd.DataFrame(
+        {"id": value["id"], **flatten_dict(value["attributes"])}
+        for value in transactions
+    )
+
+    def get_who(row) -> str:
+        return "debtor" if float(row["amount.value"]) > 0 else "creditor"
+
+    def get_other_name(row) -> str:
+        who = get_who(row)
+        return row[f"{who}.name"]
+
+    def get_other_iban(row) -> str:
+        who = get_who(row)
+        return row[f"{who}.{who}Account.iban"]
+
+    df["other.name"] = df.apply(get_other_name, axis=1)
+    df["other.iban"] = df.apply(get_other_iban, axis=1)
+
+    df_filtered = df[dkb_via_api.EXPORT_COLUMNS]
+    return df_filtered[
+        (df_filtered["status"] != "pending") & (df_filtered["valueDate"] >= from_date)
+    ]
+
+
+VARIANTS = {"legacy": legacy, "extractor": dkb_via_api._to_export_frame}
+
+
+def measure(fn, transactions: list[dict], from_date: str, repeat: int) -> tuple[float, int]:
+    """Median seconds and peak traced bytes of one call."""
+    fn(transactions, from_date)  # Warm-up, e.g. pandas' lazy imports.
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        fn(transactions, from_date)
+        times.append(time.perf_counter() - start)
+    gc.collect()
+    tracemalloc.start()
+    fn(transactions, from_date)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return statistics.median(times), peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--count", type=int, default=100_000)
+    parser.add_argument("--days", type=int, default=2 * 365)
+    parser.add_argument(
+        "--from-date",
+        default=(date.today() - timedelta(days=365)).isoformat(),
+        help="Only transactions since this date are exported.",
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    transactions = make_dkb_transactions(args.count, days=args.days)
+    expected = legacy(transactions, args.from_date).to_csv(index=False)
+    actual = dkb_via_api._to_export_frame(transactions, args.from_date).to_csv(index=False)
+    if actual != expected:
+        raise RuntimeError("The variants produce different exports.")
+
+    print(f"{args.count} transactions, exporting since {args.from_date}")
+    print(f"{'variant':<10} {'seconds':>8} {'peak MB':>8}")
+    for name, fn in VARIANTS.items():
+        seconds, peak = measure(fn, transactions, args.from_date, args.repeat)
+        print(f"{name:<10} {seconds:>8.2f} {peak / 2**20:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
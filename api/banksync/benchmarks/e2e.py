@@ -0,0 +1,296 @@
+#!/usr/bin/python3
+"""
+End-to-end throughput of the sync scripts against the local mock banks.
+
+For every data size, starts mock_sparkasse.py and mock_dkb.py with that many
+transactions per account and runs a full sync against each:
+
+- Sparkasse: sparkasse.py itself (login, account selection, search, CSV
+  download and transcoding to stdout).
+- DKB: the fetch/export path of dkb_via_api.py (login with MFA, account
+  listing, paginated transaction fetch, transform and CSV export). There is
+  no browser: API calls go straight to the mock over HTTP (ApiClient below).
+  With --dkb-api-transport auto, the calls after the login are issued by
+  transport.HttpTransport instead, seeded with ApiClient's cookies; adding
+  --dkb-waf-after N makes the mock reject it after N requests, to measure the
+  fallback to ApiClient.
+
+Each sync runs in its own process and writes its metrics (see metrics.py).
+Reported per phase are wall time, CPU time, the largest RSS of the process at
+the end of the phase and how much the phase grew it (summed over its spans),
+plus totals for the whole process, where the RSS is the peak of its life. Throttling sleeps of
+sparkasse.py are shown as their own phase.
+
+    python e2e.py --sizes 1000,10000,100000
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from http.cookiejar import CookieJar
+from urllib.error import HTTPError
+from urllib.parse import unquote, urlencode
+from urllib.request import HTTPCookieProcessor, Request, build_opener
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+BANKSYNC_DIR = os.path.dirname(BENCHMARK_DIR)
+
+
+class ApiClient:
+    """Stand-in for DkbBrowser that calls the (mock) API directly over HTTP.
+    It sends the Sec-Fetch-Site header of a browser, so the mock's WAF lets
+    it through."""
+
+    def __init__(self, base_url: str, max_concurrency: int = 4):
+        self.base_url = base_url
+        self.max_concurrency = max_concurrency
+        self.cookies = CookieJar()
+        self.opener = build_opener(HTTPCookieProcessor(self.cookies))
+        self.captcha_token = "mock-captcha-token"
+
+    def request(self, method: str, path: str, data=None, json_body=None):
+        from dkb_captcha import ApiError, _Response
+
+        headers = {"Accept": "application/json", "Sec-Fetch-Site": "same-origin"}
+        body = None
+        if json_body is not None:
+            body = json.dumps(json_body).encode("utf-8")
+            headers["Content-Type"] = "application/vnd.api+json"
+        elif data is not None:
+            body = urlencode(data).encode("utf-8")
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        for cookie in self.cookies:
+            if cookie.name == "__Host-xsrf":
+                headers["x-xsrf-token"] = unquote(cookie.value)
+        request = Request(self.base_url + path, data=body, headers=headers, method=method)
+        try:
+            with self.opener.open(request) as response:
+                text = response.read().decode("utf-8")
+                status, content_type = response.status, response.headers["Content-Type"]
+        except HTTPError as e:
+            raise ApiError(f"{method} {path} failed with status {e.code}") from e
+        return _Response(status, text, content_type or "")
+
+    def session_state(self) -> tuple[list[dict], str]:
+        cookies = [
+            {"name": c.name, "value": c.value, "domain": c.domain, "path": c.path}
+            for c in self.cookies
+        ]
+        return cookies, "Mozilla/5.0 (e2e benchmark)"
+
+    def request_many(self, calls: list[dict], max_concurrency: int | None = None):
+        with ThreadPoolExecutor(max_concurrency or self.max_concurrency) as executor:
+            futures = [executor.submit(self.request, **call) for call in calls]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append(e)
+        return results
+
+
+def dkb_client(args: argparse.Namespace) -> None:
+    """Runs the DKB login and export against the mock (in a child process)."""
+    sys.path.insert(0, BANKSYNC_DIR)
+    import dkb_via_api
+    import metrics
+    from transport import API_TRANSPORT_AUTO, select_transport
+
+    metrics.configure("dkb_via_api", args)
+    client = ApiClient(args.base, args.batch_size)
+    dkb_via_api.browser = dkb_via_api.transport = client
+    dkb_via_api.login("mock-user", "mock-password")
+    if args.api_transport == API_TRANSPORT_AUTO:
+        dkb_via_api.transport = select_transport(client, args.batch_size, base_url=args.base)
+    dkb_via_api.export_accounts(
+        list(range(args.accounts)),
+        [os.path.join(args.output_dir, f"account-{i}.csv") for i in range(args.accounts)],
+        args.from_date,
+        batch_size=args.batch_size,
+    )
+    dkb_via_api.logout()
+    metrics.flush(0)
+
+
+def start_server(script: str, size: int, accounts: int, days: int, extra: list[str]):
+    proc = subprocess.Popen(
+        [
+            sys.executable,
+            os.path.join(BENCHMARK_DIR, script),
+            "--accounts",
+            str(accounts),
+            "--transactions",
+            str(size),
+            "--days",
+            str(days),
+            *extra,
+        ],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    base_url = proc.stdout.readline().strip()
+    if not base_url:
+        proc.kill()
+        raise RuntimeError(f"{script} did not start")
+    return proc, base_url
+
+
+def run_client(command: list[str], stdin: str, metrics_file: str) -> dict:
+    """Runs a sync process and returns its metrics plus whole-process totals."""
+    env = {k: v for k, v in os.environ.items() if k != "FT_BANKSYNC_SOCKET"}
+    with tempfile.TemporaryFile() as stderr:
+        start = time.perf_counter()
+        proc = subprocess.Popen(
+            command + ["--metrics-file", metrics_file],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=stderr,
+            cwd=BANKSYNC_DIR,
+            env=env,
+        )
+        proc.stdin.write(stdin.encode("utf-8"))
+        proc.stdin.close()
+        _, status, usage = os.wait4(proc.pid, 0)
+        wall = time.perf_counter() - start
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        if proc.returncode != 0:
+            stderr.seek(0)
+            sys.stderr.write(stderr.read().decode("utf-8", errors="replace"))
+            raise RuntimeError(f"{command[1]} exited with {proc.returncode}")
+    with open(metrics_file, encoding="utf-8") as f:
+        record = json.load(f)
+    record["total"] = {
+        "wall": wall,
+        "cpu": usage.ru_utime + usage.ru_stime,
+        "rss_kb": usage.ru_maxrss,
+        "rss_growth_kb": None,
+    }
+    return record
+
+
+def print_record(bank: str, size: int, record: dict) -> None:
+    phases: dict[str, dict] = defaultdict(
+        lambda: {"wall": 0.0, "cpu": 0.0, "rss_kb": 0, "rss_growth_kb": 0}
+    )
+    for span in record["spans"]:
+        phase = phases[span["name"]]
+        phase["wall"] += span["duration"]
+        phase["cpu"] += span["cpu"]
+        if "rss_end_kb" in span:
+            phase["rss_kb"] = max(phase["rss_kb"], span["rss_end_kb"])
+            phase["rss_growth_kb"] += span["rss_end_kb"] - span["rss_start_kb"]
+    phases["total"] = record["total"]
+    for name, phase in phases.items():
+        growth = phase["rss_growth_kb"]
+        print(
+            f"{bank:<10} {size:>8} {name:<18} {phase['wall']:>8.2f} "
+            f"{phase['cpu']:>8.2f} {phase['rss_kb'] / 1024:>8.1f} "
+            + ("" if growth is None else f"{growth / 1024:>+9.1f}")
+        )
+    counters = " ".join(f"{k}={v}" for k, v in sorted(record["counters"].items()))
+    print(f"{'':<10} {'':>8} {counters}")
+
+
+def bench_sparkasse(size: int, args: argparse.Namespace, tmp: str) -> dict:
+    server, base_url = start_server("mock_sparkasse.py", size, 1, args.days, [])
+    try:
+        today = date.today()
+        return run_client(
+            [
+                sys.executable,
+                "sparkasse.py",
+                "--base",
+                base_url,
+                "--from",
+                (today - timedelta(days=args.days)).strftime("%d.%m.%Y"),
+                "--to",
+                today.strftime("%d.%m.%Y"),
+            ],
+            "mock-user\nmock-password\n0\n",
+            os.path.join(tmp, f"sparkasse-{size}.json"),
+        )
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def bench_dkb(size: int, args: argparse.Namespace, tmp: str) -> dict:
+    extra = ["--mfa-delay", "0"]
+    if args.dkb_waf_after is not None:
+        extra += ["--waf-after", str(args.dkb_waf_after)]
+    server, base_url = start_server("mock_dkb.py", size, args.dkb_accounts, args.days, extra)
+    try:
+        return run_client(
+            [
+                sys.executable,
+                os.path.join(BENCHMARK_DIR, "e2e.py"),
+                "dkb-client",
+                "--base",
+                base_url,
+                "--accounts",
+                str(args.dkb_accounts),
+                "--from-date",
+                (date.today() - timedelta(days=args.days)).isoformat(),
+                "--output-dir",
+                tmp,
+                "--api-transport",
+                args.dkb_api_transport,
+            ],
+            "",
+            os.path.join(tmp, f"dkb-{size}.json"),
+        )
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    subparsers = parser.add_subparsers(dest="command")
+    run_parser = subparsers.add_parser("run", help="Run the benchmark (default).")
+    for p in (parser, run_parser):
+        p.add_argument(
+            "--sizes",
+            default="1000,10000,100000",
+            help="Comma-separated numbers of transactions per account.",
+        )
+        p.add_argument("--days", type=int, default=3 * 365, help="Age of the oldest transaction.")
+        p.add_argument("--dkb-accounts", type=int, default=2)
+        p.add_argument("--banks", default="sparkasse,dkb", help="Comma-separated.")
+        p.add_argument("--dkb-api-transport", choices=["browser", "auto"], default="browser")
+        p.add_argument("--dkb-waf-after", type=int, help="See mock_dkb.py --waf-after.")
+
+    client_parser = subparsers.add_parser("dkb-client", help="Internal: the DKB sync.")
+    client_parser.add_argument("--base", required=True)
+    client_parser.add_argument("--accounts", type=int, required=True)
+    client_parser.add_argument("--from-date", required=True)
+    client_parser.add_argument("--output-dir", required=True)
+    client_parser.add_argument("--batch-size", type=int, default=4)
+    client_parser.add_argument("--api-transport", choices=["browser", "auto"], default="browser")
+    client_parser.add_argument("--metrics-file")
+    client_parser.add_argument("--metrics-fd", type=int)
+    args = parser.parse_args()
+
+    if args.command == "dkb-client":
+        return dkb_client(args)
+
+    benches = {"sparkasse": bench_sparkasse, "dkb": bench_dkb}
+    banks = args.banks.split(",")
+    print(f"{'bank':<10} {'size':>8} {'phase':<18} {'wall s':>8} {'cpu s':>8} {'rss MB':>8} {'+rss MB':>9}")
+    with tempfile.TemporaryDirectory(prefix="ft_e2e_") as tmp:
+        for size in (int(s) for s in args.sizes.split(",")):
+            for bank in banks:
+                print_record(bank, size, benches[bank](size, args, tmp))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/python3
+"""
+Checks the import time of the banksync entry points against a budget.
+
+The PHP API waits synchronously for the scripts, so their startup time adds
+directly to the latency of every sync. Each module is imported in a fresh
+interpreter with ``python -X importtime`` and its cumulative import time is
+compared to the budget in ``import_budgets.json``. Exits with status 1 if any
+budget is exceeded.
+
+Run from anywhere with the interpreter of the banksync venv:
+
+    /path/to/your/venv/bin/python benchmarks/import_time.py
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+SCRIPT_DIR = os.path.dirname(BENCHMARK_DIR)
+DEFAULT_BUDGET_FILE = os.path.join(BENCHMARK_DIR, "import_budgets.json")
+
+
+def measure_import_us(module: str) -> tuple[int, list[tuple[str, int]]]:
+    """Imports a module in a fresh interpreter.
+
+    Returns its cumulative import time in microseconds and the five most
+    expensive modules (by self time) that were imported along the way."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=SCRIPT_DIR,
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{proc.stderr}")
+
+    cumulative = None
+    self_times = []
+    for line in proc.stderr.splitlines():
+        # Format: "import time: <self us> | <cumulative us> | <indented name>"
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        name = name.strip()
+        self_times.append((name, int(self_us)))
+        if name == module:
+            cumulative = int(cumulative_us)
+    if cumulative is None:
+        raise RuntimeError(f"No import time reported for {module}")
+    self_times.sort(key=lambda entry: entry[1], reverse=True)
+    return cumulative, self_times[:5]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Checks the import time of the banksync entry points."
+    )
+    parser.add_argument(
+        "--budgets",
+        default=DEFAULT_BUDGET_FILE,
+        help="JSON file with the budgets (default: %(default)s).",
+    )
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        action="store_true",
+        help="Also print the most expensive imported modules.",
+    )
+    args = parser.parse_args()
+
+    with open(args.budgets) as f:
+        config = json.load(f)
+    runs = int(config.get("runs", 5))
+
+    failed = False
+    for module, budget_ms in config["budgets_ms"].items():
+        samples = []
+        for _ in range(runs):
+            cumulative_us, top_modules = measure_import_us(module)
+            samples.append(cumulative_us)
+        median_ms = statistics.median(samples) / 1000
+        ok = median_ms <= budget_ms
+        failed = failed or not ok
+        print(
+            f"{'OK  ' if ok else 'FAIL'} {module:<16} {median_ms:8.1f} ms "
+            f"(budget {budget_ms} ms, {runs} runs)"
+        )
+        if args.verbose or not ok:
+            for name, self_us in top_modules:
+                print(f"       {self_us / 1000:8.1f} ms  {name}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
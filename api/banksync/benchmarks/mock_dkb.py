@@ -0,0 +1,382 @@
+#!/usr/bin/python3
+"""
+Local stand-in for DKB's banking JSON API.
+
+Serves the endpoints dkb_via_api.py uses below /api: session setup, the
+captcha/password token exchange, the seal_one MFA challenge (approved after
+--mfa-delay seconds), the account listing, paginated transactions with the
+booking date filter, token refresh and revoke (which, like an OAuth token
+revocation, also invalidates the refresh tokens issued with the session).
+Accounts and transactions are
+synthetic (see synthetic.py) and can be scaled to 100k+ rows.
+
+Like the real API, it keeps a session in a cookie, requires the XSRF cookie to
+be echoed in an x-xsrf-token header on POSTs and only serves account data
+once the MFA login is completed. There is no captcha: any token is accepted.
+With --waf-after, it also plays DKB's WAF: requests without the Sec-Fetch-Site
+header that browsers send get a "503 Security Check" HTML page once that many
+of them were answered (0: all of them).
+
+    python mock_dkb.py --accounts 3 --transactions 100000
+
+prints the API base URL (ending in /api).
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import secrets
+import threading
+import time
+from dataclasses import dataclass
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+from synthetic import make_dkb_transactions
+
+SESSION_COOKIE = "mockdkbsession"
+XSRF_COOKIE = "__Host-xsrf"
+JSON_API = "application/vnd.api+json"
+
+
+@dataclass
+class _Session:
+    xsrf: str
+    authenticated: bool = False
+
+
+class MockDkb:
+    """The bank's state: synthetic accounts, sessions, MFA and tokens."""
+
+    def __init__(
+        self,
+        accounts: int,
+        transactions: int,
+        days: int,
+        page_size: int = 1000,
+        mfa_delay: float = 2.0,
+        seed: int = 0,
+        waf_after: int | None = None,
+    ):
+        newest = date.today()
+        self.accounts = {
+            f"mock-account-{i}": make_dkb_transactions(transactions, newest, days, seed=seed + i)
+            for i in range(accounts)
+        }
+        self.page_size = page_size
+        self.mfa_delay = mfa_delay
+        self.sessions: dict[str, _Session] = {}
+        # mfa_id -> session id; challenge id -> (mfa_id, time it was created).
+        self.mfas: dict[str, str] = {}
+        self.challenges: dict[str, tuple[str, float]] = {}
+        # Refresh token -> id of the session it was issued with.
+        self.refresh_tokens: dict[str, str] = {}
+        self.waf_after = waf_after
+        self.non_browser_requests = 0
+        self.lock = threading.Lock()
+
+
+class Handler(BaseHTTPRequestHandler):
+    server: "MockDkbServer"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def bank(self) -> MockDkb:
+        return self.server.bank
+
+    def _cookies(self) -> dict[str, str]:
+        cookies = {}
+        for cookie in (self.headers.get("Cookie") or "").split(";"):
+            name, _, value = cookie.strip().partition("=")
+            cookies[name] = value
+        return cookies
+
+    def _session(self) -> tuple[str, _Session] | tuple[None, None]:
+        sid = self._cookies().get(SESSION_COOKIE)
+        session = self.bank.sessions.get(sid or "")
+        return (sid, session) if session is not None else (None, None)
+
+    def _send(
+        self,
+        status: int,
+        data: object | None = None,
+        content_type: str = JSON_API,
+        headers: list[tuple[str, str]] | None = None,
+    ) -> None:
+        body = b"" if data is None else json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers or []:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, status: int, detail: str) -> None:
+        self._send(status, {"errors": [{"status": str(status), "detail": detail}]})
+
+    def _waf_rejects(self) -> bool:
+        if self.bank.waf_after is None or self.headers.get("Sec-Fetch-Site"):
+            return False
+        with self.bank.lock:
+            self.bank.non_browser_requests += 1
+            if self.bank.non_browser_requests <= self.bank.waf_after:
+                return False
+        body = b"<html><head><title>Security Check</title></head></html>"
+        self.send_response(503)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        return True
+
+    def do_GET(self):
+        if self._waf_rejects():
+            return
+        parts = urlsplit(self.path)
+        query = {k: v[0] for k, v in parse_qs(parts.query).items()}
+        path = parts.path.removeprefix("/api")
+        if path == "/session":
+            return self._new_session()
+        sid, session = self._session()
+        if session is None:
+            return self._error(401, "No session")
+        if path.startswith("/mfa/mfa/challenges/"):
+            return self._challenge(path.rsplit("/", 1)[1])
+        if path.startswith("/mfa/mfa/") and path.endswith("/methods"):
+            return self._send(
+                200,
+                {
+                    "data": [
+                        {
+                            "id": "method-1",
+                            "type": "mfa-method",
+                            "attributes": {
+                                "methodType": "seal_one",
+                                "deviceName": "Mock Phone",
+                                "enrolledAt": "2024-01-01T00:00:00Z",
+                            },
+                        }
+                    ]
+                },
+            )
+        if not session.authenticated:
+            return self._error(401, "Not logged in")
+        if path == "/accounts/accounts":
+            return self._send(
+                200,
+                {
+                    "data": [
+                        {"id": account_id, "type": "account", "attributes": {"iban": account_id}}
+                        for account_id in self.bank.accounts
+                    ]
+                },
+            )
+        prefix, _, account_id = path.rpartition("/accounts/accounts/")
+        account_id, _, rest = account_id.partition("/")
+        if not prefix and rest == "transactions" and account_id in self.bank.accounts:
+            return self._transactions(parts.path, account_id, query)
+        self._error(404, "Not found")
+
+    def do_POST(self):
+        parts = urlsplit(self.path)
+        path = parts.path.removeprefix("/api")
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length).decode("utf-8")
+        if self._waf_rejects():
+            return
+        sid, session = self._session()
+        if path == "/refresh":
+            # A refresh does not need the browser session.
+            return self._refresh({k: v[0] for k, v in parse_qs(raw).items()})
+        if session is None:
+            return self._error(401, "No session")
+        if self.headers.get("x-xsrf-token") != session.xsrf:
+            return self._error(403, "XSRF token mismatch")
+        if path == "/token":
+            return self._token(sid, session, {k: v[0] for k, v in parse_qs(raw).items()})
+        if path == "/mfa/mfa/challenges":
+            mfa_id = json.loads(raw)["data"]["attributes"]["mfaId"]
+            if self.bank.mfas.get(mfa_id) != sid:
+                return self._error(400, "Unknown MFA")
+            challenge_id = secrets.token_hex(8)
+            with self.bank.lock:
+                self.bank.challenges[challenge_id] = (mfa_id, time.monotonic())
+            return self._send(200, {"data": {"id": challenge_id, "type": "mfa-challenge"}})
+        if path == "/revoke":
+            with self.bank.lock:
+                self.bank.sessions.pop(sid, None)
+                for token, token_sid in list(self.bank.refresh_tokens.items()):
+                    if token_sid == sid:
+                        del self.bank.refresh_tokens[token]
+            return self._send(200, content_type="text/plain")
+        self._error(404, "Not found")
+
+    def _new_session(self) -> None:
+        sid, xsrf = secrets.token_hex(16), secrets.token_hex(16)
+        with self.bank.lock:
+            self.bank.sessions[sid] = _Session(xsrf=xsrf)
+        self._send(
+            200,
+            {},
+            "application/json",
+            [
+                ("Set-Cookie", f"{SESSION_COOKIE}={sid}; Path=/; HttpOnly"),
+                ("Set-Cookie", f"{XSRF_COOKIE}={xsrf}; Path=/"),
+            ],
+        )
+
+    def _token(self, sid: str, session: _Session, form: dict[str, str]) -> None:
+        grant_type = form.get("grant_type")
+        if grant_type == "banking_user_sca":
+            if not (form.get("username") and form.get("password") and form.get("captcha_token")):
+                return self._error(400, "Missing credentials")
+            mfa_id = secrets.token_hex(8)
+            with self.bank.lock:
+                self.bank.mfas[mfa_id] = sid
+            return self._send(
+                200,
+                {"access_token": secrets.token_hex(16), "mfa_id": mfa_id, "token_type": "Bearer"},
+                "application/json",
+            )
+        if grant_type == "banking_user_mfa":
+            mfa_id = form.get("mfa_id", "")
+            approved = any(
+                m == mfa_id and time.monotonic() - created >= self.bank.mfa_delay
+                for m, created in self.bank.challenges.values()
+            )
+            if self.bank.mfas.get(mfa_id) != sid or not approved:
+                return self._error(400, "MFA not completed")
+            session.authenticated = True
+            return self._send(200, self._new_tokens(sid), "application/json")
+        self._error(400, f"Unsupported grant type: {grant_type}")
+
+    def _refresh(self, form: dict[str, str]) -> None:
+        token = form.get("refresh_token", "")
+        if form.get("grant_type") != "refresh_token":
+            return self._error(400, "Unsupported grant type")
+        with self.bank.lock:
+            if token not in self.bank.refresh_tokens:
+                return self._error(400, "Invalid refresh token")
+            del self.bank.refresh_tokens[token]
+            sid = secrets.token_hex(16)
+            xsrf = secrets.token_hex(16)
+            self.bank.sessions[sid] = _Session(xsrf=xsrf, authenticated=True)
+        self._send(
+            200,
+            self._new_tokens(sid),
+            "application/json",
+            [
+                ("Set-Cookie", f"{SESSION_COOKIE}={sid}; Path=/; HttpOnly"),
+                ("Set-Cookie", f"{XSRF_COOKIE}={xsrf}; Path=/"),
+            ],
+        )
+
+    def _new_tokens(self, sid: str) -> dict:
+        refresh_token = secrets.token_hex(16)
+        with self.bank.lock:
+            self.bank.refresh_tokens[refresh_token] = sid
+        return {
+            "access_token": secrets.token_hex(16),
+            "refresh_token": refresh_token,
+            "token_type": "Bearer",
+            "expires_in": 300,
+        }
+
+    def _challenge(self, challenge_id: str) -> None:
+        challenge = self.bank.challenges.get(challenge_id)
+        if challenge is None:
+            return self._error(404, "Unknown challenge")
+        approved = time.monotonic() - challenge[1] >= self.bank.mfa_delay
+        self._send(
+            200,
+            {
+                "data": {
+                    "id": challenge_id,
+                    "type": "mfa-challenge",
+                    "attributes": {"verificationStatus": "processed" if approved else "processing"},
+                }
+            },
+        )
+
+    def _transactions(self, path: str, account_id: str, query: dict[str, str]) -> None:
+        transactions = self.bank.accounts[account_id]
+        from_date = query.get("filter[bookingDate][GE]")
+        if from_date:
+            # Sorted newest first, so the matches are a prefix.
+            end = 0
+            while end < len(transactions) and transactions[end]["attributes"]["bookingDate"] >= from_date:
+                end += 1
+            transactions = transactions[:end]
+        body: dict = {}
+        page_size = self.bank.page_size
+        if page_size:
+            page = int(query.get("page[number]", "0"))
+            start = page * page_size
+            body["data"] = transactions[start : start + page_size]
+            if start + page_size < len(transactions):
+                query["page[number]"] = str(page + 1)
+                body["links"] = {"next": path + "?" + urlencode(query)}
+        else:
+            body["data"] = transactions
+        self._send(200, body)
+
+
+class MockDkbServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, bank: MockDkb, port: int = 0):
+        super().__init__(("127.0.0.1", port), Handler)
+        self.bank = bank
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/api"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--port", type=int, default=0, help="Port to listen on; 0 picks a free one.")
+    parser.add_argument("--accounts", type=int, default=1)
+    parser.add_argument("--transactions", type=int, default=1000, help="Per account.")
+    parser.add_argument("--days", type=int, default=3 * 365, help="Age of the oldest transaction.")
+    parser.add_argument("--page-size", type=int, default=1000, help="0 disables pagination.")
+    parser.add_argument(
+        "--mfa-delay", type=float, default=2.0, help="Seconds until a challenge is approved."
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--waf-after",
+        type=int,
+        help="Reject requests that do not come from a browser after this many.",
+    )
+    args = parser.parse_args()
+
+    server = MockDkbServer(
+        MockDkb(
+            args.accounts,
+            args.transactions,
+            args.days,
+            page_size=args.page_size,
+            mfa_delay=args.mfa_delay,
+            seed=args.seed,
+            waf_after=args.waf_after,
+        ),
+        args.port,
+    )
+    # The first line of output is the base URL (read by benchmarks/e2e.py).
+    print(server.base_url, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,325 @@
+#!/usr/bin/python3
+"""
+Local stand-in for the Sparkasse online banking website.
+
+Serves just enough of the site for sparkasse.py to run end to end: the login
+form, the account overview (finanzuebersicht.html), the transactions page with
+its search form (umsaetze.html), the CSV-CAMT download (download.service) and
+logout. Accounts and transactions are synthetic (see synthetic.py) and can be
+scaled to 100k+ rows.
+
+    python mock_sparkasse.py --accounts 2 --transactions 100000
+
+prints the base URL to pass to sparkasse.py as --base. Any user name and
+password are accepted.
+"""
+from __future__ import annotations
+
+import argparse
+import csv
+import html
+import io
+import secrets
+import threading
+from datetime import date, datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+from synthetic import SPARKASSE_CAMT_COLUMNS, format_sparkasse_row, make_sparkasse_rows
+
+LOGIN_PATH = "/de/home/login-online-banking.html"
+OVERVIEW_PATH = "/de/home/onlinebanking/nbf/finanzuebersicht.html"
+TRANSACTIONS_PATH = "/de/home/onlinebanking/umsaetze/umsaetze.html"
+DOWNLOAD_PATH = "/de/home/services/download.service"
+LOGOUT_PATH = "/de/home/logout.html"
+SESSION_COOKIE = "mocksession"
+SERVER_FILE_ENCODING = "windows-1252"
+# Rows shown in the HTML table of a search result, like the real paginated list.
+HTML_TABLE_ROWS = 50
+
+_PAGE = """<!DOCTYPE html>
+<html lang="de"><head><meta charset="utf-8"><title>{title}</title></head>
+<body><div class="page">{body}</div></body></html>
+"""
+
+_LOGOUT_FORM = f"""
+<form action="{LOGOUT_PATH}" method="post" class="logout">
+  <input type="hidden" name="logoutAction" value="logout">
+  <input type="submit" value="Abmelden">
+</form>
+"""
+
+
+class MockSparkasse:
+    """The bank's state: synthetic accounts and logged-in sessions."""
+
+    def __init__(self, accounts: int, transactions: int, days: int, seed: int = 0):
+        self.newest = date.today()
+        self.accounts = [
+            make_sparkasse_rows(transactions, self.newest, days, seed=seed + i)
+            for i in range(accounts)
+        ]
+        self.sessions: set[str] = set()
+        self.lock = threading.Lock()
+
+
+class Handler(BaseHTTPRequestHandler):
+    server: "MockSparkasseServer"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def bank(self) -> MockSparkasse:
+        return self.server.bank
+
+    def _session(self) -> str | None:
+        for cookie in (self.headers.get("Cookie") or "").split(";"):
+            name, _, value = cookie.strip().partition("=")
+            if name == SESSION_COOKIE and value in self.bank.sessions:
+                return value
+        return None
+
+    def _send(
+        self,
+        status: int,
+        body: bytes = b"",
+        content_type: str = "text/html; charset=utf-8",
+        headers: dict[str, str] | None = None,
+    ) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _page(self, title: str, body: str) -> None:
+        self._send(200, _PAGE.format(title=title, body=body).encode("utf-8"))
+
+    def _redirect(self, path: str, headers: dict[str, str] | None = None) -> None:
+        self._send(302, headers={"Location": path, **(headers or {})})
+
+    def _form(self) -> dict[str, str]:
+        length = int(self.headers.get("Content-Length") or 0)
+        data = self.rfile.read(length).decode("utf-8")
+        return {k: v[0] for k, v in parse_qs(data, keep_blank_values=True).items()}
+
+    def _account(self, query: dict[str, str]) -> int | None:
+        try:
+            index = int(query.get("account", ""))
+        except ValueError:
+            return None
+        return index if 0 <= index < len(self.bank.accounts) else None
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        query = {k: v[0] for k, v in parse_qs(parts.query).items()}
+        if parts.path == LOGIN_PATH:
+            return self._login_page()
+        if self._session() is None:
+            return self._redirect(LOGIN_PATH)
+        if parts.path == OVERVIEW_PATH:
+            return self._overview_page()
+        account = self._account(query)
+        if account is None:
+            return self._send(404, b"Unknown account")
+        if parts.path == TRANSACTIONS_PATH:
+            return self._transactions_page(account, None, None)
+        if parts.path == DOWNLOAD_PATH:
+            return self._download(account, query.get("from", ""), query.get("to", ""))
+        self._send(404, b"Not found")
+
+    def do_POST(self):
+        parts = urlsplit(self.path)
+        query = {k: v[0] for k, v in parse_qs(parts.query).items()}
+        form = self._form()
+        if parts.path == LOGIN_PATH:
+            return self._login(form)
+        session = self._session()
+        if parts.path == LOGOUT_PATH:
+            with self.bank.lock:
+                self.bank.sessions.discard(session)
+            return self._redirect(LOGIN_PATH)
+        if session is None:
+            return self._redirect(LOGIN_PATH)
+        account = self._account(query)
+        if parts.path == TRANSACTIONS_PATH and account is not None:
+            return self._search(account, form)
+        self._send(404, b"Not found")
+
+    def _login_page(self) -> None:
+        # Like the real site, input names are random on every page load.
+        user_field = "u" + secrets.token_hex(6)
+        pass_field = "p" + secrets.token_hex(6)
+        self._page(
+            "Login",
+            f"""
+<form action="{LOGIN_PATH}" method="post" class="login">
+  <label for="{user_field}">Anmeldename</label>
+  <input type="text" id="{user_field}" name="{user_field}" value="">
+  <label for="{pass_field}">PIN</label>
+  <input type="password" id="{pass_field}" name="{pass_field}" value="">
+  <input type="submit" name="login" value="Anmelden">
+</form>
+""",
+        )
+
+    def _login(self, form: dict[str, str]) -> None:
+        user = next((v for k, v in form.items() if k.startswith("u")), "")
+        password = next((v for k, v in form.items() if k.startswith("p")), "")
+        if not user or not password:
+            return self._page(
+                "Login",
+                '<div class="msgerror">Fehlermeldung:Anmeldename oder PIN fehlt.</div>',
+            )
+        session = secrets.token_hex(16)
+        with self.bank.lock:
+            self.bank.sessions.add(session)
+        self._redirect(
+            OVERVIEW_PATH, {"Set-Cookie": f"{SESSION_COOKIE}={session}; Path=/; HttpOnly"}
+        )
+
+    def _overview_page(self) -> None:
+        cards = "".join(
+            f"""
+<div class="mkp-card-bank-account">
+  <a class="mkp-identifier-link" href="{TRANSACTIONS_PATH}?account={i}">
+    Girokonto {i}
+    <span class="iban">{html.escape(rows[0][0] if rows else '')}</span>
+  </a>
+</div>"""
+            for i, rows in enumerate(self.bank.accounts)
+        )
+        self._page("Finanzübersicht", cards + _LOGOUT_FORM)
+
+    def _transactions_page(self, account: int, date_from: str | None, date_to: str | None) -> None:
+        rows = None
+        if date_from is not None:
+            rows = _select_rows(self.bank.accounts[account], date_from, date_to)
+        self._send(200, render_transactions_page(account, date_from, date_to, rows).encode("utf-8"))
+
+    def _search(self, account: int, form: dict[str, str]) -> None:
+        date_from = form.get("zeitraumVon", "")
+        date_to = form.get("zeitraumBis", "")
+        if _parse_date(date_from) is None or _parse_date(date_to) is None:
+            return self._page(
+                "Umsätze",
+                '<div class="msgerror">Fehlermeldung:Ungültiger Zeitraum.</div>'
+                + _search_form(account, date_from, date_to),
+            )
+        self._transactions_page(account, date_from, date_to)
+
+    def _download(self, account: int, date_from: str, date_to: str) -> None:
+        rows = _select_rows(self.bank.accounts[account], date_from, date_to)
+        output = io.StringIO()
+        writer = csv.writer(output, delimiter=";", quoting=csv.QUOTE_ALL, lineterminator="\r\n")
+        writer.writerow(SPARKASSE_CAMT_COLUMNS)
+        writer.writerows(format_sparkasse_row(row) for row in rows)
+        self._send(
+            200,
+            output.getvalue().encode(SERVER_FILE_ENCODING),
+            "text/csv; charset=" + SERVER_FILE_ENCODING,
+            {"Content-Disposition": 'attachment; filename="umsaetze.csv"'},
+        )
+
+
+def _search_form(account: int, date_from: str, date_to: str) -> str:
+    return f"""
+<form action="{TRANSACTIONS_PATH}?account={account}" method="post" class="search">
+  <input type="hidden" name="submitted" value="0">
+  <input type="text" name="zeitraumVon" placeholder="TT.MM.JJJJ" value="{date_from}">
+  <input type="text" name="zeitraumBis" placeholder="TT.MM.JJJJ" value="{date_to}">
+  <input type="submit" name="suche" value="Aktualisieren">
+  <input type="submit" name="zuruecksetzen" value="Zurücksetzen">
+</form>
+"""
+
+
+def render_transactions_page(
+    account: int,
+    date_from: str | None,
+    date_to: str | None,
+    rows: list[list] | None,
+    table_rows: int = HTML_TABLE_ROWS,
+) -> str:
+    """The transactions page: the search form plus, after a search, its results.
+
+    rows are the transactions found by the search (None before searching), of
+    which the first table_rows are shown in the HTML table."""
+    body = _search_form(account, date_from or "", date_to or "")
+    if rows is not None:
+        if not rows:
+            body += "<p>Keine Suchergebnisse</p>"
+        else:
+            download = f"{DOWNLOAD_PATH}?" + urlencode(
+                {"account": account, "from": date_from, "to": date_to}
+            )
+            body += f"""
+<div class="nbf-druckExportOption">
+  <a href="{download}">Excel (CSV-CAMT V2)</a>
+  <a href="{download}&amp;format=pdf">PDF</a>
+</div>
+"""
+            body += "<table class=\"umsaetze\">" + "".join(
+                "<tr>"
+                + "".join(f"<td>{html.escape(v)}</td>" for v in format_sparkasse_row(row)[1:5])
+                + f"<td class=\"betrag\">{row[14]}</td></tr>"
+                for row in rows[:table_rows]
+            ) + "</table>"
+    return _PAGE.format(title="Umsätze", body=body + _LOGOUT_FORM)
+
+
+def _parse_date(value: str) -> date | None:
+    try:
+        return datetime.strptime(value, "%d.%m.%Y").date()
+    except ValueError:
+        return None
+
+
+def _select_rows(rows: list[list], date_from: str, date_to: str) -> list[list]:
+    start, end = _parse_date(date_from), _parse_date(date_to)
+    if start is None or end is None:
+        return []
+    return [row for row in rows if start <= row[1] <= end]
+
+
+class MockSparkasseServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, bank: MockSparkasse, port: int = 0):
+        super().__init__(("127.0.0.1", port), Handler)
+        self.bank = bank
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--port", type=int, default=0, help="Port to listen on; 0 picks a free one.")
+    parser.add_argument("--accounts", type=int, default=1)
+    parser.add_argument("--transactions", type=int, default=1000, help="Per account.")
+    parser.add_argument("--days", type=int, default=3 * 365, help="Age of the oldest transaction.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    server = MockSparkasseServer(
+        MockSparkasse(args.accounts, args.transactions, args.days, args.seed), args.port
+    )
+    # The first line of output is the base URL (read by benchmarks/e2e.py).
+    print(server.base_url, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
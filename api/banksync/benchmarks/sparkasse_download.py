@@ -0,0 +1,170 @@
+#!/usr/bin/python3
+"""
+Measures peak memory and time to first byte of writing a Sparkasse CSV export.
+
+Compares two ways of getting a large windows-1252 export from the response to
+stdout as UTF-8:
+
+- "buffered": what sparkasse.py did before, i.e. r.content, decoded to str,
+              re-encoded and written at once.
+- "streamed": sparkasse.iter_decoded and transcode_export, i.e. the body is
+              read in chunks, decoded incrementally and written as it comes.
+
+The response is a stand-in that generates the synthetic export in chunks, as
+if it arrived from the network. Each variant runs in a fresh process that
+writes to /dev/null; reported are the peak RSS of that process and the peak
+of memory allocated by Python (tracemalloc) during the export.
+
+    python sparkasse_download.py --rows 10000,100000,300000
+"""
+from __future__ import annotations
+
+import argparse
+import csv
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import date
+from typing import Iterator
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+import sparkasse  # noqa: E402
+from synthetic import (  # noqa: E402
+    SPARKASSE_CAMT_COLUMNS,
+    format_sparkasse_row,
+    make_sparkasse_rows,
+)
+
+# Rows generated at a time by the stand-in response.
+BATCH_ROWS = 1000
+
+
+class SyntheticExport:
+    """Stand-in for the streamed requests.Response of the CSV download."""
+
+    def __init__(self, rows: int, days: int = 3 * 365):
+        self.rows = rows
+        self.days = days
+
+    def _batches(self) -> Iterator[bytes]:
+        today = date.today()
+        for i, start in enumerate(range(0, self.rows, BATCH_ROWS)):
+            out = io.StringIO()
+            writer = csv.writer(out, delimiter=";", quoting=csv.QUOTE_ALL, lineterminator="\r\n")
+            if start == 0:
+                writer.writerow(SPARKASSE_CAMT_COLUMNS)
+            count = min(BATCH_ROWS, self.rows - start)
+            for row in make_sparkasse_rows(count, today, self.days, seed=i):
+                writer.writerow(format_sparkasse_row(row))
+            yield out.getvalue().encode(sparkasse.SERVER_FILE_ENCODING)
+
+    def iter_content(self, chunk_size: int) -> Iterator[bytes]:
+        pending = b""
+        for batch in self._batches():
+            pending += batch
+            while len(pending) >= chunk_size:
+                yield pending[:chunk_size]
+                pending = pending[chunk_size:]
+        if pending:
+            yield pending
+
+    @property
+    def content(self) -> bytes:
+        return b"".join(self._batches())
+
+
+class _FirstByte:
+    """Binary sink that remembers when it was first written to."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.first_write: float | None = None
+
+    def write(self, data: bytes) -> int:
+        if self.first_write is None and data:
+            self.first_write = time.perf_counter()
+        return self.stream.write(data)
+
+    def flush(self) -> None:
+        self.stream.flush()
+
+
+def buffered(response: SyntheticExport, sink: _FirstByte) -> None:
+    csv_bytes = response.content
+    csv_text = csv_bytes.decode(sparkasse.SERVER_FILE_ENCODING)
+    reencoded_bytes = csv_text.encode(sparkasse.OUTPUT_ENCODING)
+    sink.write(reencoded_bytes)
+    sink.flush()
+
+
+def streamed(response: SyntheticExport, sink: _FirstByte) -> None:
+    writer = sparkasse.OutputWriter(sink)
+    sparkasse.transcode_export(sparkasse.iter_decoded(response), writer, None, None)
+    writer.finish()
+
+
+VARIANTS = {"buffered": buffered, "streamed": streamed}
+
+
+def run_variant(variant: str, rows: int) -> None:
+    """Runs one export in this process and prints its measurements as JSON."""
+    response = SyntheticExport(rows)
+    with open(os.devnull, "wb") as devnull:
+        sink = _FirstByte(devnull)
+        tracemalloc.start()
+        start = time.perf_counter()
+        VARIANTS[variant](response, sink)
+        seconds = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    print(
+        json.dumps(
+            {
+                "seconds": seconds,
+                "first_byte": sink.first_write - start,
+                "traced_peak": peak,
+                "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            }
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--rows", default="10000,100000,300000", help="Comma-separated numbers of CSV rows."
+    )
+    parser.add_argument("--variant", choices=VARIANTS, help="Internal: run a single export.")
+    args = parser.parse_args()
+
+    if args.variant:
+        return run_variant(args.variant, int(args.rows))
+
+    print(
+        f"{'rows':>8} {'variant':<9} {'seconds':>8} {'1st byte s':>10} "
+        f"{'traced MB':>10} {'rss MB':>8}"
+    )
+    for rows in (int(s) for s in args.rows.split(",")):
+        for variant in VARIANTS:
+            proc = subprocess.run(
+                [sys.executable, __file__, "--variant", variant, "--rows", str(rows)],
+                capture_output=True,
+                text=True,
+                check=True,
+            )
+            result = json.loads(proc.stdout)
+            print(
+                f"{rows:>8} {variant:<9} {result['seconds']:>8.2f} {result['first_byte']:>10.3f} "
+                f"{result['traced_peak'] / 2**20:>10.1f} {result['max_rss_kb'] / 1024:>8.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
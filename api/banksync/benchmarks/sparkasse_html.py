@@ -0,0 +1,123 @@
+#!/usr/bin/python3
+"""
+Compares the HTML processing of sparkasse.py before and after sparkasse_pages.
+
+For a search result page, both variants do what do_apply_date_filter and
+do_export_csv need: tell whether the search succeeded, parse the page, find
+the export links and pick the CSV export to follow.
+
+- "legacy":  one text scan per marker string, html.fromstring followed by
+             make_links_absolute over the whole document, and cssselect()
+             (which translates the selector to XPath on every call).
+- "targeted": sparkasse_pages, i.e. a single regex scan, parsing with a base
+             URL and precompiled XPath expressions.
+
+The page is generated like mock_sparkasse.py does, but with --rows rows in
+its table to approximate the size of real result pages. Pass --page to use a
+saved page instead.
+
+    python sparkasse_html.py --rows 100,1000,10000
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import statistics
+import sys
+import time
+from datetime import date, timedelta
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+import sparkasse_pages  # noqa: E402
+from mock_sparkasse import render_transactions_page  # noqa: E402
+from synthetic import make_sparkasse_rows  # noqa: E402
+
+PAGE_URL = "https://www.sparkasse.example/de/home/onlinebanking/umsaetze/umsaetze.html"
+
+
+def legacy(text: str, url: str) -> str | None:
+    from lxml import html
+
+    if "Keine Suchergebnisse" in text:
+        return None
+    if not any(button in text for button in sparkasse_pages.ACCEPTED_EXPORT_BUTTONS):
+        return None
+    doc = html.fromstring(text)
+    doc.make_links_absolute(url)
+    export_links = doc.cssselect(".nbf-druckExportOption a")
+    accepted = [
+        el
+        for el in export_links
+        if any(b in el.text_content() for b in sparkasse_pages.ACCEPTED_EXPORT_BUTTONS)
+    ]
+    # The debug log of the available formats.
+    [el.text_content().strip() for el in export_links]
+    return accepted[0].get("href") if accepted else None
+
+
+def targeted(text: str, url: str) -> str | None:
+    if sparkasse_pages.classify_search_result(text) != sparkasse_pages.SEARCH_EXPORTABLE:
+        return None
+    doc = sparkasse_pages.parse(text, url)
+    accepted = [
+        href
+        for link_text, href in sparkasse_pages.export_links(doc)
+        if any(b in link_text for b in sparkasse_pages.ACCEPTED_EXPORT_BUTTONS)
+    ]
+    return sparkasse_pages.absolute(doc, accepted[0]) if accepted else None
+
+
+def measure(fn, text: str, repeat: int) -> float:
+    """Median seconds of one call."""
+    fn(text, PAGE_URL)  # Warm-up, e.g. compiling the XPath expressions.
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(text, PAGE_URL)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def generated_page(rows: int) -> str:
+    today = date.today()
+    transactions = make_sparkasse_rows(rows, today, 3 * 365)
+    return render_transactions_page(
+        0,
+        (today - timedelta(days=3 * 365)).strftime("%d.%m.%Y"),
+        today.strftime("%d.%m.%Y"),
+        transactions,
+        table_rows=rows,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--rows", default="100,1000,10000", help="Comma-separated table sizes of the page."
+    )
+    parser.add_argument("--page", help="Use this saved HTML page instead of generated ones.")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.page:
+        with open(args.page, encoding="utf-8", errors="replace") as f:
+            pages = [(os.path.basename(args.page), f.read())]
+    else:
+        pages = [(f"{n} rows", generated_page(n)) for n in (int(s) for s in args.rows.split(","))]
+
+    print(f"{'page':<16} {'size KB':>8} {'legacy ms':>10} {'targeted ms':>12} {'speedup':>8}")
+    for name, text in pages:
+        if legacy(text, PAGE_URL) != targeted(text, PAGE_URL):
+            raise RuntimeError(f"{name}: the variants disagree on the export link")
+        legacy_s = measure(legacy, text, args.repeat)
+        targeted_s = measure(targeted, text, args.repeat)
+        print(
+            f"{name:<16} {len(text) / 1024:>8.0f} {legacy_s * 1000:>10.2f} "
+            f"{targeted_s * 1000:>12.2f} {legacy_s / targeted_s:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
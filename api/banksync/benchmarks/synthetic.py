@@ -0,0 +1,140 @@
+"""
+Synthetic bank data for the benchmarks.
+
+All generators are deterministic for a given seed, so results are comparable
+between runs.
+"""
+from __future__ import annotations
+
+import random
+from datetime import date, timedelta
+
+_NAMES = [
+    "REWE Markt GmbH",
+    "Stadtwerke Muenchen",
+    "Amazon EU S.a.r.l.",
+    "Deutsche Bahn AG",
+    "Max Mustermann",
+    "Erika Musterfrau",
+    "Vodafone GmbH",
+    "Techniker Krankenkasse",
+]
+_TYPES = ["KARTENZAHLUNG", "LASTSCHRIFT", "UEBERWEISUNG", "GUTSCHRIFT", "DAUERAUFTRAG"]
+
+
+def _iban(rng: random.Random) -> str:
+    return "DE" + "".join(str(rng.randrange(10)) for _ in range(20))
+
+
+def make_dkb_transactions(
+    count: int, newest: date | None = None, days: int = 5 * 365, seed: int = 0
+) -> list[dict]:
+    """Transactions as returned by DKB's JSON API, newest first."""
+    rng = random.Random(seed)
+    newest = newest or date.today()
+    own_iban = _iban(rng)
+    transactions = []
+    for i in range(count):
+        booking_date = newest - timedelta(days=days * i // max(count, 1))
+        value_date = booking_date + timedelta(days=rng.choice([0, 0, 0, 1, 2]))
+        amount = round(rng.uniform(-250, 250), 2) or 1.0
+        other = {"name": rng.choice(_NAMES)}
+        other_account = {"iban": _iban(rng), "bic": "BYLADEM1001"}
+        own = {"name": "Account Holder"}
+        own_account = {"iban": own_iban}
+        if amount > 0:
+            debtor, creditor = other, own
+            debtor["debtorAccount"] = other_account
+            creditor["creditorAccount"] = own_account
+        else:
+            debtor, creditor = own, other
+            debtor["debtorAccount"] = own_account
+            creditor["creditorAccount"] = other_account
+        transactions.append(
+            {
+                "type": "accountTransaction",
+                "id": f"{booking_date.isoformat()}-{i:08d}",
+                "attributes": {
+                    "status": "pending" if i < 3 else "booked",
+                    "bookingDate": booking_date.isoformat(),
+                    "valueDate": value_date.isoformat(),
+                    "description": f"Verwendungszweck {i} " + "x" * rng.randrange(10, 80),
+                    "endToEndId": f"E2E{i:012d}",
+                    "transactionType": rng.choice(_TYPES),
+                    "purposeCode": "OTHR",
+                    "businessTransactionCode": "NMSC+201+9310+000",
+                    "amount": {"currencyCode": "EUR", "value": f"{amount:.2f}"},
+                    "creditor": creditor,
+                    "debtor": debtor,
+                    "isRevocable": False,
+                },
+                "relationships": {},
+            }
+        )
+    return transactions
+
+
+# Columns of Sparkasse's "Excel (CSV-CAMT V2)" export.
+SPARKASSE_CAMT_COLUMNS = [
+    "Auftragskonto",
+    "Buchungstag",
+    "Valutadatum",
+    "Buchungstext",
+    "Verwendungszweck",
+    "Glaeubiger ID",
+    "Mandatsreferenz",
+    "Kundenreferenz (End-to-End)",
+    "Sammlerreferenz",
+    "Lastschrift Ursprungsbetrag",
+    "Auslagenersatz Ruecklastschrift",
+    "Beguenstigter/Zahlungspflichtiger",
+    "Kontonummer/IBAN",
+    "BIC (SWIFT-Code)",
+    "Betrag",
+    "Waehrung",
+    "Info",
+]
+
+
+def make_sparkasse_rows(
+    count: int, newest: date | None = None, days: int = 5 * 365, seed: int = 0
+) -> list[list]:
+    """Rows of a Sparkasse CSV-CAMT export (without header), newest first.
+
+    Dates are datetime.date objects in the Buchungstag/Valutadatum columns, so
+    that callers can filter by them; format them with format_sparkasse_row."""
+    rng = random.Random(seed)
+    newest = newest or date.today()
+    own_iban = _iban(rng)
+    rows = []
+    for i in range(count):
+        booking_date = newest - timedelta(days=days * i // max(count, 1))
+        value_date = booking_date + timedelta(days=rng.choice([0, 0, 0, 1, 2]))
+        amount = round(rng.uniform(-250, 250), 2) or 1.0
+        rows.append(
+            [
+                own_iban,
+                booking_date,
+                value_date,
+                rng.choice(_TYPES),
+                # Umlauts, to exercise the windows-1252 transcoding.
+                f"Verwendungszweck {i} Überweisung " + "x" * rng.randrange(10, 80),
+                "",
+                "",
+                f"E2E{i:012d}",
+                "",
+                "",
+                "",
+                rng.choice(_NAMES),
+                _iban(rng),
+                "BYLADEM1001",
+                f"{amount:.2f}".replace(".", ","),
+                "EUR",
+                "Umsatz vorgemerkt" if i < 2 else "Umsatz gebucht",
+            ]
+        )
+    return rows
+
+
+def format_sparkasse_row(row: list) -> list[str]:
+    return [v.strftime("%d.%m.%y") if isinstance(v, date) else v for v in row]
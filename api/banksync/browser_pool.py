@@ -0,0 +1,521 @@
+#!/usr/bin/python3
+"""
+Pool of pre-launched Chromium instances for the DKB sync.
+
+Launching Xvfb and Chrome and loading the login page takes a large, fixed part
+of every DKB sync. The pool manager (``python browser_pool.py``) keeps a number
+of isolated browsers running, each with its own profile, parked on a blank
+page. ``DkbBrowser`` leases one of them, attaches to it via the DevTools port
+and hands it back afterwards with cookies and storage cleared.
+
+The pool lives in a directory, so that leases work across processes (CLI
+invocations, worker children) without talking to the manager:
+
+    <pool dir>/slot-<n>/state.json   port, pid and usage of the browser
+    <pool dir>/slot-<n>/lock         flock()ed while the browser is leased
+    <pool dir>/slot-<n>/profile/     the browser's user data dir
+
+The manager retires a browser once it has served --max-sessions sessions or
+its process tree uses more than --max-rss-mb, and launches a fresh one in its
+place.
+"""
+from __future__ import annotations
+
+import argparse
+import fcntl
+import json
+import logging
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import tempfile
+import time
+import urllib.request
+
+logger = logging.getLogger(__name__)
+
+STATUS_READY = "ready"
+STATUS_RETIRED = "retired"
+
+CHROME_BINARY_CANDIDATES = [
+    "google-chrome",
+    "google-chrome-stable",
+    "chromium",
+    "chromium-browser",
+]
+
+# Added to the flags of seleniumbase's UC/CDP mode (see chrome_args()): the
+# cold path passes locale="de", and attaching happens from other processes.
+EXTRA_CHROME_FLAGS = [
+    "--lang=de",
+    "--remote-allow-origins=*",
+]
+
+
+def _read_json(path: str) -> dict | None:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json(path: str, data: dict) -> None:
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".state-")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def _pid_alive(pid: int | None) -> bool:
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _process_start_time(pid: int) -> int | None:
+    """Returns the start time of a process in clock ticks since boot (field 22
+    of /proc/<pid>/stat), or None if there is no such process."""
+    try:
+        with open(f"/proc/{pid}/stat", encoding="ascii", errors="replace") as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # The command name may contain spaces, so split after its closing paren.
+    return int(stat[stat.rfind(")") + 2 :].split()[19])
+
+
+def _browser_alive(state: dict) -> bool:
+    """Returns whether the browser of a slot's state still runs.
+
+    The pid alone may since have been reused by an unrelated process, e.g.
+    after a reboot, so its start time must match as well. Without /proc, only
+    the pid can be checked."""
+    pid = state.get("pid")
+    if not _pid_alive(pid):
+        return False
+    if not os.path.isdir("/proc"):
+        return True
+    start_time = state.get("start_time")
+    return start_time is not None and _process_start_time(pid) == start_time
+
+
+def _try_lock(slot_dir: str) -> int | None:
+    """Takes the lock of a slot without waiting. Returns its file descriptor,
+    or None if the slot is leased (or its lock cannot be opened)."""
+    try:
+        lock_fd = os.open(os.path.join(slot_dir, "lock"), os.O_RDWR | os.O_CREAT, 0o600)
+    except OSError:
+        return None
+    try:
+        fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(lock_fd)
+        return None
+    return lock_fd
+
+
+def _remove_state(slot_dir: str) -> None:
+    try:
+        os.unlink(os.path.join(slot_dir, "state.json"))
+    except FileNotFoundError:
+        pass
+
+
+def process_tree_rss(pid: int) -> int | None:
+    """Returns the summed RSS in bytes of a process and its descendants.
+
+    Chrome spreads its memory over many renderer/GPU/utility processes, so the
+    browser process alone says little. Linux only; None elsewhere."""
+    if not os.path.isdir("/proc"):
+        return None
+    children: dict[int, list[int]] = {}
+    rss_pages: dict[int, int] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", encoding="ascii", errors="replace") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # The command name may contain spaces, so split after its closing paren.
+        fields = stat[stat.rfind(")") + 2 :].split()
+        child = int(entry)
+        children.setdefault(int(fields[1]), []).append(child)
+        rss_pages[child] = int(fields[21])
+    if pid not in rss_pages:
+        return None
+    total = 0
+    stack = [pid]
+    while stack:
+        current = stack.pop()
+        total += rss_pages.get(current, 0)
+        stack.extend(children.get(current, []))
+    return total * os.sysconf("SC_PAGE_SIZE")
+
+
+class BrowserLease:
+    """A pooled browser, exclusively held until release() is called."""
+
+    def __init__(self, slot_dir: str, lock_fd: int, state: dict):
+        self.slot_dir = slot_dir
+        self._lock_fd = lock_fd
+        self.state = state
+
+    @property
+    def host(self) -> str:
+        return "127.0.0.1"
+
+    @property
+    def port(self) -> int:
+        return self.state["port"]
+
+    def release(self, healthy: bool = True) -> None:
+        """Returns the browser to the pool.
+
+        If it could not be cleaned up properly, pass healthy=False to have the
+        manager replace it."""
+        if self._lock_fd is None:
+            return
+        try:
+            self.state["sessions"] = self.state.get("sessions", 0) + 1
+            if not healthy:
+                self.state["status"] = STATUS_RETIRED
+            _write_json(os.path.join(self.slot_dir, "state.json"), self.state)
+        finally:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+
+class BrowserPool:
+    """Client side of the pool: leases browsers launched by the manager."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def _slot_dirs(self) -> list[str]:
+        try:
+            names = sorted(n for n in os.listdir(self.directory) if n.startswith("slot-"))
+        except FileNotFoundError:
+            return []
+        return [os.path.join(self.directory, n) for n in names]
+
+    def acquire(self) -> BrowserLease | None:
+        """Leases an idle, ready browser. Returns None if there is none."""
+        for slot_dir in self._slot_dirs():
+            lock_fd = _try_lock(slot_dir)
+            if lock_fd is None:
+                continue
+            state = _read_json(os.path.join(slot_dir, "state.json"))
+            if (
+                state is not None
+                and state.get("status") == STATUS_READY
+                and _browser_alive(state)
+            ):
+                logger.debug("Leased pooled browser from %s", slot_dir)
+                return BrowserLease(slot_dir, lock_fd, state)
+            fcntl.flock(lock_fd, fcntl.LOCK_UN)
+            os.close(lock_fd)
+        return None
+
+
+def find_chrome_binary(binary: str | None) -> str:
+    if binary:
+        return binary
+    for candidate in CHROME_BINARY_CANDIDATES:
+        path = shutil.which(candidate)
+        if path:
+            return path
+    raise RuntimeError("No Chrome/Chromium binary found. Pass --chrome-binary.")
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def chrome_args(chrome_binary: str, profile_dir: str, port: int, headless: bool) -> list[str]:
+    """Returns the command line that starts a browser the way seleniumbase's
+    UC/CDP mode (``SB(uc=True)``) does, so that pooled browsers are not easier
+    to detect than the ones DkbBrowser launches itself.
+
+    This also writes UC mode's default preferences into the profile.
+    """
+    # Only the manager needs seleniumbase here; leasing stays stdlib-only.
+    from seleniumbase.undetected.cdp_driver.config import Config
+
+    config = Config(
+        user_data_dir=profile_dir,
+        headless=headless,
+        browser_executable_path=chrome_binary,
+        host="127.0.0.1",
+        port=port,
+    )
+    return [chrome_binary, *config(), *EXTRA_CHROME_FLAGS, "about:blank"]
+
+
+def _wait_for_devtools(port: int, timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/json/version", timeout=1):
+                return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+
+class PoolManager:
+    """Launches, monitors and retires the browsers of a pool."""
+
+    def __init__(
+        self,
+        directory: str,
+        size: int,
+        chrome_binary: str,
+        xvfb: bool = False,
+        headless: bool = False,
+        max_sessions: int = 20,
+        max_rss_mb: int = 1500,
+    ):
+        self.directory = directory
+        self.size = size
+        self.chrome_binary = chrome_binary
+        self.xvfb = xvfb
+        self.headless = headless
+        self.max_sessions = max_sessions
+        self.max_rss_mb = max_rss_mb
+        self._xvfb_proc: subprocess.Popen | None = None
+        self._display: str | None = None
+        self._procs: dict[str, subprocess.Popen] = {}
+        self._stopping = False
+
+    def _start_xvfb(self) -> None:
+        for display_number in range(99, 199):
+            if os.path.exists(f"/tmp/.X11-unix/X{display_number}"):
+                continue
+            display = f":{display_number}"
+            proc = subprocess.Popen(
+                ["Xvfb", display, "-screen", "0", "1920x1080x24", "-nolisten", "tcp"],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+            time.sleep(0.5)
+            if proc.poll() is None:
+                self._xvfb_proc = proc
+                self._display = display
+                logger.info("Started Xvfb on display %s", display)
+                return
+        raise RuntimeError("Could not start Xvfb.")
+
+    def _launch(self, slot_dir: str) -> None:
+        profile_dir = os.path.join(slot_dir, "profile")
+        shutil.rmtree(profile_dir, ignore_errors=True)
+        os.makedirs(profile_dir, mode=0o700)
+        port = _free_port()
+        args = chrome_args(self.chrome_binary, profile_dir, port, self.headless)
+        env = dict(os.environ)
+        # Chrome writes its NSS cert DB etc. under $HOME, see DkbBrowser.
+        env["HOME"] = slot_dir
+        if self._display:
+            env["DISPLAY"] = self._display
+
+        start = time.monotonic()
+        proc = subprocess.Popen(
+            args,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+        if not _wait_for_devtools(port, timeout=30):
+            proc.kill()
+            proc.wait()
+            raise RuntimeError(f"Browser in {slot_dir} did not open its DevTools port.")
+        self._procs[slot_dir] = proc
+        _write_json(
+            os.path.join(slot_dir, "state.json"),
+            {
+                "status": STATUS_READY,
+                "pid": proc.pid,
+                "start_time": _process_start_time(proc.pid),
+                "port": port,
+                "sessions": 0,
+                "launched_at": time.time(),
+            },
+        )
+        logger.info(
+            "Launched browser in %s on port %d in %.2fs",
+            slot_dir,
+            port,
+            time.monotonic() - start,
+        )
+
+    def _stop(self, slot_dir: str) -> None:
+        proc = self._procs.pop(slot_dir, None)
+        if proc is None:
+            # Launched by an earlier manager: only kill it if it is still
+            # that browser, not a process that got its pid since.
+            state = _read_json(os.path.join(slot_dir, "state.json")) or {}
+            if _browser_alive(state):
+                try:
+                    os.killpg(state["pid"], signal.SIGTERM)
+                except OSError:
+                    pass
+            return
+        try:
+            os.killpg(proc.pid, signal.SIGTERM)
+            proc.wait(timeout=10)
+        except (OSError, subprocess.TimeoutExpired):
+            proc.kill()
+            proc.wait()
+
+    def _needs_replacement(self, slot_dir: str) -> str | None:
+        """Returns the reason why an (idle) browser should be replaced, if any."""
+        state = _read_json(os.path.join(slot_dir, "state.json"))
+        if state is None:
+            return "not launched"
+        if state.get("status") != STATUS_READY:
+            return state.get("status")
+        if not _browser_alive(state):
+            return "process died"
+        if state.get("sessions", 0) >= self.max_sessions:
+            return f"served {state['sessions']} sessions"
+        rss = process_tree_rss(state["pid"])
+        if rss is not None and rss > self.max_rss_mb * 1024 * 1024:
+            return f"uses {rss // (1024 * 1024)} MB"
+        return None
+
+    def maintain(self) -> None:
+        """Replaces idle browsers that are dead or due for retirement."""
+        for i in range(self.size):
+            slot_dir = os.path.join(self.directory, f"slot-{i}")
+            os.makedirs(slot_dir, mode=0o700, exist_ok=True)
+            lock_fd = _try_lock(slot_dir)
+            if lock_fd is None:
+                continue  # Currently leased.
+            try:
+                reason = self._needs_replacement(slot_dir)
+                if reason is None:
+                    continue
+                logger.info("Replacing browser in %s: %s", slot_dir, reason)
+                self._stop(slot_dir)
+                try:
+                    self._launch(slot_dir)
+                except Exception:
+                    logger.exception("Failed to launch browser in %s", slot_dir)
+            finally:
+                os.close(lock_fd)
+
+    def run(self, interval: float) -> None:
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        signal.signal(signal.SIGTERM, self._on_terminate)
+        signal.signal(signal.SIGINT, self._on_terminate)
+        if self.xvfb:
+            self._start_xvfb()
+        self._stop_previous()
+        try:
+            while not self._stopping:
+                self.maintain()
+                time.sleep(interval)
+        finally:
+            for slot_dir in list(self._procs):
+                self._stop(slot_dir)
+                _remove_state(slot_dir)
+            if self._xvfb_proc is not None:
+                self._xvfb_proc.terminate()
+                self._xvfb_proc.wait()
+            logger.info("Shut down.")
+
+    def _stop_previous(self) -> None:
+        """Stops the idle browsers a previous manager may have left behind.
+
+        Leased ones are left to finish their sync; maintain() replaces them
+        once they are returned, if needed."""
+        for i in range(self.size):
+            slot_dir = os.path.join(self.directory, f"slot-{i}")
+            if not os.path.isdir(slot_dir):
+                continue
+            lock_fd = _try_lock(slot_dir)
+            if lock_fd is None:
+                logger.info("Browser in %s is leased, keeping it.", slot_dir)
+                continue
+            try:
+                self._stop(slot_dir)
+                _remove_state(slot_dir)
+            finally:
+                os.close(lock_fd)
+
+    def _on_terminate(self, signum, frame):
+        self._stopping = True
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Keeps a pool of pre-launched browsers for the DKB sync."
+    )
+    parser.add_argument("--dir", required=True, help="Directory of the pool.")
+    parser.add_argument("--size", type=int, default=2, help="Number of browsers.")
+    parser.add_argument(
+        "--chrome-binary",
+        default=os.environ.get("FT_CHROME_BINARY"),
+        help="Path to the Chrome/Chromium binary. Defaults to the "
+        "FT_CHROME_BINARY env var, or the first one found on PATH.",
+    )
+    parser.add_argument(
+        "--xvfb",
+        action="store_true",
+        help="Run the browsers inside a virtual framebuffer (xvfb).",
+    )
+    parser.add_argument(
+        "--headless", action="store_true", help="Run the browsers in headless mode."
+    )
+    parser.add_argument(
+        "--max-sessions",
+        type=int,
+        default=20,
+        help="Replace a browser after it has served this many syncs.",
+    )
+    parser.add_argument(
+        "--max-rss-mb",
+        type=int,
+        default=1500,
+        help="Replace a browser once its processes use more memory than this.",
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=2.0,
+        help="Seconds between checks for browsers to replace.",
+    )
+    parser.add_argument("-v", "--verbose", action="store_true", help="Enable verbose logging.")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.INFO,
+        format="[%(levelname)s] %(message)s",
+    )
+    PoolManager(
+        args.dir,
+        args.size,
+        find_chrome_binary(args.chrome_binary),
+        xvfb=args.xvfb,
+        headless=args.headless,
+        max_sessions=args.max_sessions,
+        max_rss_mb=args.max_rss_mb,
+    ).run(args.interval)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+"""
+On-disk checkpoints for incremental bank syncs.
+
+A checkpoint remembers, per account, the newest booked transaction date that
+was exported and the ids of the booked transactions close to that date. An
+incremental sync then only needs to fetch transactions from shortly before
+that date (OVERLAP, to catch late bookings) and can drop the ones that were
+already exported.
+
+There is one JSON file per bank and user. Its name contains a hash of the user
+name rather than the name itself. It also records which account id each
+account index resolved to, so that a reordered account list is detected and
+leads to a full export instead of a wrong delta.
+
+Exported is not imported: the user may cancel the import of an account, or the
+response may get lost. A sync run with a token therefore does not touch the
+checkpoints, but writes what it would change to a pending file:
+
+    <checkpoint dir>/pending/<token>.json
+
+Only once the client confirms which accounts it imported, commit() (or
+`checkpoints.py commit`) moves their checkpoints into the store. Pending files
+that are never committed are deleted after PENDING_MAX_AGE.
+"""
+from __future__ import annotations
+
+import argparse
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass, field
+from datetime import date, timedelta
+from typing import Iterable
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+
+PENDING_DIR = "pending"
+PENDING_MAX_AGE = 24 * 3600  # seconds
+_TOKEN_RE = re.compile(r"[0-9a-f]{32}")
+
+# How far before the newest exported date an incremental sync starts, to catch
+# transactions that are booked late with an earlier date.
+OVERLAP = timedelta(days=3)
+
+
+@dataclass
+class AccountCheckpoint:
+    account_id: str
+    # ISO date (YYYY-MM-DD) of the newest booked transaction that was exported.
+    newest_date: str
+    # Ids of the exported booked transactions from within OVERLAP of newest_date.
+    exported_ids: list[str] = field(default_factory=list)
+
+    def since(self, from_date: str) -> str:
+        """Returns the ISO date an incremental sync has to fetch from."""
+        start = (date.fromisoformat(self.newest_date) - OVERLAP).isoformat()
+        return max(start, from_date)
+
+
+def _write_json(path: str, data: dict) -> None:
+    directory = os.path.dirname(path)
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    # Write atomically, so that a crash never leaves a truncated file.
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".checkpoint-")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def is_token(token: str) -> bool:
+    """Whether token is a valid checkpoint token: 32 hex digits."""
+    return _TOKEN_RE.fullmatch(token) is not None
+
+
+def _pending_path(directory: str, token: str) -> str:
+    if not is_token(token):
+        raise ValueError(f"Invalid checkpoint token: {token!r}")
+    return os.path.join(directory, PENDING_DIR, token + ".json")
+
+
+def _delete_stale_pending(directory: str) -> None:
+    try:
+        entries = list(os.scandir(os.path.join(directory, PENDING_DIR)))
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        try:
+            if entry.stat().st_mtime < time.time() - PENDING_MAX_AGE:
+                os.unlink(entry.path)
+        except OSError:
+            pass
+
+
+class CheckpointStore:
+    """Checkpoints of all accounts of one user at one bank.
+
+    With a token, save() writes the changes to a pending file instead, see the
+    module docstring."""
+
+    def __init__(self, directory: str, bank: str, username: str, token: str | None = None):
+        user_hash = hashlib.sha256(f"{bank}\0{username}".encode("utf-8")).hexdigest()
+        self._open(os.path.join(directory, f"{user_hash[:32]}.json"), bank, token)
+
+    @classmethod
+    def _at(cls, path: str, bank: str) -> CheckpointStore:
+        """The store in a given file."""
+        store = cls.__new__(cls)
+        store._open(path, bank, None)
+        return store
+
+    def _open(self, path: str, bank: str, token: str | None) -> None:
+        self.directory = os.path.dirname(path)
+        self.path = path
+        self.bank = bank
+        self.token = token
+        if token is not None:
+            _pending_path(self.directory, token)  # Validates the token.
+        self.account_ids: dict[str, str] = {}
+        self.accounts: dict[str, AccountCheckpoint] = {}
+        # Account indices updated by this sync.
+        self.updated: set[str] = set()
+        self._load()
+
+    def _load(self) -> None:
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") != FORMAT_VERSION or data.get("bank") != self.bank:
+                raise ValueError("version or bank mismatch")
+            self.account_ids = {str(k): str(v) for k, v in data["account_ids"].items()}
+            self.accounts = {
+                account_id: AccountCheckpoint(**checkpoint)
+                for account_id, checkpoint in data["accounts"].items()
+            }
+        except FileNotFoundError:
+            logger.debug("No checkpoints found at %s.", self.path)
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning("Ignoring invalid checkpoint file %s: %s", self.path, e)
+            self.account_ids = {}
+            self.accounts = {}
+
+    def save(self) -> None:
+        if self.token is not None:
+            self._save_pending()
+            return
+        _write_json(
+            self.path,
+            {
+                "version": FORMAT_VERSION,
+                "bank": self.bank,
+                "account_ids": self.account_ids,
+                "accounts": {k: asdict(v) for k, v in self.accounts.items()},
+            },
+        )
+
+    def _save_pending(self) -> None:
+        _delete_stale_pending(self.directory)
+        accounts = {}
+        for index in sorted(self.updated):
+            account_id = self.account_ids[index]
+            checkpoint = self.accounts.get(account_id)
+            accounts[index] = {
+                "account_id": account_id,
+                "checkpoint": asdict(checkpoint) if checkpoint is not None else None,
+            }
+        _write_json(
+            _pending_path(self.directory, self.token),
+            {
+                "version": FORMAT_VERSION,
+                "bank": self.bank,
+                "store": os.path.basename(self.path),
+                "accounts": accounts,
+            },
+        )
+
+    def get(self, account_index: int, account_id: str) -> AccountCheckpoint | None:
+        """Returns the checkpoint of an account, or None if there is no usable one."""
+        known_id = self.account_ids.get(str(account_index))
+        if known_id is None:
+            return None
+        if known_id != account_id:
+            logger.info(
+                "Account %d used to be %s, but is now %s. Doing a full export.",
+                account_index,
+                known_id,
+                account_id,
+            )
+            return None
+        checkpoint = self.accounts.get(account_id)
+        if checkpoint is None:
+            return None
+        try:
+            newest = date.fromisoformat(checkpoint.newest_date)
+        except ValueError:
+            logger.warning("Invalid checkpoint date for account %d.", account_index)
+            return None
+        if newest > date.today() + timedelta(days=1):
+            logger.warning("Checkpoint of account %d is in the future.", account_index)
+            return None
+        return checkpoint
+
+    def update(
+        self,
+        account_index: int,
+        account_id: str,
+        booked: Iterable[tuple[str, str]],
+    ) -> None:
+        """Records the booked transactions (id, ISO date) seen by a sync.
+
+        The transactions must cover at least the range from the previous
+        checkpoint's since() date until today, which is the case for full and
+        for incremental syncs."""
+        booked = list(booked)
+        previous = self.accounts.get(account_id)
+        self.account_ids[str(account_index)] = account_id
+        self.updated.add(str(account_index))
+        if not booked:
+            # Nothing new; keep what we had.
+            return
+        newest = max(d for _, d in booked)
+        if previous is not None and previous.newest_date > newest:
+            newest = previous.newest_date
+        window_start = (date.fromisoformat(newest) - OVERLAP).isoformat()
+        self.accounts[account_id] = AccountCheckpoint(
+            account_id=account_id,
+            newest_date=newest,
+            exported_ids=sorted({i for i, d in booked if d >= window_start}),
+        )
+
+
+def commit(directory: str, token: str, account_indices: Iterable[int]) -> int:
+    """Moves the pending checkpoints of the given accounts of a sync into the
+    store, and forgets the others. Returns the number of accounts committed.
+
+    Raises FileNotFoundError if there is nothing pending for the token, e.g.
+    because it was committed already or expired."""
+    pending_path = _pending_path(directory, token)
+    with open(pending_path, encoding="utf-8") as f:
+        pending = json.load(f)
+    if pending.get("version") != FORMAT_VERSION:
+        raise ValueError("Unsupported pending checkpoint version.")
+    store_path = os.path.join(directory, os.path.basename(pending["store"]))
+
+    committed = 0
+    # Syncs of the same user may be confirmed concurrently.
+    with open(store_path + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        store = CheckpointStore._at(store_path, pending["bank"])
+        for index in {str(i) for i in account_indices}:
+            entry = pending["accounts"].get(index)
+            if entry is None:
+                continue
+            account_id = entry["account_id"]
+            store.account_ids[index] = account_id
+            checkpoint = entry["checkpoint"]
+            previous = store.accounts.get(account_id)
+            # Keep a newer checkpoint that was committed in the meantime.
+            if checkpoint is not None and (
+                previous is None or previous.newest_date <= checkpoint["newest_date"]
+            ):
+                store.accounts[account_id] = AccountCheckpoint(**checkpoint)
+            committed += 1
+        store.save()
+    os.unlink(pending_path)
+    return committed
+
+
+def main() -> bool:
+    parser = argparse.ArgumentParser(description="Manages sync checkpoints.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    commit_parser = subparsers.add_parser(
+        "commit", help="Commits the checkpoints of the accounts a client imported."
+    )
+    commit_parser.add_argument("--checkpoint-dir", required=True)
+    commit_parser.add_argument("--token", required=True)
+    commit_parser.add_argument(
+        "--account-index",
+        type=int,
+        action="append",
+        default=[],
+        help="Index of an account whose export was imported. Repeat for several.",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s")
+
+    try:
+        count = commit(args.checkpoint_dir, args.token, args.account_index)
+    except FileNotFoundError:
+        print("Nothing to commit for this token.")
+        return False
+    except (ValueError, KeyError, TypeError) as e:
+        print(f"Invalid pending checkpoints: {e}")
+        return False
+    logger.info("Committed the checkpoints of %d accounts.", count)
+    return True
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 2)
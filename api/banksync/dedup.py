@@ -0,0 +1,403 @@
+"""
+Server-side deduplication against the user's stored DataContainer.
+
+Every sync returns all transactions of the requested date range, most of which
+the user has already imported. If the user's database is stored on this
+server without encryption (see api/storage.php), the rows of its
+`imported_rows` that would be detected as duplicates by the app's import can
+be dropped before they are returned.
+
+Like the import (isDuplicate in import-file.component.ts), a row is a
+duplicate if an existing imported row has the same values in all columns that
+the import mapping of its file format uses. Also like the import
+(findRelevantExistingRows), an existing row is only compared if no transaction
+refers to it, or a transaction of the target account does. So the scripts need
+to be told the local account that the export of each account goes to
+(--dedup-account-id); without it, only rows without transactions are compared.
+
+The fingerprints of all existing rows are kept in an index, per file format
+and per account that refers to them, cached on disk under the sha256 of the
+stored file (the ETag of api/storage.php), so that it is only rebuilt after
+the database changed. The DataContainer is read with a minimal protobuf wire
+format reader, as only a few fields of ImportedRow and TransactionData are
+needed.
+"""
+from __future__ import annotations
+
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from typing import Iterator
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 2
+
+# Columns compared by the import of each file format, i.e. the requiredColumns
+# of MAPPINGS_BY_FORMAT in src/app/money/import/mappings.ts.
+DEDUP_COLUMNS = {
+    "ksk_camt": [
+        "Valutadatum",
+        "Betrag",
+        "Verwendungszweck",
+        "Beguenstigter/Zahlungspflichtiger",
+        "Kontonummer/IBAN",
+        "Buchungstext",
+    ],
+    "dkb_custom": [
+        "valueDate",
+        "description",
+        "other.name",
+        "other.iban",
+        "amount.value",
+        "transactionType",
+    ],
+}
+
+# Cached indexes of older versions of databases are deleted beyond this number.
+MAX_CACHED_INDEXES = 16
+
+FINGERPRINT_SIZE = 16
+# Magic prefix of databases encrypted by the app (src/app/core/crypto-util.ts).
+_ENCRYPTED_HEADER = b"FTRACK"
+_GZIP_MAGIC = b"\x1f\x8b"
+
+# Field numbers of DataContainer.transactions and .imported_rows, of
+# Transaction.single and .group, GroupData.children, TransactionData, ImportedRow
+# and of the entries of its `values` map.
+_FIELD_TRANSACTIONS = 2
+_FIELD_IMPORTED_ROWS = 3
+_FIELD_SINGLE = 100
+_FIELD_GROUP = 101
+_FIELD_CHILDREN = 1
+_FIELD_ACCOUNT_ID = 7
+_FIELD_IMPORTED_ROW_ID = 29
+_FIELD_ROW_ID = 1
+_FIELD_FILE_FORMAT = 3
+_FIELD_VALUES = 4
+_FIELD_MAP_KEY = 1
+_FIELD_MAP_VALUE = 2
+
+_WIRE_VARINT = 0
+_WIRE_I64 = 1
+_WIRE_LEN = 2
+_WIRE_I32 = 5
+
+
+class DedupError(Exception):
+    """The stored database cannot be used for deduplication."""
+
+
+def fingerprint(columns: list[str], values: dict[str, str]) -> bytes | None:
+    """Fingerprint of the given columns of a row, or None if one is missing."""
+    try:
+        key = "\x1f".join(values[column] for column in columns)
+    except KeyError:
+        return None
+    return hashlib.sha256(key.encode("utf-8")).digest()[:FINGERPRINT_SIZE]
+
+
+def _read_varint(data: bytes, pos: int) -> tuple[int, int]:
+    result = shift = 0
+    while True:
+        if pos >= len(data):
+            raise DedupError("Truncated protobuf data.")
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def _iter_fields(data: bytes) -> Iterator[tuple[int, bytes | int | None]]:
+    """Yields (field number, value) of a message. Length-delimited values are
+    returned as bytes and varints as int; fixed-size values are skipped and
+    yielded as None."""
+    pos = 0
+    while pos < len(data):
+        tag, pos = _read_varint(data, pos)
+        field, wire_type = tag >> 3, tag & 7
+        if wire_type == _WIRE_LEN:
+            length, pos = _read_varint(data, pos)
+            if pos + length > len(data):
+                raise DedupError("Truncated protobuf data.")
+            yield field, data[pos : pos + length]
+            pos += length
+        elif wire_type == _WIRE_VARINT:
+            value, pos = _read_varint(data, pos)
+            yield field, value
+        elif wire_type == _WIRE_I64:
+            pos += 8
+            yield field, None
+        elif wire_type == _WIRE_I32:
+            pos += 4
+            yield field, None
+        else:
+            raise DedupError(f"Unsupported protobuf wire type {wire_type}.")
+
+
+def _string(value: bytes | int | None) -> str:
+    return value.decode("utf-8") if isinstance(value, bytes) else ""
+
+
+def iter_imported_rows(container: bytes) -> Iterator[tuple[int, str, dict[str, str]]]:
+    """Yields id, file format and values of the imported rows of a DataContainer."""
+    for field, row in _iter_fields(container):
+        if field != _FIELD_IMPORTED_ROWS or not isinstance(row, bytes):
+            continue
+        row_id = 0
+        file_format = ""
+        values = {}
+        for row_field, value in _iter_fields(row):
+            if row_field == _FIELD_ROW_ID and isinstance(value, int):
+                row_id = value
+            elif row_field == _FIELD_FILE_FORMAT:
+                file_format = _string(value)
+            elif row_field == _FIELD_VALUES and isinstance(value, bytes):
+                entry = dict(_iter_fields(value))
+                values[_string(entry.get(_FIELD_MAP_KEY))] = _string(entry.get(_FIELD_MAP_VALUE))
+        yield row_id, file_format, values
+
+
+def _transaction_data(transaction: bytes) -> Iterator[bytes]:
+    """Yields the TransactionData of a single transaction or of a group's children."""
+    for field, value in _iter_fields(transaction):
+        if not isinstance(value, bytes):
+            continue
+        if field == _FIELD_SINGLE:
+            yield value
+        elif field == _FIELD_GROUP:
+            for child_field, child in _iter_fields(value):
+                if child_field == _FIELD_CHILDREN and isinstance(child, bytes):
+                    yield child
+
+
+def row_accounts(container: bytes) -> dict[int, set[int]]:
+    """Returns the ids of the accounts whose transactions refer to each imported row."""
+    accounts: dict[int, set[int]] = {}
+    for field, transaction in _iter_fields(container):
+        if field != _FIELD_TRANSACTIONS or not isinstance(transaction, bytes):
+            continue
+        for data in _transaction_data(transaction):
+            account_id = row_id = 0
+            for data_field, value in _iter_fields(data):
+                if data_field == _FIELD_ACCOUNT_ID and isinstance(value, int):
+                    account_id = value
+                elif data_field == _FIELD_IMPORTED_ROW_ID and isinstance(value, int):
+                    row_id = value
+            if row_id > 0:
+                accounts.setdefault(row_id, set()).add(account_id)
+    return accounts
+
+
+def load_container(raw: bytes) -> bytes:
+    """Returns the encoded DataContainer of a stored database file."""
+    if raw.startswith(_ENCRYPTED_HEADER):
+        raise DedupError("The database is encrypted.")
+    if raw.startswith(_GZIP_MAGIC):
+        return gzip.decompress(raw)
+    # Like the app, also accept databases saved without compression.
+    return raw
+
+
+class FingerprintIndex:
+    """Fingerprints of the existing imported rows, per file format and account.
+
+    The fingerprints of rows that no transaction refers to are stored under
+    the account None, as they are compared for every account.
+    """
+
+    def __init__(self, fingerprints: dict[str, dict[int | None, set[bytes]]]):
+        self.fingerprints = fingerprints
+
+    @classmethod
+    def build(cls, container: bytes) -> FingerprintIndex:
+        fingerprints: dict[str, dict[int | None, set[bytes]]] = {
+            name: {None: set()} for name in DEDUP_COLUMNS
+        }
+        accounts = row_accounts(container)
+        for row_id, _, values in iter_imported_rows(container):
+            row_account_ids = accounts.get(row_id) or {None}
+            # Like the import, compare regardless of the format of the existing row.
+            for name, columns in DEDUP_COLUMNS.items():
+                fp = fingerprint(columns, values)
+                if fp is None:
+                    continue
+                for account_id in row_account_ids:
+                    fingerprints[name].setdefault(account_id, set()).add(fp)
+        return cls(fingerprints)
+
+    def contains(self, file_format: str, values: dict[str, str], account_id: int | None) -> bool:
+        """Whether the import into the given account would detect the row as a duplicate."""
+        columns = DEDUP_COLUMNS.get(file_format)
+        if columns is None:
+            return False
+        fp = fingerprint(columns, values)
+        if fp is None:
+            return False
+        by_account = self.fingerprints[file_format]
+        return fp in by_account[None] or (
+            account_id is not None and fp in by_account.get(account_id, ())
+        )
+
+    def dump(self) -> bytes:
+        """Serializes the index: a JSON header line followed by the raw fingerprints."""
+        sets = [
+            (name, account_id, self.fingerprints[name][account_id])
+            for name in sorted(self.fingerprints)
+            for account_id in sorted(self.fingerprints[name], key=lambda a: -1 if a is None else a)
+        ]
+        header = {
+            "version": FORMAT_VERSION,
+            "formats": [[name, account_id, len(fps)] for name, account_id, fps in sets],
+        }
+        parts = [json.dumps(header).encode("utf-8"), b"\n"]
+        for _, _, fps in sets:
+            parts.extend(sorted(fps))
+        return b"".join(parts)
+
+    @classmethod
+    def load(cls, data: bytes) -> FingerprintIndex:
+        header_line, _, body = data.partition(b"\n")
+        header = json.loads(header_line)
+        if header.get("version") != FORMAT_VERSION:
+            raise ValueError("Unsupported index version.")
+        fingerprints: dict[str, dict[int | None, set[bytes]]] = {}
+        pos = 0
+        for name, account_id, count in header["formats"]:
+            end = pos + count * FINGERPRINT_SIZE
+            fingerprints.setdefault(name, {})[account_id] = {
+                body[i : i + FINGERPRINT_SIZE] for i in range(pos, end, FINGERPRINT_SIZE)
+            }
+            pos = end
+        if (
+            pos != len(body)
+            or set(fingerprints) != set(DEDUP_COLUMNS)
+            or any(None not in by_account for by_account in fingerprints.values())
+        ):
+            raise ValueError("Corrupt or outdated index.")
+        return cls(fingerprints)
+
+
+def _sha256_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _prune_cache(cache_dir: str) -> None:
+    entries = [e for e in os.scandir(cache_dir) if e.name.endswith(".idx")]
+    entries.sort(key=lambda e: e.stat().st_mtime, reverse=True)
+    for entry in entries[MAX_CACHED_INDEXES:]:
+        try:
+            os.unlink(entry.path)
+        except OSError:
+            pass
+
+
+def load_index(storage_file: str, cache_dir: str | None) -> FingerprintIndex:
+    """Returns the index of a stored database, from the cache if it is current."""
+    with metrics.span("dedup_index") as span:
+        file_hash = _sha256_file(storage_file)
+        cache_path = os.path.join(cache_dir, file_hash + ".idx") if cache_dir else None
+        if cache_path is not None and os.path.exists(cache_path):
+            try:
+                with open(cache_path, "rb") as f:
+                    index = FingerprintIndex.load(f.read())
+                span["cached"] = True
+                # Keep recently used indexes when pruning.
+                os.utime(cache_path)
+                return index
+            except (OSError, ValueError) as e:
+                logger.warning("Ignoring unreadable dedup index %s: %s", cache_path, e)
+
+        span["cached"] = False
+        with open(storage_file, "rb") as f:
+            index = FingerprintIndex.build(load_container(f.read()))
+        if cache_path is not None:
+            os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+            # Write atomically, so that concurrent syncs never read a partial file.
+            fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix=".index-")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(index.dump())
+                os.replace(tmp_path, cache_path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+            _prune_cache(cache_dir)
+        return index
+
+
+class Deduplicator:
+    """Drops rows that already exist in the user's database, for the import
+    into one account (or, if account_id is None, into any account)."""
+
+    def __init__(self, index: FingerprintIndex, account_id: int | None = None):
+        self.index = index
+        self.account_id = account_id
+        self.dropped = 0
+
+    def is_known(self, file_format: str, values: dict[str, str]) -> bool:
+        if self.index.contains(file_format, values, self.account_id):
+            self.dropped += 1
+            metrics.count("dedup_dropped")
+            return True
+        return False
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--dedup-storage",
+        help="Stored database (.bin file of api/storage.php) of the user. "
+        "Transactions that were already imported into it are not exported. "
+        "Ignored if the database is encrypted.",
+    )
+    parser.add_argument(
+        "--dedup-cache-dir",
+        help="Directory to cache the fingerprint index of --dedup-storage in.",
+    )
+    parser.add_argument(
+        "--dedup-account-id",
+        type=int,
+        action="append",
+        help="Id of the account in --dedup-storage that the export of an "
+        "account is imported into; specify it once per account, in the same "
+        "order. Without it, only rows that no transaction refers to are compared.",
+    )
+
+
+def check_args(args: argparse.Namespace, account_count: int) -> str | None:
+    """Returns an error message if the --dedup-* arguments do not match the accounts."""
+    if args.dedup_account_id is not None and len(args.dedup_account_id) != account_count:
+        return "Number of account indices and dedup account ids must match."
+    return None
+
+
+def from_args(args: argparse.Namespace, account_count: int) -> list[Deduplicator | None]:
+    """Sets up deduplication from the --dedup-* arguments, if requested and possible.
+
+    Returns one deduplicator (or None) per exported account, see check_args.
+    """
+    if not args.dedup_storage:
+        return [None] * account_count
+    try:
+        index = load_index(args.dedup_storage, args.dedup_cache_dir)
+    except (OSError, DedupError, ValueError) as e:
+        logger.warning("Not deduplicating against the stored database: %s", e)
+        return [None] * account_count
+    account_ids = args.dedup_account_id or [None] * account_count
+    if args.dedup_account_id:
+        logger.info("Deduplicating against the rows of the stored database.")
+    else:
+        logger.info("Deduplicating against the rows of the stored database without transactions.")
+    return [Deduplicator(index, account_id) for account_id in account_ids]
@@ -24,23 +24,84 @@ import os
 import shutil
 import tempfile
 import time
+from typing import TYPE_CHECKING
 from urllib.parse import urlencode
 
+import metrics
+from resource_policy import NetworkFilter, ResourcePolicy
+
+if TYPE_CHECKING:
+    from browser_pool import BrowserLease
+    from profile_cache import ProfileLease
+
 logger = logging.getLogger(__name__)
 
 FRC_INPUT_SELECTOR = 'input[name="frc-captcha-response"]'
 FRC_WIDGET_SELECTOR = "iframe.frc-i-widget"
 DKB_LOGIN_URL = "https://banking.dkb.de/login"
 API_BASE_URL = "https://banking.dkb.de/api"
+# Origins whose storage is wiped before a pooled browser is handed back, in
+# addition to those of any DKB cookies found.
+DKB_ORIGINS = ("https://banking.dkb.de", "https://www.dkb.de", "https://dkb.de")
 
 # A Friendly Captcha token is long (~470 chars). Anything shorter is the empty
 # placeholder value or an intermediate state.
 MIN_TOKEN_LENGTH = 400
 
-# JS run inside the DKB page. `p` (url/method/headers/body) is injected by the
-# caller. The result is stashed on window so Python can poll for it, sidestepping
-# any quirks around awaiting promises through the CDP bridge.
-_FETCH_JS = """
+# Transports for the in-page fetch, see DkbBrowser.request.
+TRANSPORT_AWAIT = "await"
+TRANSPORT_POLL = "poll"
+TRANSPORTS = (TRANSPORT_AWAIT, TRANSPORT_POLL)
+
+# Seconds to wait for the captcha widget to appear on the login page.
+WIDGET_TIMEOUT = 30
+
+# Upper bounds (in ms) of the buckets of the request latency histogram.
+LATENCY_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# Response bodies longer than this (in UTF-16 code units, i.e. JS string
+# length) are not returned with the fetch result, but read back from the page
+# in chunks of this size, one CDP round trip each. This keeps every CDP message
+# bounded (the bridge rejects messages over 256 MiB) and leaves the result
+# envelope with just the metadata, so a body is not JSON-encoded into it and
+# JSON-decoded out of it again before the API's JSON is parsed.
+BODY_CHUNK_CHARS = 2**20
+
+# JS function that turns a fetched body into the result object: small bodies
+# are included, larger ones are split into chunks of at most p.chunkChars (never
+# within a surrogate pair) and kept on window until read by
+# DkbBrowser._read_body.
+_RESULT_JS = """
+function dkbResult(p, status, t, ct) {
+  if (t.length <= p.inlineMax) { return { status: status, body: t, ct: ct }; }
+  var chunks = [];
+  for (var i = 0; i < t.length; ) {
+    var end = Math.min(i + p.chunkChars, t.length);
+    var c = t.charCodeAt(end - 1);
+    if (end < t.length && c >= 0xD800 && c <= 0xDBFF) { end--; }
+    chunks.push(t.slice(i, end));
+    i = end;
+  }
+  var s = window.__dkb_bodies || (window.__dkb_bodies = { next: 0 });
+  var id = ++s.next;
+  s[id] = chunks;
+  return { status: status, body: null, ct: ct, bodyId: id, chunks: chunks.length, size: t.length };
+}
+"""
+
+# JS expression that returns one chunk of a kept body as a plain string, and
+# forgets the body after its last chunk. Evaluates to null if it is gone.
+_READ_CHUNK_JS = (
+    "(function () { var s = window.__dkb_bodies; var c = s && s[%d];"
+    " if (!c) { return null; } var t = c[%d]; c[%d] = null;"
+    " if (%d === c.length - 1) { delete s[%d]; } return t; })()"
+)
+
+# JS run inside the DKB page (polling transport). `p` (url/method/headers/body
+# and the chunking parameters) is injected by the caller. The result is stashed
+# on window so Python can poll for it, sidestepping any quirks around awaiting
+# promises through the CDP bridge.
+_FETCH_JS = _RESULT_JS + """
 window.__dkb_done = false;
 window.__dkb_result = null;
 var headers = p.headers || {};
@@ -52,7 +113,7 @@ fetch(p.url, opts).then(function (r) {
   var status = r.status;
   var ct = r.headers.get('content-type') || '';
   return r.text().then(function (t) {
-    window.__dkb_result = { status: status, body: t, ct: ct };
+    window.__dkb_result = dkbResult(p, status, t, ct);
     window.__dkb_done = true;
   });
 }).catch(function (e) {
@@ -61,11 +122,151 @@ fetch(p.url, opts).then(function (r) {
 });
 """
 
+# JS function used by the await transport: runs a single fetch described by `p`
+# (url/method/headers/body/timeoutMs and the chunking parameters) and resolves
+# to a plain result object.
+_FETCH_FN_JS = _RESULT_JS + """
+async function dkbFetch(p) {
+  var headers = p.headers || {};
+  var m = document.cookie.match(/__Host-xsrf=([^;]+)/);
+  if (m) { headers['x-xsrf-token'] = decodeURIComponent(m[1]); }
+  var ctrl = new AbortController();
+  var timer = setTimeout(function () { ctrl.abort(); }, p.timeoutMs);
+  var opts = { method: p.method, headers: headers, credentials: 'include', signal: ctrl.signal };
+  if (p.body !== null) { opts.body = p.body; }
+  try {
+    var r = await fetch(p.url, opts);
+    var t = await r.text();
+    return dkbResult(p, r.status, t, r.headers.get('content-type') || '');
+  } catch (e) {
+    return { status: -1, body: String(e), ct: '', timedOut: ctrl.signal.aborted };
+  } finally {
+    clearTimeout(timer);
+  }
+}
+"""
+
+# JS expression evaluated inside the DKB page (await transport). Resolves to the
+# JSON-encoded result, so status, content type and (unless it is read in
+# chunks) the body come back in the same CDP round trip that started the fetch.
+_FETCH_AWAIT_JS = (
+    "(async function () {"
+    + _FETCH_FN_JS
+    + "return JSON.stringify(await dkbFetch(%s)); })()"
+)
+
+# Like _FETCH_AWAIT_JS, but runs a list of fetches with at most `limit` of them
+# in flight at once, and resolves to the list of results in input order.
+_FETCH_MANY_JS = (
+    "(async function () {"
+    + _FETCH_FN_JS
+    + """
+  var ps = %s;
+  var limit = %d;
+  var results = new Array(ps.length);
+  var next = 0;
+  async function worker() {
+    while (next < ps.length) {
+      var i = next++;
+      results[i] = await dkbFetch(ps[i]);
+    }
+  }
+  var workers = [];
+  for (var k = 0; k < Math.min(limit, ps.length); k++) { workers.push(worker()); }
+  await Promise.all(workers);
+  return JSON.stringify(results);
+})()
+"""
+)
+
+# JS expression that resolves as soon as the page reaches a state, instead of
+# having Python poll for it. The state is described by the body of `check()`,
+# which returns a non-null value once reached. It is re-checked on every DOM
+# mutation and Friendly Captcha event, and on a short in-page interval as a
+# safety net for changes that no observer sees (e.g. an input's value property
+# or a closed shadow root). Resolves to the JSON-encoded
+# {value, waitedMs}; value is null on timeout.
+_WAIT_FOR_JS = """
+(function () {
+  var timeoutMs = %d;
+  function check() { %s }
+  var events = ['frc:widget.complete', 'frc:widget.statechange', 'input', 'change', 'load'];
+  return new Promise(function (resolve) {
+    var start = performance.now();
+    var done = false;
+    var observer, ticker, timer;
+    function finish(value) {
+      if (done) { return; }
+      done = true;
+      observer.disconnect();
+      clearInterval(ticker);
+      clearTimeout(timer);
+      events.forEach(function (e) { document.removeEventListener(e, attempt, true); });
+      resolve(JSON.stringify({ value: value, waitedMs: Math.round(performance.now() - start) }));
+    }
+    function attempt() {
+      var value = null;
+      try { value = check(); } catch (e) {}
+      if (value !== null && value !== undefined) { finish(value); }
+    }
+    observer = new MutationObserver(attempt);
+    observer.observe(document.documentElement, { childList: true, subtree: true, attributes: true });
+    events.forEach(function (e) { document.addEventListener(e, attempt, true); });
+    ticker = setInterval(attempt, 100);
+    timer = setTimeout(function () { finish(null); }, timeoutMs);
+    attempt();
+  });
+})()
+"""
+
+# check() bodies for _WAIT_FOR_JS. They must not change the page, since they
+# run on every mutation.
+_WIDGET_CHECK_JS = "return document.querySelector('%s') ? 'found' : null;" % FRC_WIDGET_SELECTOR
+_TOKEN_CHECK_JS = (
+    "var el = document.querySelector('%s');"
+    "return el && el.value && el.value.length > %d ? el.value : null;"
+    % (FRC_INPUT_SELECTOR, MIN_TOKEN_LENGTH)
+)
+
 
 class ApiError(Exception):
     """Raised when a DKB API call returns a non-2xx status."""
 
 
+class _TransportUnavailable(Exception):
+    """Raised when the await transport is not supported by the CDP bridge."""
+
+
+class _LatencyHistogram:
+    """Counts request latencies per transport in fixed buckets."""
+
+    def __init__(self, buckets_ms: tuple[int, ...] = LATENCY_BUCKETS_MS):
+        self.buckets_ms = buckets_ms
+        self.counts: dict[str, list[int]] = {}
+        self.totals: dict[str, float] = {}
+
+    def record(self, transport: str, seconds: float) -> None:
+        counts = self.counts.setdefault(transport, [0] * (len(self.buckets_ms) + 1))
+        ms = seconds * 1000
+        for i, bound in enumerate(self.buckets_ms):
+            if ms <= bound:
+                counts[i] += 1
+                break
+        else:
+            counts[-1] += 1
+        self.totals[transport] = self.totals.get(transport, 0.0) + seconds
+
+    def format(self, transport: str) -> str:
+        counts = self.counts.get(transport)
+        if not counts:
+            return f"{transport}: no requests"
+        labels = [f"<={b}ms" for b in self.buckets_ms] + [f">{self.buckets_ms[-1]}ms"]
+        n = sum(counts)
+        mean_ms = self.totals[transport] * 1000 / n
+        buckets = " ".join(f"{label}:{c}" for label, c in zip(labels, counts) if c)
+        return f"{transport}: n={n} mean={mean_ms:.0f}ms {buckets}"
+
+
 class _Response:
     """Minimal requests-like response wrapper around an in-page fetch result."""
 
@@ -87,14 +288,49 @@ class DkbBrowser:
         request_timeout: int = 60,
         headless: bool = False,
         xvfb: bool = False,
+        binary_location: str | None = None,
+        transport: str = TRANSPORT_AWAIT,
+        max_concurrency: int = 4,
+        pool_dir: str | None = None,
+        resource_policy: ResourcePolicy | None = None,
+        profile_cache_dir: str | None = None,
+        profile_cache_max_bytes: int | None = None,
+        solve_captcha: bool = True,
     ):
+        if transport not in TRANSPORTS:
+            raise ValueError(f"Unknown transport: {transport}")
         self.captcha_timeout = captcha_timeout
         self.request_timeout = request_timeout
         self.headless = headless
         self.xvfb = xvfb
+        self.binary_location = binary_location
+        self.transport = transport
+        self.max_concurrency = max_concurrency
+        self.latencies = _LatencyHistogram()
+        self.pool_dir = pool_dir
+        # Applied to the login page until the captcha is solved; None loads
+        # everything, as a normal browser would. Opt-in until a measured run
+        # (benchmarks/dkb_login_page.py) shows the login still works and is
+        # faster with it.
+        self.resource_policy = resource_policy
+        # Keeps Chrome's caches between syncs of browsers launched here.
+        self.profile_cache_dir = profile_cache_dir
+        self.profile_cache_max_bytes = profile_cache_max_bytes
+        # Whether entering the context solves the captcha. If not, e.g. when a
+        # stored refresh token is tried first, call solve_captcha() when needed.
+        self.solve_captcha_on_enter = solve_captcha
         self.captcha_token: str | None = None
+        # Seconds from entering the context until each startup milestone.
+        self.startup_timings: dict[str, float] = {}
         self._sb_cm = None
         self.sb = None
+        # The CDP methods of the browser (seleniumbase's sb.cdp, or a CDP-only
+        # session attached to a pooled browser).
+        self.cdp = None
+        self._lease: BrowserLease | None = None
+        self._network_filter: NetworkFilter | None = None
+        self._profile_lease: ProfileLease | None = None
+        self._start_time = 0.0
         self._workdir: str | None = None
         self._orig_cwd: str | None = None
         self._orig_home: str | None = None
@@ -103,6 +339,7 @@ class DkbBrowser:
     # -- lifecycle ---------------------------------------------------------
 
     def __enter__(self) -> "DkbBrowser":
+        self._start_time = time.monotonic()
         try:
             from seleniumbase import SB
         except ImportError as exc:  # pragma: no cover - environment dependent
@@ -132,9 +369,51 @@ class DkbBrowser:
         os.environ["HOME"] = self._workdir
 
         try:
-            self._sb_cm = SB(uc=True, locale="de", headless=self.headless, xvfb=self.xvfb)
-            self.sb = self._sb_cm.__enter__()
-            self._open_and_solve_captcha()
+            with metrics.span("browser_launch") as launch:
+                if not (self.pool_dir and self._attach_pooled()):
+                    self._sb_cm = SB(
+                        uc=True,
+                        locale="de",
+                        headless=self.headless,
+                        xvfb=self.xvfb,
+                        binary_location=self.binary_location,
+                        **self._profile_options(),
+                    )
+                    self.sb = self._sb_cm.__enter__()
+                launch["pooled"] = self._lease is not None
+                if self._profile_lease is not None:
+                    launch["profile_cached_bytes"] = self._profile_lease.cached_bytes
+            self._mark_startup("browser")
+            self._start_network_filter()
+            with metrics.span("captcha") as captcha:
+                logger.info(
+                    "Opening DKB login page%s ...",
+                    " and solving Friendly Captcha" if self.solve_captcha_on_enter else "",
+                )
+                if self.sb is not None:
+                    self.sb.open(DKB_LOGIN_URL)
+                    self.cdp = self.sb.cdp
+                else:
+                    self.cdp.open(DKB_LOGIN_URL)
+                self._mark_startup("login_page")
+                captcha["resource_policy"] = self._network_filter is not None
+                captcha["login_page"] = round(self.startup_timings["login_page"], 3)
+                if self.solve_captcha_on_enter:
+                    self._solve_captcha()
+                    captcha["captcha_ready"] = round(self.startup_timings["captcha_ready"], 3)
+                else:
+                    captcha["skipped"] = True
+                # The API calls that follow need nothing to be blocked.
+                self._stop_network_filter(captcha)
+            logger.info(
+                "Browser startup (%s): browser %.2fs, login page %.2fs, "
+                "captcha ready %.2fs, captcha solved %.2fs",
+                "pooled" if self._lease else "cold",
+                self.startup_timings.get("browser", -1),
+                self.startup_timings.get("login_page", -1),
+                self.startup_timings.get("captcha_ready", -1),
+                self.startup_timings.get("captcha_solved", -1),
+            )
         except BaseException:
             # __exit__ is not called if __enter__ raises; clean up here.
             self.__exit__(None, None, None)
@@ -142,11 +421,20 @@ class DkbBrowser:
         return self
 
     def __exit__(self, *exc_info):
+        for transport in self.latencies.counts:
+            logger.debug("Request latencies: %s", self.latencies.format(transport))
         try:
+            self._stop_network_filter()
+            if self._lease is not None:
+                self._recycle_pooled()
             if self._sb_cm is not None:
                 return self._sb_cm.__exit__(*exc_info)
             return False
         finally:
+            if self._profile_lease is not None:
+                # Only now that the browser quit.
+                self._profile_lease.release()
+                self._profile_lease = None
             if self._orig_cwd:
                 os.chdir(self._orig_cwd)
             if self._home_was_set:
@@ -156,27 +444,165 @@ class DkbBrowser:
             if self._workdir:
                 shutil.rmtree(self._workdir, ignore_errors=True)
 
-    # -- captcha -----------------------------------------------------------
+    def _mark_startup(self, milestone: str) -> None:
+        self.startup_timings[milestone] = time.monotonic() - self._start_time
+
+    # -- profile cache -----------------------------------------------------
+
+    def _profile_options(self) -> dict:
+        """SB options to launch the browser with a cached profile, if enabled."""
+        if not self.profile_cache_dir:
+            return {}
+        # Only needed with a profile cache.
+        from profile_cache import DEFAULT_MAX_BYTES, ProfileCache
+
+        max_bytes = self.profile_cache_max_bytes or DEFAULT_MAX_BYTES
+        lease = ProfileCache(self.profile_cache_dir, max_bytes).acquire()
+        if lease is None:
+            logger.info("All cached profiles are in use, using a fresh one.")
+            return {}
+        self._profile_lease = lease
+        logger.debug("Using cached profile with %d bytes of cache", lease.cached_bytes)
+        # Chrome evicts from its HTTP cache itself while running; the other
+        # caches are trimmed when the profile is released.
+        return {
+            "user_data_dir": lease.profile_dir,
+            "chromium_arg": f"--disk-cache-size={max_bytes}",
+        }
+
+    # -- resource policy ---------------------------------------------------
+
+    def _debugger_address(self) -> tuple[str, int] | None:
+        if self._lease is not None:
+            return self._lease.host, self._lease.port
+        address = self.sb.driver.capabilities.get("goog:chromeOptions", {}).get("debuggerAddress")
+        if not address:
+            return None
+        host, _, port = address.rpartition(":")
+        return host, int(port)
+
+    def _start_network_filter(self) -> None:
+        """Applies the resource policy to the browser, if enabled."""
+        if self.resource_policy is None:
+            return
+        try:
+            address = self._debugger_address()
+            if address is None:
+                raise RuntimeError("remote debugging address unknown")
+            network_filter = NetworkFilter(self.resource_policy, *address)
+            network_filter.start()
+        except Exception as e:
+            # The login works without it, just slower.
+            logger.warning("Could not apply the resource policy: %s", e)
+            return
+        self._network_filter = network_filter
+
+    def _stop_network_filter(self, span: dict | None = None) -> None:
+        network_filter, self._network_filter = self._network_filter, None
+        if network_filter is None:
+            return
+        network_filter.stop()
+        logger.info("Login page: %s", network_filter.summary())
+        if span is not None:
+            span["page_requests"] = network_filter.requests
+            span["page_blocked"] = sum(network_filter.blocked.values())
+            span["page_bytes"] = network_filter.bytes_received
+
+    # -- browser pool ------------------------------------------------------
+
+    def _attach_pooled(self) -> bool:
+        """Leases a pre-launched browser from the pool and attaches to it."""
+        # Only needed with a pool; also imports the manager's dependencies.
+        from browser_pool import BrowserPool
+
+        lease = BrowserPool(self.pool_dir).acquire()
+        if lease is None:
+            logger.info("No idle browser in the pool, launching a new one.")
+            return False
+        try:
+            from seleniumbase import sb_cdp
+
+            self.cdp = sb_cdp.Chrome(host=lease.host, port=lease.port)
+        except Exception:
+            logger.warning(
+                "Could not attach to pooled browser, launching a new one.", exc_info=True
+            )
+            lease.release(healthy=False)
+            return False
+        self._lease = lease
+        return True
+
+    def _recycle_pooled(self) -> None:
+        """Wipes the session from the pooled browser and returns it to the pool."""
+        healthy = True
+        try:
+            # The CDP bindings that ship with seleniumbase.
+            from mycdp import network, storage
 
-    def _open_and_solve_captcha(self) -> None:
-        logger.info("Opening DKB login page and solving Friendly Captcha ...")
-        self.sb.open(DKB_LOGIN_URL)
+            cdp = self.cdp
+            for origin in self._dkb_origins():
+                cdp.loop.run_until_complete(
+                    cdp.page.send(storage.clear_data_for_origin(origin=origin, storage_types="all"))
+                )
+            cdp.loop.run_until_complete(cdp.page.send(network.clear_browser_cookies()))
+            cdp.open("about:blank")
+        except Exception:
+            logger.warning("Could not clean up pooled browser, retiring it.", exc_info=True)
+            healthy = False
+        self._lease.release(healthy=healthy)
+        self._lease = None
+
+    def _dkb_origins(self) -> list[str]:
+        """Returns the DKB origins the session may have stored data for."""
+        origins = list(DKB_ORIGINS)
+        for cookie in self.cdp.get_all_cookies():
+            domain = cookie.domain.lstrip(".")
+            origin = f"https://{domain}"
+            if (domain == "dkb.de" or domain.endswith(".dkb.de")) and origin not in origins:
+                origins.append(origin)
+        return origins
+
+    # -- session ---------------------------------------------------------
+
+    def session_state(self) -> tuple[list[dict], str]:
+        """Returns the cookies and user agent of the browser, to continue its
+        session with another HTTP client (see transport.py)."""
+        cookies = [
+            {"name": c.name, "value": c.value, "domain": c.domain, "path": c.path}
+            for c in self.cdp.get_all_cookies()
+        ]
+        return cookies, self.cdp.evaluate("navigator.userAgent")
+
+    # -- captcha -----------------------------------------------------------
 
+    def solve_captcha(self) -> None:
+        """Solves the captcha of the login page, if not done yet."""
+        if self.captcha_token:
+            return
+        with metrics.span("captcha"):
+            logger.info("Solving Friendly Captcha ...")
+            self._solve_captcha()
+
+    def _solve_captcha(self) -> None:
+        if not self._wait_for_widget():
+            logger.warning("captcha: widget not found, trying to click it anyway")
         # A plain JS .click() does not propagate into the cross-origin iframe,
-        # so we use a real mouse click that reaches the checkbox inside it.
-        for _ in range(30):
+        # so we use a real mouse click that reaches the checkbox inside it. The
+        # cookie banner would cover the widget, so it is dismissed first.
+        for _ in range(3):
             self._dismiss_cookie_banner()
             try:
-                elem = self.sb.cdp.find_element(FRC_WIDGET_SELECTOR)
+                elem = self.cdp.find_element(FRC_WIDGET_SELECTOR)
                 elem.scroll_into_view()
-                time.sleep(0.5)
                 elem.mouse_click()
                 logger.debug("captcha: widget clicked")
                 break
             except Exception:
                 time.sleep(1)
+        self._mark_startup("captcha_ready")
 
-        self.captcha_token = self._poll_frc_token()
+        self.captcha_token = self._wait_for_token()
+        self._mark_startup("captcha_solved")
         if not self.captcha_token:
             raise RuntimeError(
                 "Failed to obtain a Friendly Captcha token from the DKB login "
@@ -184,10 +610,43 @@ class DkbBrowser:
                 "detected as a bot."
             )
 
+    def _wait_in_page(self, check_js: str, timeout: int) -> str | None:
+        """Waits until the page reaches the state described by check_js.
+
+        Returns the value produced by check_js, or None on timeout. Raises
+        _TransportUnavailable if the CDP bridge cannot await promises."""
+        result = json.loads(self._evaluate_await(_WAIT_FOR_JS % (timeout * 1000, check_js)))
+        return result["value"]
+
+    def _wait_for_widget(self) -> bool:
+        start = time.monotonic()
+        if self.transport == TRANSPORT_AWAIT:
+            try:
+                found = self._wait_in_page(_WIDGET_CHECK_JS, WIDGET_TIMEOUT) is not None
+                logger.debug(
+                    "captcha: widget %s after %.2fs",
+                    "present" if found else "missing",
+                    time.monotonic() - start,
+                )
+                return found
+            except _TransportUnavailable as e:
+                logger.debug("captcha: cannot await page state (%s), polling", e)
+        for _ in range(WIDGET_TIMEOUT):
+            try:
+                if self.cdp.evaluate(f"!!document.querySelector('{FRC_WIDGET_SELECTOR}')"):
+                    logger.debug(
+                        "captcha: widget present after %.2fs", time.monotonic() - start
+                    )
+                    return True
+            except Exception:
+                pass
+            time.sleep(1)
+        return False
+
     def _dismiss_cookie_banner(self) -> None:
         for button in ("button.uc-deny-button", "button.uc-accept-button"):
             try:
-                self.sb.cdp.evaluate(
+                self.cdp.evaluate(
                     "document.querySelector('#usercentrics-cmp-ui')"
                     f".shadowRoot.querySelector('{button}').click()"
                 )
@@ -196,15 +655,39 @@ class DkbBrowser:
             except Exception:
                 continue
 
-    def _poll_frc_token(self) -> str | None:
+    def _wait_for_token(self) -> str | None:
         logger.debug("captcha: waiting up to %ds for token", self.captcha_timeout)
+        start = time.monotonic()
+        if self.transport == TRANSPORT_AWAIT:
+            try:
+                token = self._wait_in_page(_TOKEN_CHECK_JS, self.captcha_timeout)
+            except _TransportUnavailable as e:
+                logger.debug("captcha: cannot await page state (%s), polling", e)
+            else:
+                if token:
+                    logger.debug(
+                        "captcha: token obtained (%d chars) after %.2fs",
+                        len(token),
+                        time.monotonic() - start,
+                    )
+                else:
+                    logger.error("captcha: timed out waiting for token")
+                return token
+        return self._poll_frc_token()
+
+    def _poll_frc_token(self) -> str | None:
+        start = time.monotonic()
         for _ in range(self.captcha_timeout):
             try:
-                val = self.sb.cdp.evaluate(
+                val = self.cdp.evaluate(
                     f"document.querySelector('{FRC_INPUT_SELECTOR}').value"
                 )
                 if val and len(val) > MIN_TOKEN_LENGTH:
-                    logger.debug("captcha: token obtained (%d chars)", len(val))
+                    logger.debug(
+                        "captcha: token obtained (%d chars) after %.2fs",
+                        len(val),
+                        time.monotonic() - start,
+                    )
                     return val
             except Exception:
                 pass
@@ -214,10 +697,10 @@ class DkbBrowser:
 
     # -- HTTP transport (in-page fetch) ------------------------------------
 
-    def request(
-        self, method: str, path: str, data: dict | None = None, json_body: dict | None = None
-    ) -> _Response:
-        """Issue an API call from inside the browser page and return the response."""
+    @staticmethod
+    def _build_payload(
+        method: str, path: str, data: dict | None = None, json_body: dict | None = None
+    ) -> dict:
         headers: dict[str, str] = {}
         body: str | None = None
         if json_body is not None:
@@ -228,30 +711,209 @@ class DkbBrowser:
             body = urlencode(data)
             headers["Content-Type"] = "application/x-www-form-urlencoded"
 
-        payload = {
+        return {
             "url": API_BASE_URL + path,
             "method": method.upper(),
             "headers": headers,
             "body": body,
         }
-        script = "(function(){var p=" + json.dumps(payload) + ";" + _FETCH_JS + "})();"
-        self.sb.cdp.evaluate(script)
 
-        for _ in range(self.request_timeout * 2):
-            if self.sb.cdp.evaluate("window.__dkb_done === true"):
-                break
-            time.sleep(0.5)
-        else:
-            raise TimeoutError(f"In-browser fetch to {path} timed out")
-
-        raw = self.sb.cdp.evaluate("JSON.stringify(window.__dkb_result)")
-        result = json.loads(raw)
+    @staticmethod
+    def _to_response(result: dict, path: str) -> _Response:
         status = result.get("status")
         text = result.get("body") or ""
-        logger.debug("Response: %s - %s", status, text[:100])
-
+        if result.get("timedOut"):
+            raise TimeoutError(f"In-browser fetch to {path} timed out")
         if status is None or not 200 <= status < 300:
             raise ApiError(
                 f"Unsuccessful response code for {path}: {status} - {text[:200]}"
             )
         return _Response(status, text, result.get("ct") or "")
+
+    @staticmethod
+    def _count_traffic(payloads: list[dict], results: list[dict]) -> None:
+        metrics.count("requests", len(payloads))
+        metrics.count("bytes_sent", sum(len(p["body"] or "") for p in payloads))
+        metrics.count("bytes_received", sum(len(r.get("body") or "") for r in results))
+
+    def _fall_back_to_polling(self, error: Exception) -> None:
+        logger.warning(
+            "Awaiting in-page fetch is not supported (%s), falling back to polling.",
+            error,
+        )
+        self.transport = TRANSPORT_POLL
+
+    def request(
+        self, method: str, path: str, data: dict | None = None, json_body: dict | None = None
+    ) -> _Response:
+        """Issue an API call from inside the browser page and return the response."""
+        payload = self._build_payload(method, path, data, json_body)
+        transport = self.transport
+        start = time.monotonic()
+        if transport == TRANSPORT_AWAIT:
+            try:
+                result = self._fetch_await(payload, path)
+            except _TransportUnavailable as e:
+                self._fall_back_to_polling(e)
+                transport = self.transport
+                if payload["method"] != "GET":
+                    # The request may have been sent already, so don't risk
+                    # repeating a non-idempotent call.
+                    raise ApiError(f"In-browser fetch to {path} failed: {e}") from e
+                metrics.count("retries")
+                start = time.monotonic()
+                result = self._fetch_poll(payload, path)
+        else:
+            result = self._fetch_poll(payload, path)
+        elapsed = time.monotonic() - start
+        self.latencies.record(transport, elapsed)
+        self._count_traffic([payload], [result])
+
+        logger.debug(
+            "Response: %s - %s (%.0f ms via %s)",
+            result.get("status"),
+            (result.get("body") or "")[:100],
+            elapsed * 1000,
+            transport,
+        )
+        return self._to_response(result, path)
+
+    def request_many(
+        self, calls: list[dict], max_concurrency: int | None = None
+    ) -> list[_Response | Exception]:
+        """Issue several independent API calls at once.
+
+        Each call is a dict with the keyword arguments of request() (method,
+        path and optionally data/json_body). All fetches are started in one
+        evaluation, with at most `max_concurrency` of them in flight at once.
+        Returns one entry per call, in input order: the response, or the
+        ApiError/TimeoutError that request() would have raised for it.
+        """
+        if not calls:
+            return []
+        limit = max(1, max_concurrency or self.max_concurrency)
+        payloads = [self._build_payload(**call) for call in calls]
+
+        if self.transport == TRANSPORT_AWAIT:
+            start = time.monotonic()
+            try:
+                results = self._fetch_many_await(payloads, limit)
+            except _TransportUnavailable as e:
+                self._fall_back_to_polling(e)
+                if any(p["method"] != "GET" for p in payloads):
+                    raise ApiError(f"In-browser batch fetch failed: {e}") from e
+                metrics.count("retries", len(payloads))
+            else:
+                for call, result in zip(calls, results):
+                    self._read_body(result, call["path"])
+                elapsed = time.monotonic() - start
+                self.latencies.record(f"{TRANSPORT_AWAIT}-batch", elapsed)
+                self._count_traffic(payloads, results)
+                logger.debug(
+                    "Batch of %d responses (limit %d): %s (%.0f ms)",
+                    len(results),
+                    limit,
+                    [r.get("status") for r in results],
+                    elapsed * 1000,
+                )
+                responses: list[_Response | Exception] = []
+                for call, result in zip(calls, results):
+                    try:
+                        responses.append(self._to_response(result, call["path"]))
+                    except (ApiError, TimeoutError) as e:
+                        responses.append(e)
+                return responses
+
+        # Polling transport: the page can only track one fetch at a time.
+        responses = []
+        for call in calls:
+            try:
+                responses.append(self.request(**call))
+            except (ApiError, TimeoutError) as e:
+                responses.append(e)
+        return responses
+
+    def _evaluate_await(self, script: str) -> str:
+        """Evaluates a promise-returning expression and returns its string result."""
+        try:
+            cdp = self.cdp
+            raw = cdp.loop.run_until_complete(
+                cdp.page.evaluate(script, await_promise=True, return_by_value=True)
+            )
+        except (AttributeError, TypeError) as e:
+            # Older seleniumbase versions don't expose the page/loop or don't
+            # support awaiting promises.
+            raise _TransportUnavailable(str(e)) from e
+        if not isinstance(raw, str):
+            raise _TransportUnavailable(f"unexpected evaluation result: {raw!r}"[:200])
+        return raw
+
+    def _read_body(self, result: dict, path: str) -> dict:
+        """Fills in the body of a result whose body was kept in the page.
+
+        Each chunk is returned as a plain string, so the body is decoded from
+        the CDP messages once, and only parsed as JSON by the caller.
+        """
+        body_id = result.get("bodyId")
+        if body_id is None:
+            return result
+        chunks = []
+        for i in range(result["chunks"]):
+            chunk = self.cdp.evaluate(_READ_CHUNK_JS % (body_id, i, i, i, body_id))
+            if not isinstance(chunk, str):
+                raise ApiError(f"Response body of {path} is no longer available in the page")
+            chunks.append(chunk)
+        metrics.count("body_chunks", len(chunks))
+        result["body"] = "".join(chunks)
+        return result
+
+    def _fetch_await(self, payload: dict, path: str) -> dict:
+        """Runs the fetch and returns its result, in a single CDP evaluation
+        unless the body is read in chunks."""
+        script = _FETCH_AWAIT_JS % json.dumps(
+            {
+                **payload,
+                "timeoutMs": self.request_timeout * 1000,
+                "chunkChars": BODY_CHUNK_CHARS,
+                "inlineMax": BODY_CHUNK_CHARS,
+            }
+        )
+        return self._read_body(json.loads(self._evaluate_await(script)), path)
+
+    def _fetch_many_await(self, payloads: list[dict], limit: int) -> list[dict]:
+        """Runs the fetches and returns their results. The bodies of results
+        with a bodyId still have to be read with _read_body."""
+        timeout_ms = self.request_timeout * 1000
+        # All included bodies together stay within one chunk.
+        inline_max = BODY_CHUNK_CHARS // len(payloads)
+        script = _FETCH_MANY_JS % (
+            json.dumps(
+                [
+                    {
+                        **p,
+                        "timeoutMs": timeout_ms,
+                        "chunkChars": BODY_CHUNK_CHARS,
+                        "inlineMax": inline_max,
+                    }
+                    for p in payloads
+                ]
+            ),
+            limit,
+        )
+        return json.loads(self._evaluate_await(script))
+
+    def _fetch_poll(self, payload: dict, path: str) -> dict:
+        """Starts the fetch, then polls the page until the result is available."""
+        payload = {**payload, "chunkChars": BODY_CHUNK_CHARS, "inlineMax": BODY_CHUNK_CHARS}
+        script = "(function(){var p=" + json.dumps(payload) + ";" + _FETCH_JS + "})();"
+        self.cdp.evaluate(script)
+
+        for _ in range(self.request_timeout * 2):
+            if self.cdp.evaluate("window.__dkb_done === true"):
+                break
+            time.sleep(0.5)
+        else:
+            raise TimeoutError(f"In-browser fetch to {path} timed out")
+
+        raw = self.cdp.evaluate("JSON.stringify(window.__dkb_result)")
+        return self._read_body(json.loads(raw), path)
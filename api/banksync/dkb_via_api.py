@@ -6,19 +6,82 @@ import logging
 import os
 import sys
 import time
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
+from datetime import date, timedelta
 from getpass import getpass
-
-import pandas as pd
-
-from dkb_captcha import DkbBrowser
+from typing import Iterator
+from urllib.parse import urlencode, urlsplit
+
+# Note: pandas is imported lazily in export_transactions, since it alone takes
+# longer to import than everything else. See benchmarks/import_time.py.
+import dedup
+import imported_rows
+import metrics
+import resource_policy
+import token_store
+from checkpoints import AccountCheckpoint, CheckpointStore, is_token
+from dedup import Deduplicator
+from dkb_captcha import TRANSPORT_AWAIT, TRANSPORTS, ApiError, DkbBrowser
+from imported_rows import RowWriter
+from polling import PollSchedule, StepSchedule
+from token_store import TokenStore
+from transport import API_TRANSPORT_AUTO, API_TRANSPORTS, select_transport
+from worker_client import forward_cli
 
 logger = logging.getLogger(__name__)
 
-# All API calls go through a real browser (DkbBrowser) via in-page fetch, so we
+# The login goes through a real browser (DkbBrowser) via in-page fetch, so we
 # inherit DKB's MyraSecurity WAF clearance, TLS fingerprint, cookies and XSRF
-# token. The active browser session is stored here for do_get/do_post to use.
+# token. The active browser session is stored here.
 browser: DkbBrowser | None = None
+# What do_get/do_post use: the browser, or after the login possibly a direct
+# HTTP client continuing its session (see transport.py).
+transport = None
+
+# Margin subtracted from --from-date for the server-side booking date filter.
+DATE_FILTER_MARGIN = timedelta(days=14)
+
+# How long to wait for the user to approve the MFA challenge, at most.
+MFA_MAX_DURATION = 60  # seconds
+# Poll densely while an approval is most likely, then back off.
+MFA_POLL_SCHEDULE = StepSchedule(steps=((10.0, 0.5), (30.0, 1.0)), final=3.0)
+# How a run logged in, as recorded in the "login_path" metrics event.
+LOGIN_PATH_REFRESH = "refresh"
+LOGIN_PATH_FULL = "full"
+# Columns of the export, in order.
+EXPORT_COLUMNS = [
+    "id",
+    "status",
+    # date
+    "bookingDate",
+    "valueDate",  # <-- probably the one i want
+    # amount
+    "amount.currencyCode",
+    "amount.value",
+    # reason
+    "description",
+    # who
+    "other.name",
+    "other.iban",
+    # bookingText
+    "transactionType",
+]
+# Where the columns of the export (and the parties that other.* are chosen
+# from) are found in the attributes of a transaction.
+_EXPORT_ATTRIBUTES = {
+    "status": ("status",),
+    "bookingDate": ("bookingDate",),
+    "valueDate": ("valueDate",),
+    "amount.currencyCode": ("amount", "currencyCode"),
+    "amount.value": ("amount", "value"),
+    "description": ("description",),
+    "transactionType": ("transactionType",),
+    "debtor.name": ("debtor", "name"),
+    "debtor.iban": ("debtor", "debtorAccount", "iban"),
+    "creditor.name": ("creditor", "name"),
+    "creditor.iban": ("creditor", "creditorAccount", "iban"),
+}
 
 
 def _parse(resp) -> object | str:
@@ -30,11 +93,20 @@ def _parse(resp) -> object | str:
 
 
 def do_get(url: str) -> object | str:
-    return _parse(browser.request("GET", url))
+    return _parse(transport.request("GET", url))
 
 
 def do_post(url: str, data: dict | None = None, json: dict | None = None) -> object | str:
-    return _parse(browser.request("POST", url, data=data, json_body=json))
+    return _parse(transport.request("POST", url, data=data, json_body=json))
+
+
+def do_get_many(urls: list[str]) -> list[object | str]:
+    """GETs several independent URLs concurrently. Raises the first error."""
+    responses = transport.request_many([{"method": "GET", "path": url} for url in urls])
+    for resp in responses:
+        if isinstance(resp, Exception):
+            raise resp
+    return [_parse(resp) for resp in responses]
 
 
 def get_password() -> str:
@@ -47,20 +119,6 @@ def get_password() -> str:
         return sys.stdin.read().strip()
 
 
-def flatten_dict(d: dict, parent_key: str = "", sep: str = ".") -> dict:
-    """
-    Flattens a nested dictionary into a single level dictionary.
-    """
-    items = []
-    for k, v in d.items():
-        new_key = f"{parent_key}{sep}{k}" if parent_key else k
-        if isinstance(v, dict):
-            items.extend(flatten_dict(v, new_key, sep=sep).items())
-        else:
-            items.append((new_key, v))
-    return dict(items)
-
-
 @dataclass
 class PrepareLoginResult:
     access_token: str
@@ -124,23 +182,40 @@ def prepare_login(
     )
 
 
-def wait_for_mfa_success(challenge_id: str) -> None:
-    MAX_DURATION = 60  # seconds
-    POLL_INTERVAL = 3  # seconds
+def wait_for_mfa_success(
+    challenge_id: str,
+    deadline: float | None = None,
+    schedule: PollSchedule = MFA_POLL_SCHEDULE,
+) -> None:
+    """Polls the challenge until it is approved.
+
+    Gives up after MFA_MAX_DURATION, or earlier if the next poll would happen
+    after `deadline` (a time.monotonic() value)."""
+    start = time.monotonic()
+    give_up_at = start + MFA_MAX_DURATION
+    if deadline is not None:
+        give_up_at = min(give_up_at, deadline)
 
     attempts = 0
     while True:
         attempts += 1
         challenge_data = do_get(f"/mfa/mfa/challenges/{challenge_id}")
         status = challenge_data["data"]["attributes"]["verificationStatus"]
+        elapsed = time.monotonic() - start
+        metrics.event("mfa_poll", attempt=attempts, elapsed=round(elapsed, 3), status=status)
         if status == "processed":
             logger.info("MFA successful!")
+            logger.debug("MFA approved after %.1fs and %d polls.", elapsed, attempts)
             break
         elif status == "processing":
-            logger.info("MFA still pending ...")
-            if attempts > MAX_DURATION / POLL_INTERVAL:
-                raise TimeoutError("MFA challenge took too many attempts!")
-            time.sleep(POLL_INTERVAL)
+            if attempts == 1:
+                logger.info("MFA still pending ...")
+            delay = schedule.delay(elapsed)
+            if time.monotonic() + delay > give_up_at:
+                raise TimeoutError(
+                    f"MFA challenge was not approved within {elapsed:.0f} seconds!"
+                )
+            time.sleep(delay)
         else:
             raise ValueError(f"Unexpected challenge status: {status}")
 
@@ -156,19 +231,77 @@ def complete_login(mfa_id: str, access_token: str):
         },
     )
     logger.info("Login completed!")
+    # Also contains the refresh token for the next sync, see refresh_login.
     return token_data2
-    # Side note: Could in theory refresh token if long-term access is needed:
-    # do_post("/refresh", data={"grant_type": "refresh_token", "refresh_token": ""})
 
 
-def login(username: str, password: str):
-    # The browser has already loaded the login page and solved the captcha.
-    login_data = prepare_login(username, password, browser.captcha_token)
-    wait_for_mfa_success(login_data.challenge_id)
-    complete_login(login_data.mfa_id, login_data.access_token)
+def refresh_login(refresh_token: str) -> dict | None:
+    """Starts a logged in session with a refresh token of an earlier login.
 
-
-def logout():
+    Returns the new tokens, or None if DKB rejected the refresh token."""
+    # The endpoint follows a note in the original login code ("/refresh"); it
+    # has not been confirmed against the live API. If DKB rejects it, the sync
+    # falls back to the full login and the stored token is dropped.
+    try:
+        token_data = do_post(
+            "/refresh",
+            data={"grant_type": "refresh_token", "refresh_token": refresh_token},
+        )
+    except ApiError as e:
+        logger.info("Stored login was rejected (%s), logging in with MFA.", e)
+        return None
+    if not isinstance(token_data, dict) or "access_token" not in token_data:
+        logger.info("Unexpected refresh response, logging in with MFA.")
+        return None
+    logger.info("Resumed stored login, skipping captcha and MFA!")
+    return token_data
+
+
+def login(
+    username: str,
+    password: str,
+    deadline: float | None = None,
+    tokens: TokenStore | None = None,
+) -> bool:
+    """Logs in, with the user's stored refresh token if possible.
+
+    Returns whether a refresh token was stored for the next sync, in which
+    case the session must not be revoked on logout."""
+    refresh = "none"
+    if tokens is not None:
+        refresh_token = tokens.load(username, password)
+        if refresh_token is not None:
+            with metrics.span("token_refresh") as span:
+                token_data = refresh_login(refresh_token)
+                span["accepted"] = token_data is not None
+            if token_data is not None:
+                # Refresh tokens are single-use: keep the new one.
+                stored = tokens.save(username, password, token_data)
+                metrics.event("login_path", path=LOGIN_PATH_REFRESH)
+                return stored
+            tokens.delete(username)
+            refresh = "rejected"
+
+    if not browser.captcha_token:
+        # Skipped while opening the browser, in favor of the refresh token.
+        browser.solve_captcha()
+    with metrics.span("login"):
+        login_data = prepare_login(username, password, browser.captcha_token)
+    with metrics.span("mfa"):
+        wait_for_mfa_success(login_data.challenge_id, deadline)
+        token_data = complete_login(login_data.mfa_id, login_data.access_token)
+    stored = tokens is not None and tokens.save(username, password, token_data)
+    metrics.event("login_path", path=LOGIN_PATH_FULL, refresh=refresh)
+    return stored
+
+
+def logout(revoke: bool = True):
+    """Ends the session. Without revoke, it is left to expire, e.g. because
+    revoking it could also invalidate the refresh token stored for the next
+    sync."""
+    if not revoke:
+        logger.info("Keeping the session for the stored login.")
+        return
     try:
         do_post("/revoke", data={"token": "no-token"})
         logger.info("Logged out.")
@@ -176,66 +309,283 @@ def logout():
         logger.exception("Failed to log out, but ignoring error!")
 
 
-def load_transactions(account_index: int) -> list[dict]:
-    accounts_data = do_get("/accounts/accounts")
-    account_id = accounts_data["data"][account_index]["id"]
-    logger.info(f"Loading from account {account_index}: {account_id}")
-
-    transactions_data = do_get(
-        f"/accounts/accounts/{account_id}/transactions?expand=Merchant"
+def load_account_ids(account_indices: list[int]) -> list[str]:
+    """Resolves account indices to account ids using a single account listing."""
+    with metrics.span("account_listing"):
+        accounts = do_get("/accounts/accounts")["data"]
+    account_ids = []
+    for account_index in account_indices:
+        if not 0 <= account_index < len(accounts):
+            raise ValueError(
+                f"Tried to access account with index {account_index}, "
+                f"but found only {len(accounts)} accounts."
+            )
+        account_id = accounts[account_index]["id"]
+        logger.info(f"Loading from account {account_index}: {account_id}")
+        account_ids.append(account_id)
+    return account_ids
+
+
+def transactions_path(account_id: str, from_date: str) -> str:
+    # Let the server drop old transactions. It filters by booking date, while
+    # the export filters by value date, which can be a few days later.
+    server_from_date = date.fromisoformat(from_date) - DATE_FILTER_MARGIN
+    query = urlencode(
+        {"filter[bookingDate][GE]": server_from_date.isoformat(), "expand": "Merchant"}
     )
-    return transactions_data["data"]
+    return f"/accounts/accounts/{account_id}/transactions?{query}"
+
+
+def _next_page_path(data: dict) -> str | None:
+    """Extracts the API path of the next result page from a JSON:API response."""
+    next_url = (data.get("links") or {}).get("next")
+    if not next_url:
+        return None
+    parts = urlsplit(next_url)
+    path = parts.path
+    # Links may be absolute or relative to the host; we need them relative to
+    # API_BASE_URL.
+    if path.startswith("/api/"):
+        path = path[len("/api") :]
+    return path + (f"?{parts.query}" if parts.query else "")
+
+
+def _is_older_than(transactions: list[dict], from_date: str) -> bool:
+    """Whether a page only contains transactions from before from_date."""
+    if not transactions:
+        return False
+    for transaction in transactions:
+        attributes = transaction.get("attributes") or {}
+        dates = [attributes.get("bookingDate"), attributes.get("valueDate")]
+        dates = [d for d in dates if d]
+        # Undated (e.g. pending) transactions might still be relevant.
+        if not dates or max(dates) >= from_date:
+            return False
+    return True
+
+
+def load_transactions(
+    account_ids: list[str], batch_size: int, from_date: str
+) -> Iterator[list[dict]]:
+    """Yields the transactions of each account since from_date, in the order given.
+
+    The per-account calls are independent, so they are issued in concurrent
+    batches of `batch_size`. Accounts are yielded as soon as their batch is
+    done, so the caller can process them while the next batch is fetched.
+
+    Results are restricted to from_date on the server where possible. If the
+    server paginates, pages are followed until one only contains transactions
+    older than from_date (results are sorted newest first), in case the date
+    filter was ignored.
+    """
+    unique_ids = list(dict.fromkeys(account_ids))
+    loaded: dict[str, list[dict]] = {}
+    next_index = 0
+    for start in range(0, len(unique_ids), batch_size):
+        batch = unique_ids[start : start + batch_size]
+        results: dict[str, list[dict]] = {account_id: [] for account_id in batch}
+        pages = {account_id: transactions_path(account_id, from_date) for account_id in batch}
+        page_counts = dict.fromkeys(batch, 0)
+        while pages:
+            page_ids = list(pages)
+            with metrics.span("transaction_fetch", accounts=len(page_ids)):
+                responses = do_get_many([pages[account_id] for account_id in page_ids])
+            pages = {}
+            for account_id, data in zip(page_ids, responses):
+                transactions = data["data"]
+                results[account_id].extend(transactions)
+                page_counts[account_id] += 1
+                next_path = _next_page_path(data)
+                if next_path is None:
+                    continue
+                if _is_older_than(transactions, from_date):
+                    logger.debug(
+                        "Account %s: stopping after page %d, which is older than %s.",
+                        account_id,
+                        page_counts[account_id],
+                        from_date,
+                    )
+                    continue
+                pages[account_id] = next_path
+        for account_id in batch:
+            logger.debug(
+                "Account %s: loaded %d transactions in %d pages.",
+                account_id,
+                len(results[account_id]),
+                page_counts[account_id],
+            )
+        loaded.update(results)
+        while next_index < len(account_ids) and account_ids[next_index] in loaded:
+            yield loaded[account_ids[next_index]]
+            next_index += 1
+
+
+def export_transactions(
+    transactions: list[dict],
+    output_file: str,
+    from_date: str,
+    output_format: str = "csv",
+    deduplicator: Deduplicator | None = None,
+):
+    with metrics.span("transform", transactions=len(transactions)):
+        df_export = _to_export_frame(transactions, from_date)
+        if deduplicator is not None:
+            records = df_export.fillna("").astype(str).to_dict("records")
+            known = [deduplicator.is_known(imported_rows.FILE_FORMAT_DKB, r) for r in records]
+            df_export = df_export[[not k for k in known]]
+    logger.info(f"Found {len(df_export)} transactions since {from_date}.")
 
+    with metrics.span("export", transactions=len(df_export)):
+        if output_format == "csv":
+            df_export.to_csv(output_file, index=False)
+        else:
+            with open(output_file, "wb") as f:
+                writer = RowWriter(f.write, output_format, imported_rows.FILE_FORMAT_DKB)
+                for values in df_export.fillna("").astype(str).to_dict("records"):
+                    writer.write(values)
+    logger.info(f"Exported transactions to {output_file}")
 
-def export_transactions(transactions: list[dict], output_file: str, from_date: str):
-    df = pd.DataFrame(
-        {"id": value["id"], **flatten_dict(value["attributes"])}
-        for value in transactions
-    )
 
-    def get_who(row) -> str:
-        return "debtor" if float(row["amount.value"]) > 0 else "creditor"
-
-    def get_other_name(row) -> str:
-        who = get_who(row)
-        return row[f"{who}.name"]
-
-    def get_other_iban(row) -> str:
-        who = get_who(row)
-        return row[f"{who}.{who}Account.iban"]
-
-    df["other.name"] = df.apply(get_other_name, axis=1)
-    df["other.iban"] = df.apply(get_other_iban, axis=1)
-
-    # Pick columns which will be included in the CSV.
-    df_filtered = df[
-        [
-            "id",
-            "status",
-            # date
-            "bookingDate",
-            "valueDate",  # <-- probably the one i want
-            # amount
-            "amount.currencyCode",
-            "amount.value",
-            # reason
-            "description",
-            # who
-            "other.name",
-            "other.iban",
-            # bookingText
-            "transactionType",
-        ]
+def _get_path(attributes: dict, path: tuple[str, ...]):
+    value = attributes
+    for key in path:
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
+
+
+def _to_export_frame(transactions: list[dict], from_date: str):
+    """Builds the table of booked transactions since from_date, as exported.
+
+    Only the exported attributes are extracted, in a single pass over the
+    transactions that also drops pending and older ones, so that the frame
+    only ever holds the exported rows."""
+    import pandas as pd
+
+    paths = list(_EXPORT_ATTRIBUTES.items())
+    ids = []
+    columns: dict[str, list] = {name: [] for name, _ in paths}
+    for transaction in transactions:
+        attributes = transaction["attributes"]
+        value_date = attributes.get("valueDate")
+        if attributes.get("status") == "pending" or value_date is None or value_date < from_date:
+            continue
+        ids.append(transaction["id"])
+        for name, path in paths:
+            columns[name].append(_get_path(attributes, path))
+    df = pd.DataFrame({"id": ids, **columns}, dtype=object)
+
+    # The other party is the debtor of incoming and the creditor of outgoing
+    # transactions.
+    incoming = pd.to_numeric(df["amount.value"], errors="coerce") > 0
+    df["other.name"] = df["debtor.name"].where(incoming, df["creditor.name"])
+    df["other.iban"] = df["debtor.iban"].where(incoming, df["creditor.iban"])
+    return df[EXPORT_COLUMNS]
+
+
+def _booked_transactions(transactions: list[dict]) -> list[tuple[str, str]]:
+    """Returns (id, booking date) of all booked transactions, for checkpoints."""
+    booked = []
+    for transaction in transactions:
+        attributes = transaction["attributes"]
+        if attributes.get("status") != "pending" and attributes.get("bookingDate"):
+            booked.append((transaction["id"], attributes["bookingDate"]))
+    return booked
+
+
+def _select_delta(
+    transactions: list[dict], checkpoint: AccountCheckpoint, from_date: str
+) -> list[dict]:
+    """Drops the transactions that were already exported before the checkpoint."""
+    since = checkpoint.since(from_date)
+    exported = set(checkpoint.exported_ids)
+    return [
+        t
+        for t in transactions
+        if t["id"] not in exported and (t["attributes"].get("bookingDate") or since) >= since
     ]
 
-    # Filter transactions by date.
-    df_export = df_filtered[
-        (df_filtered["status"] != "pending") & (df_filtered["valueDate"] >= from_date)
-    ]
-    logger.info(f"Found {len(df_export)} transactions since {from_date}.")
 
-    df_export.to_csv(output_file, index=False)
-    logger.info(f"Exported transactions to {output_file}")
+def export_accounts(
+    account_indices: list[int],
+    output_files: list[str],
+    from_date: str,
+    batch_size: int,
+    checkpoints: CheckpointStore | None = None,
+    incremental: bool = False,
+    output_format: str = "csv",
+    deduplicators: list[Deduplicator | None] | None = None,
+) -> None:
+    """Exports several accounts, overlapping fetching with transform + export.
+
+    API calls stay on the calling thread (the browser is not thread-safe),
+    while the CSV of the previous batch is built and written on a worker
+    thread.
+
+    If checkpoints are given, they are saved after a successful export (as
+    pending if they have a token, see checkpoints.py). In incremental mode,
+    only transactions that were not exported before are written, for all
+    accounts that have a usable checkpoint.
+
+    output_format is one of imported_rows.OUTPUT_FORMATS. Transactions known
+    to the deduplicator of their account (if any) are not written.
+    """
+    account_ids = load_account_ids(account_indices)
+    if deduplicators is None:
+        deduplicators = [None] * len(account_ids)
+
+    account_checkpoints: list[AccountCheckpoint | None] = [None] * len(account_ids)
+    fetch_from_date = from_date
+    if checkpoints is not None and incremental:
+        account_checkpoints = [
+            checkpoints.get(account_index, account_id)
+            for account_index, account_id in zip(account_indices, account_ids)
+        ]
+        if all(account_checkpoints):
+            fetch_from_date = min(c.since(from_date) for c in account_checkpoints)
+        logger.info(
+            "Incremental export for %d of %d accounts, fetching since %s.",
+            sum(1 for c in account_checkpoints if c),
+            len(account_ids),
+            fetch_from_date,
+        )
+
+    booked_by_account = []
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="export") as executor:
+        futures = []
+        for transactions, output_file, checkpoint, deduplicator in zip(
+            load_transactions(account_ids, batch_size, fetch_from_date),
+            output_files,
+            account_checkpoints,
+            deduplicators,
+        ):
+            # Fail fast instead of fetching the remaining accounts in vain.
+            for future in futures:
+                if future.done() and future.exception() is not None:
+                    raise future.exception()
+            booked_by_account.append(_booked_transactions(transactions))
+            if checkpoint is not None:
+                transactions = _select_delta(transactions, checkpoint, from_date)
+            futures.append(
+                executor.submit(
+                    export_transactions,
+                    transactions,
+                    output_file,
+                    from_date,
+                    output_format,
+                    deduplicator,
+                )
+            )
+        for future in futures:
+            future.result()
+
+    if checkpoints is not None:
+        for account_index, account_id, booked in zip(
+            account_indices, account_ids, booked_by_account
+        ):
+            checkpoints.update(account_index, account_id, booked)
+        checkpoints.save()
 
 
 def main():
@@ -288,10 +638,117 @@ def main():
         "Defaults to the FT_CHROME_BINARY env var. Set this to avoid an "
         "unusable snap-packaged Chromium, which cannot run as www-data.",
     )
+    parser.add_argument(
+        "--browser-pool",
+        default=os.environ.get("FT_BANKSYNC_BROWSER_POOL"),
+        help="Directory of a warm browser pool (see browser_pool.py). If given, "
+        "an idle pre-launched browser is leased from the pool instead of "
+        "launching a new one. Defaults to the FT_BANKSYNC_BROWSER_POOL env var.",
+    )
+    parser.add_argument(
+        "--profile-cache",
+        default=os.environ.get("FT_BANKSYNC_PROFILE_CACHE"),
+        help="Directory to keep browser profiles in between syncs (see "
+        "profile_cache.py), so that the login page's static files are cached. "
+        "Cookies and storage are still wiped after every sync. Not used with a "
+        "pooled browser. Defaults to the FT_BANKSYNC_PROFILE_CACHE env var.",
+    )
+    parser.add_argument(
+        "--profile-cache-mb",
+        type=int,
+        default=200,
+        help="Size limit of the caches of each profile in --profile-cache, in MiB.",
+    )
+    parser.add_argument(
+        "--resource-policy",
+        default=os.environ.get("FT_BANKSYNC_RESOURCE_POLICY", "off"),
+        help="Which resources the login page may load: 'off' loads everything, "
+        "'default' blocks images, fonts, the consent manager, trackers and "
+        "other third parties except the captcha provider. Or the path of a "
+        "JSON file with the fields of resource_policy.ResourcePolicy. Defaults "
+        "to the FT_BANKSYNC_RESOURCE_POLICY env var, or 'off'.",
+    )
+    parser.add_argument(
+        "--fetch-transport",
+        choices=TRANSPORTS,
+        default=TRANSPORT_AWAIT,
+        help="How API responses are read back from the browser: 'await' gets "
+        "them in a single round trip, 'poll' polls the page until the fetch is "
+        "done (slower, but works with any CDP bridge). 'await' automatically "
+        "falls back to 'poll' if unsupported.",
+    )
+    parser.add_argument(
+        "--api-transport",
+        choices=API_TRANSPORTS,
+        default=os.environ.get("FT_BANKSYNC_API_TRANSPORT", API_TRANSPORT_AUTO),
+        help="How the API calls after the login are issued: 'auto' switches to "
+        "a direct HTTP client with the browser's cookies if DKB accepts a probe "
+        "request through it (and back to the browser if it is rejected later), "
+        "'browser' keeps issuing them from the browser. Defaults to the "
+        "FT_BANKSYNC_API_TRANSPORT env var, or 'auto'.",
+    )
+    parser.add_argument(
+        "--max-concurrent-requests",
+        type=int,
+        default=4,
+        help="Maximum number of independent API calls (e.g. the transactions "
+        "of several accounts) that are in flight at the same time.",
+    )
+    parser.add_argument(
+        "--checkpoint-dir",
+        help="Directory for sync checkpoints. If given, the newest exported "
+        "transactions of each account are recorded there after every export.",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only export transactions that were not exported by a previous "
+        "sync, based on the checkpoints in --checkpoint-dir. Accounts without a "
+        "usable checkpoint are exported in full.",
+    )
+    parser.add_argument(
+        "--checkpoint-token",
+        help="Do not update the checkpoints, but record the update as pending "
+        "under this token (32 hex digits), to be committed once the client "
+        "imported the export (see checkpoints.py).",
+    )
+    parser.add_argument(
+        "--format",
+        choices=imported_rows.OUTPUT_FORMATS,
+        default="csv",
+        help="Output format: CSV (default), or the transactions as "
+        "newline-delimited JSON or length-delimited ImportedRow protobuf "
+        "messages (see imported_rows.py).",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        help="Overall time limit of the sync in seconds. Waiting for the MFA "
+        "approval gives up early enough to stay within it.",
+    )
+    token_store.add_arguments(parser)
+    dedup.add_arguments(parser)
+    metrics.add_arguments(parser)
 
     args = parser.parse_args()
+    deadline = time.monotonic() + args.timeout if args.timeout else None
     if len(args.account_index) != len(args.output):
         parser.error("Number of account indices and output files must match.")
+    dedup_error = dedup.check_args(args, len(args.account_index))
+    if dedup_error is not None:
+        parser.error(dedup_error)
+    try:
+        date.fromisoformat(args.from_date)
+    except ValueError:
+        parser.error("--from-date must be in YYYY-MM-DD format.")
+    if args.incremental and not args.checkpoint_dir:
+        parser.error("--incremental requires --checkpoint-dir.")
+    if args.checkpoint_token is not None and not is_token(args.checkpoint_token):
+        parser.error("--checkpoint-token must be 32 hex digits.")
+    try:
+        policy = resource_policy.from_setting(args.resource_policy)
+    except (OSError, ValueError, TypeError) as e:
+        parser.error(f"Invalid --resource-policy: {e}")
 
     # Keep the root logger (and thus the chatty browser-automation stack: CDP
     # websocket frames etc.) at WARNING, and only raise verbosity for our own
@@ -301,23 +758,63 @@ def main():
     app_level = logging.DEBUG if args.verbose else logging.INFO
     logger.setLevel(app_level)
     logging.getLogger("dkb_captcha").setLevel(app_level)
-
-    global browser
+    logging.getLogger("browser_pool").setLevel(app_level)
+    logging.getLogger("checkpoints").setLevel(app_level)
+    logging.getLogger("metrics").setLevel(app_level)
+    logging.getLogger("dedup").setLevel(app_level)
+    logging.getLogger("resource_policy").setLevel(app_level)
+    logging.getLogger("profile_cache").setLevel(app_level)
+    logging.getLogger("token_store").setLevel(app_level)
+    logging.getLogger("transport").setLevel(app_level)
+    metrics.configure("dkb_via_api", args)
+
+    global browser, transport
     password = get_password()
-    # The browser stays open for the whole session: every API call is issued as
-    # an in-page fetch so it inherits the browser's WAF clearance and TLS
-    # fingerprint. Entering the context also solves the login captcha.
+    checkpoints = None
+    if args.checkpoint_dir:
+        checkpoints = CheckpointStore(
+            args.checkpoint_dir, "dkb", args.username, args.checkpoint_token
+        )
+    deduplicators = dedup.from_args(args, len(args.account_index))
+    tokens = token_store.from_args(args)
+    # The browser stays open for the whole session: the login's API calls are
+    # issued as in-page fetches so they inherit the browser's WAF clearance and
+    # TLS fingerprint, and so are the others unless a direct HTTP client is
+    # accepted. Entering the context also solves the login captcha.
     with DkbBrowser(
         headless=args.captcha_headless,
         xvfb=args.captcha_xvfb,
         binary_location=args.chrome_binary,
+        transport=args.fetch_transport,
+        max_concurrency=args.max_concurrent_requests,
+        pool_dir=args.browser_pool,
+        resource_policy=policy,
+        profile_cache_dir=args.profile_cache,
+        profile_cache_max_bytes=args.profile_cache_mb * 2**20,
+        # With a stored login, the captcha is only needed if it is rejected.
+        solve_captcha=tokens is None or not tokens.exists(args.username),
     ) as browser:
-        login(args.username, password)
-        for account_index, output_file in zip(args.account_index, args.output):
-            transactions = load_transactions(int(account_index))
-            export_transactions(transactions, output_file, args.from_date)
-        logout()
+        transport = browser
+        token_stored = login(args.username, password, deadline, tokens)
+        if args.api_transport == API_TRANSPORT_AUTO:
+            transport = select_transport(browser, args.max_concurrent_requests)
+        export_accounts(
+            [int(i) for i in args.account_index],
+            args.output,
+            args.from_date,
+            batch_size=args.max_concurrent_requests,
+            checkpoints=checkpoints,
+            incremental=args.incremental,
+            output_format=args.format,
+            deduplicators=deduplicators,
+        )
+        logout(revoke=not token_stored)
 
 
 if __name__ == "__main__":
+    # Hand the job to a running worker (see worker.py) if one is configured.
+    exit_code = forward_cli("dkb_via_api")
+    if exit_code is not None:
+        sys.exit(exit_code)
     main()
+    metrics.flush(0)
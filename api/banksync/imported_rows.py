@@ -0,0 +1,86 @@
+"""
+Output of the sync scripts as ImportedRow messages.
+
+Instead of the bank's own CSV, the scripts can write one record per
+transaction that maps onto ImportedRow (src/proto/imported-row.proto): the
+`file_format` of the source (a format id of the app's CSV import) and the
+`values` of the row by column name. The values are the raw ones of the CSV,
+exactly as the app's import stores them for that format id: its mapping
+parses them (e.g. "-1.234,50" for ksk_camt), and its duplicate detection
+compares them with the rows of earlier imports.
+
+Two encodings are supported:
+
+- "ndjson": one JSON object {"file_format": ..., "values": {...}} per line.
+  Non-ASCII characters are escaped, so the output is plain ASCII.
+- "protobuf": length-delimited ImportedRow messages, i.e. each message is
+  preceded by its size as a varint, as written by writeDelimited() of
+  protobuf.js or Java.
+
+An account without transactions produces empty output. The protobuf encoding
+is done by hand, since ImportedRow only uses strings; this keeps the scripts
+free of a protobuf dependency.
+"""
+from __future__ import annotations
+
+import json
+from typing import Callable
+
+OUTPUT_FORMATS = ["csv", "ndjson", "protobuf"]
+
+# File format ids of the app's CSV import (src/app/money/import/mappings.ts).
+FILE_FORMAT_SPARKASSE = "ksk_camt"
+FILE_FORMAT_DKB = "dkb_custom"
+
+# Field numbers of ImportedRow and of the entries of its `values` map.
+_FIELD_FILE_FORMAT = 3
+_FIELD_VALUES = 4
+_FIELD_MAP_KEY = 1
+_FIELD_MAP_VALUE = 2
+_WIRE_TYPE_LEN = 2
+
+
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _len_field(field: int, data: bytes) -> bytes:
+    return _varint(field << 3 | _WIRE_TYPE_LEN) + _varint(len(data)) + data
+
+
+def encode_imported_row(file_format: str, values: dict[str, str]) -> bytes:
+    """Encodes an ImportedRow message in the protobuf wire format."""
+    parts = [_len_field(_FIELD_FILE_FORMAT, file_format.encode("utf-8"))]
+    for key, value in values.items():
+        entry = _len_field(_FIELD_MAP_KEY, key.encode("utf-8")) + _len_field(
+            _FIELD_MAP_VALUE, value.encode("utf-8")
+        )
+        parts.append(_len_field(_FIELD_VALUES, entry))
+    return b"".join(parts)
+
+
+class RowWriter:
+    """Writes rows of one file format in one of the row encodings, passing the
+    encoded bytes to `write`."""
+
+    def __init__(self, write: Callable[[bytes], object], output_format: str, file_format: str):
+        if output_format not in ("ndjson", "protobuf"):
+            raise ValueError(f"Not a row output format: {output_format}")
+        self._write = write
+        self.output_format = output_format
+        self.file_format = file_format
+        self.rows_written = 0
+
+    def write(self, values: dict[str, str]) -> None:
+        if self.output_format == "ndjson":
+            record = {"file_format": self.file_format, "values": values}
+            self._write(json.dumps(record).encode("ascii") + b"\n")
+        else:
+            message = encode_imported_row(self.file_format, values)
+            self._write(_varint(len(message)) + message)
+        self.rows_written += 1
@@ -0,0 +1,187 @@
+"""
+Metrics of a single banksync run.
+
+The scripts record into the module-level `run`:
+
+- spans: timed phases (browser launch, captcha, login, MFA, account listing,
+  transaction fetch, transform, export), each with its offset from the start
+  of the run, its duration, the CPU time of the process meanwhile, the
+  current RSS of the process at its start and end and the exception type if
+  it failed,
+- counters: totals such as requests, bytes and retries,
+- events: timestamped points of interest, e.g. every poll of an MFA challenge.
+
+At the end of the run the record is written as one JSON object to a side
+channel (--metrics-file or --metrics-fd), separate from the script's regular
+output and logs, so that the caller can log it even in production. Only uses
+the standard library, so it is cheap to import everywhere.
+"""
+from __future__ import annotations
+
+import argparse
+import atexit
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Iterator
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 2
+
+_PAGE_SIZE_KB = os.sysconf("SC_PAGE_SIZE") // 1024
+
+
+class RunMetrics:
+    def __init__(self, script: str | None = None):
+        self.script = script
+        self.started_at = time.time()
+        self._start = time.monotonic()
+        self.spans: list[dict] = []
+        self.counters: dict[str, int] = {}
+        self.events: list[dict] = []
+        self.exit_code: int | None = None
+        # Spans are also recorded from the export thread of dkb_via_api.
+        self._lock = threading.Lock()
+
+    def elapsed(self) -> float:
+        """Seconds since the run started."""
+        return time.monotonic() - self._start
+
+    def event(self, name: str, **fields) -> None:
+        """Records an event, timestamped relative to the start of the run."""
+        with self._lock:
+            self.events.append({"name": name, "t": round(self.elapsed(), 3), **fields})
+
+    def count(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    @contextlib.contextmanager
+    def span(self, name: str, **fields) -> Iterator[dict]:
+        """Times the enclosed block. Yields the span record for extra fields."""
+        start = self.elapsed()
+        cpu_start = time.process_time()
+        record = {"name": name, "start": round(start, 3), **fields}
+        rss_start = _rss_kb()
+        try:
+            yield record
+        except BaseException as e:
+            record["error"] = type(e).__name__
+            raise
+        finally:
+            record["duration"] = round(self.elapsed() - start, 3)
+            # Process-wide, so it includes other threads working meanwhile.
+            record["cpu"] = round(time.process_time() - cpu_start, 3)
+            # The current RSS rather than getrusage()'s peak, which covers the
+            # whole life of the process, including what a worker inherited
+            # from its parent. Like the CPU time, it is process-wide.
+            rss_end = _rss_kb()
+            if rss_start is not None and rss_end is not None:
+                record["rss_start_kb"] = rss_start
+                record["rss_end_kb"] = rss_end
+            with self._lock:
+                self.spans.append(record)
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "version": FORMAT_VERSION,
+                "script": self.script,
+                "started_at": datetime.fromtimestamp(self.started_at, timezone.utc)
+                .isoformat(timespec="seconds"),
+                "duration": round(self.elapsed(), 3),
+                "exit_code": self.exit_code,
+                "spans": list(self.spans),
+                "counters": dict(self.counters),
+                "events": list(self.events),
+            }
+
+
+def _rss_kb() -> int | None:
+    """Returns the current resident set size of the process, or None where
+    /proc is not available."""
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE_KB
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+# Metrics of the current run.
+run = RunMetrics()
+
+# Where flush() writes the record to; set by configure().
+_sink_path: str | None = None
+_sink_fd: int | None = None
+
+
+def reset() -> None:
+    """Starts a new run, e.g. in a worker process forked long after import."""
+    global run, _sink_path, _sink_fd
+    run = RunMetrics()
+    _sink_path = None
+    _sink_fd = None
+
+
+def event(name: str, **fields) -> None:
+    run.event(name, **fields)
+
+
+def count(name: str, value: int = 1) -> None:
+    run.count(name, value)
+
+
+def span(name: str, **fields) -> contextlib.AbstractContextManager[dict]:
+    return run.span(name, **fields)
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--metrics-file",
+        help="Write timings and counters of the run as JSON to this file when "
+        "the run ends.",
+    )
+    parser.add_argument(
+        "--metrics-fd",
+        type=int,
+        help="Like --metrics-file, but write to this already open file "
+        "descriptor. Not supported when running on the worker.",
+    )
+
+
+def configure(script: str, args: argparse.Namespace) -> None:
+    """Sets up the side channel from the --metrics-* arguments."""
+    global _sink_path, _sink_fd
+    run.script = script
+    _sink_path = args.metrics_file
+    _sink_fd = args.metrics_fd
+    if _sink_path is not None or _sink_fd is not None:
+        # Also covers runs that end with an exception. The worker calls
+        # flush() itself, since its processes exit without running atexit.
+        atexit.register(flush)
+
+
+def flush(exit_code: int | None = None) -> None:
+    """Writes the record of the run to the side channel, at most once."""
+    global _sink_path, _sink_fd
+    if exit_code is not None:
+        run.exit_code = exit_code
+    path, fd = _sink_path, _sink_fd
+    _sink_path = _sink_fd = None
+    if path is None and fd is None:
+        return
+    data = json.dumps(run.to_dict()) + "\n"
+    try:
+        if path is not None:
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(data)
+        if fd is not None:
+            with os.fdopen(fd, "w", encoding="utf-8", closefd=False) as f:
+                f.write(data)
+    except OSError as e:
+        logger.warning("Could not write metrics: %s", e)
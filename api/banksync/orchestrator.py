@@ -0,0 +1,554 @@
+#!/usr/bin/python3
+"""
+Runs many bank syncs concurrently from a JSON job file.
+
+banksync.php runs one bank per request and blocks until it is done. For
+syncing many users at once, this runs a list of jobs with bounded
+concurrency:
+
+- Sparkasse jobs run on up to --sparkasse-workers processes at a time.
+- DKB jobs run on up to --dkb-browsers at a time, since each needs its own
+  browser. With --browser-pool, this defaults to the size of the pool.
+- On top of that, at most --per-host jobs talk to the same bank host at once
+  (the Sparkasse website of the job, or DKB), so that a batch of users of one
+  bank does not trip its rate limits.
+
+Each job runs sparkasse.py or dkb_via_api.py in its own process, on the warm
+worker if FT_BANKSYNC_SOCKET is set (see worker.py), exactly like the API does.
+The job file looks like this; the fields match the API's request:
+
+    {"jobs": [
+      {"id": "alice-sparkasse", "bankType": "sparkasse",
+       "bankUrl": "https://www.sparkasse-example.de",
+       "credentials": {"file": "/etc/ft-banksync/alice-sparkasse.json"},
+       "accountIndices": [0, 1], "maxTransactionAge": 30},
+      {"id": "bob-dkb", "bankType": "dkb",
+       "credentials": {"env": "BOB_DKB"},
+       "accountIndices": [0], "from": "2024-01-01", "incremental": true}
+    ]}
+
+Credentials are only referenced: {"file": path} names a JSON file with
+"loginName" and "loginPassword", {"env": "PREFIX"} the environment variables
+PREFIX_LOGIN_NAME and PREFIX_PASSWORD. The date window is either
+"maxTransactionAge" in days, like the API, or "from" (and optionally "to")
+as YYYY-MM-DD. Optional fields: "incremental", "outputFormat",
+"dedupStorage" (path of the user's stored database, see dedup.py) and
+"dedupAccountIds" (the ids of the accounts in it that the accounts are
+imported into, in the order of "accountIndices").
+
+The result is a JSON object {"jobs": [...]} with one entry per job, in the
+order of the job file: the response the API would return for it ("success"
+and "results", or "error" and "errorDetails"), plus "id" and "timings" (the
+seconds the job waited for its turn, its duration and the metrics of the
+script, see metrics.py). Incremental jobs also return a "checkpointToken":
+their checkpoints only advance once the import of their results is confirmed
+with `checkpoints.py commit --checkpoint-dir <state dir>/checkpoints --token
+<token> --account-index <i> ...`.
+
+    python orchestrator.py jobs.json --output results.json
+"""
+from __future__ import annotations
+
+import argparse
+import base64
+import json
+import logging
+import os
+import secrets
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from urllib.parse import urlsplit
+from zoneinfo import ZoneInfo
+
+from worker_client import SOCKET_ENV_VAR, ProtocolError, WorkerUnavailable, run_job
+
+logger = logging.getLogger("orchestrator")
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+BANK_TYPES = ["sparkasse", "dkb"]
+SCRIPTS = {"sparkasse": "sparkasse", "dkb": "dkb_via_api"}
+# Host that all DKB jobs talk to, for the per-host limit.
+DKB_HOST = "dkb.de"
+# Like the API, dates are computed in the banks' time zone.
+TIME_ZONE = ZoneInfo("Europe/Berlin")
+# Syncs can take minutes (captcha, waiting for MFA approval on the phone).
+JOB_TIMEOUT = 600  # seconds
+EMPTY_RESULT_PLACEHOLDER = "<EMPTY_RESULT_SET>"
+UNKNOWN_ERROR = "An unknown error occured! Unfortunately we do not know more."
+
+
+class JobError(Exception):
+    """A job is invalid; reported as the job's error."""
+
+
+@dataclass
+class Job:
+    id: str
+    bank_type: str
+    bank_url: str | None
+    login_name: str
+    login_password: str
+    account_indices: list[int]
+    from_date: date
+    to_date: date
+    incremental: bool = False
+    output_format: str = "csv"
+    dedup_storage: str | None = None
+    dedup_account_ids: list[int] | None = None
+
+    @property
+    def host(self) -> str:
+        if self.bank_type == "dkb":
+            return DKB_HOST
+        return urlsplit(self.bank_url).netloc
+
+
+@dataclass
+class Settings:
+    debug: bool = False
+    state_dir: str | None = None
+    browser_pool: str | None = None
+    captcha_xvfb: bool = False
+    job_timeout: float = JOB_TIMEOUT
+    worker_socket: str | None = field(default_factory=lambda: os.environ.get(SOCKET_ENV_VAR))
+
+
+def _load_credentials(reference: dict) -> tuple[str, str]:
+    if not isinstance(reference, dict):
+        raise JobError("Missing credentials reference.")
+    if "file" in reference:
+        try:
+            with open(reference["file"], encoding="utf-8") as f:
+                credentials = json.load(f)
+            return str(credentials["loginName"]), str(credentials["loginPassword"])
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            raise JobError(f"Could not read credentials file: {e}") from e
+    if "env" in reference:
+        prefix = reference["env"]
+        try:
+            return os.environ[prefix + "_LOGIN_NAME"], os.environ[prefix + "_PASSWORD"]
+        except KeyError as e:
+            raise JobError(f"Missing credentials environment variable {e}.") from e
+    raise JobError("Unsupported credentials reference.")
+
+
+def parse_job(raw: dict, index: int) -> Job:
+    """Validates one entry of the job file, like the API validates a request."""
+    if not isinstance(raw, dict):
+        raise JobError("Job is not an object.")
+    bank_type = raw.get("bankType")
+    if bank_type not in BANK_TYPES:
+        raise JobError("Unsupported bank type!")
+    bank_url = (raw.get("bankUrl") or "").strip() or None
+    if bank_type == "sparkasse" and not bank_url:
+        raise JobError("Incomplete request!")
+    account_indices = raw.get("accountIndices")
+    if (
+        not isinstance(account_indices, list)
+        or not account_indices
+        or not all(isinstance(i, int) and not isinstance(i, bool) and i >= 0 for i in account_indices)
+    ):
+        raise JobError("Invalid account index!")
+
+    today = datetime.now(TIME_ZONE).date()
+    try:
+        if "from" in raw:
+            from_date = date.fromisoformat(raw["from"])
+            to_date = date.fromisoformat(raw["to"]) if "to" in raw else today
+        else:
+            max_age = int(raw["maxTransactionAge"])
+            if max_age < 1:
+                raise ValueError(max_age)
+            from_date, to_date = today - timedelta(days=max_age), today
+    except (KeyError, TypeError, ValueError) as e:
+        raise JobError("Invalid date window!") from e
+
+    dedup_account_ids = raw.get("dedupAccountIds")
+    if dedup_account_ids is not None and (
+        not isinstance(dedup_account_ids, list)
+        or len(dedup_account_ids) != len(account_indices)
+        or not all(isinstance(i, int) and not isinstance(i, bool) and i >= 0 for i in dedup_account_ids)
+    ):
+        raise JobError("Invalid dedup account ids!")
+
+    output_format = raw.get("outputFormat") or "csv"
+    if output_format not in ("csv", "ndjson", "protobuf"):
+        raise JobError("Unsupported output format!")
+    login_name, login_password = _load_credentials(raw.get("credentials"))
+    if not login_name or not login_password:
+        raise JobError("Incomplete request!")
+    return Job(
+        id=str(raw.get("id", index)),
+        bank_type=bank_type,
+        bank_url=bank_url,
+        login_name=login_name,
+        login_password=login_password,
+        account_indices=account_indices,
+        from_date=from_date,
+        to_date=to_date,
+        incremental=bool(raw.get("incremental")),
+        output_format=output_format,
+        dedup_storage=raw.get("dedupStorage"),
+        dedup_account_ids=dedup_account_ids,
+    )
+
+
+def _state_args(job: Job, settings: Settings, checkpoint_token: str | None) -> list[str]:
+    args = []
+    if checkpoint_token is not None:
+        args += [
+            "--checkpoint-dir",
+            os.path.join(settings.state_dir, "checkpoints"),
+            "--incremental",
+            "--checkpoint-token",
+            checkpoint_token,
+        ]
+    if job.dedup_storage and os.path.exists(job.dedup_storage):
+        args += ["--dedup-storage", job.dedup_storage]
+        for account_id in job.dedup_account_ids or []:
+            args += ["--dedup-account-id", str(account_id)]
+        if settings.state_dir is not None:
+            args += ["--dedup-cache-dir", os.path.join(settings.state_dir, "dedup-index")]
+    return args
+
+
+def _command(job: Job, settings: Settings, output_files: list[str]) -> tuple[list[str], str]:
+    """Returns the arguments and stdin of the script of a job."""
+    if job.bank_type == "sparkasse":
+        args = [
+            "--base",
+            job.bank_url,
+            "--from",
+            job.from_date.strftime("%d.%m.%Y"),
+            "--to",
+            job.to_date.strftime("%d.%m.%Y"),
+            "--format",
+            job.output_format,
+        ]
+        for output_file in output_files:
+            args += ["--output", output_file]
+        indices = ",".join(str(i) for i in job.account_indices)
+        return args, f"{job.login_name}\n{job.login_password}\n{indices}\n"
+
+    args = [
+        "--username",
+        job.login_name,
+        "--from-date",
+        job.from_date.isoformat(),
+        "--format",
+        job.output_format,
+    ]
+    if settings.captcha_xvfb:
+        args.append("--captcha-xvfb")
+    if settings.browser_pool:
+        args += ["--browser-pool", settings.browser_pool]
+    if settings.state_dir and os.path.isdir(os.path.join(settings.state_dir, "profile-cache")):
+        args += ["--profile-cache", os.path.join(settings.state_dir, "profile-cache")]
+    if settings.state_dir and os.path.isdir(os.path.join(settings.state_dir, "tokens")):
+        args += ["--token-store", os.path.join(settings.state_dir, "tokens")]
+    for account_index, output_file in zip(job.account_indices, output_files):
+        args += ["--account-index", str(account_index), "--output", output_file]
+    return args, f"{job.login_password}\n"
+
+
+def run_script(script: str, args: list[str], stdin: str, settings: Settings) -> tuple[int, str, str]:
+    """Runs a script on the worker if configured, otherwise as a subprocess.
+
+    Returns (exit code, stdout, stderr). Raises subprocess.TimeoutExpired or
+    socket.timeout if the job takes longer than settings.job_timeout, and
+    OSError or ProtocolError if the worker fails during the job."""
+    env = {k: v for k, v in os.environ.items() if k != SOCKET_ENV_VAR}
+    if settings.worker_socket:
+        try:
+            exit_code, stdout, stderr = run_job(
+                settings.worker_socket,
+                script,
+                args,
+                stdin,
+                settings.job_timeout,
+                cwd=SCRIPT_DIR,
+                env=env,
+            )
+            return exit_code, stdout.decode("utf-8", errors="replace"), stderr
+        except WorkerUnavailable as e:
+            # Any later failure may leave the job running on the worker, so
+            # only a failed connect falls back.
+            logger.warning("Worker unavailable (%s), falling back to a subprocess.", e)
+    proc = subprocess.run(
+        [sys.executable, os.path.join(SCRIPT_DIR, script + ".py"), *args],
+        input=stdin.encode("utf-8"),
+        capture_output=True,
+        cwd=SCRIPT_DIR,
+        env=env,
+        timeout=settings.job_timeout,
+    )
+    return (
+        proc.returncode,
+        proc.stdout.decode("utf-8", errors="replace"),
+        proc.stderr.decode("utf-8", errors="replace"),
+    )
+
+
+def _result_data(data: bytes, output_format: str) -> str | None:
+    if output_format == "protobuf":
+        return base64.b64encode(data).decode("ascii") if data else None
+    text = data.decode("utf-8")
+    if output_format == "ndjson":
+        return text or None
+    if text.strip() == EMPTY_RESULT_PLACEHOLDER:
+        # Successful, but no transactions exist in this account.
+        return None
+    return text
+
+
+def execute(job: Job, settings: Settings) -> dict:
+    """Runs a job and returns the response the API would return for it."""
+    script = SCRIPTS[job.bank_type]
+    with tempfile.TemporaryDirectory(prefix="ftbanksync-") as tmp:
+        output_files = [os.path.join(tmp, f"account-{i}") for i in range(len(job.account_indices))]
+        metrics_file = os.path.join(tmp, "metrics.json")
+        args, stdin = _command(job, settings, output_files)
+        checkpoint_token = None
+        if job.incremental and settings.state_dir is not None:
+            checkpoint_token = secrets.token_hex(16)
+        args = _state_args(job, settings, checkpoint_token) + args
+        args += ["--metrics-file", metrics_file]
+        try:
+            exit_code, stdout, stderr = run_script(script, args, stdin, settings)
+        except (subprocess.TimeoutExpired, socket.timeout):
+            return {"error": UNKNOWN_ERROR, "errorDetails": "The sync timed out."}
+        except (OSError, ProtocolError) as e:
+            return {
+                "error": UNKNOWN_ERROR,
+                "errorDetails": f"The banksync worker failed during the sync: {e}",
+            }
+        log = stdout + "\n" + stderr if job.bank_type == "dkb" else stderr
+
+        response: dict = {}
+        try:
+            with open(metrics_file, encoding="utf-8") as f:
+                response["metrics"] = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+        if exit_code != 0:
+            error = stdout.strip() if job.bank_type == "sparkasse" else ""
+            details = f"Exit code: {exit_code}" + (f"\n{log}" if settings.debug else "")
+            return {**response, "error": error or UNKNOWN_ERROR, "errorDetails": details}
+
+        results = []
+        for output_file in output_files:
+            try:
+                with open(output_file, "rb") as f:
+                    data = f.read()
+            except OSError:
+                data = None
+            if data is None or (data == b"" and job.bank_type == "sparkasse" and job.output_format == "csv"):
+                return {
+                    **response,
+                    "error": "An error occured after exporting the transactions!",
+                    "errorDetails": "Could not read temporary file.",
+                }
+            try:
+                result_data = _result_data(data, job.output_format)
+            except UnicodeDecodeError:
+                return {
+                    **response,
+                    "error": "An error occured trying to encode the exported file to JSON!",
+                    "errorDetails": "The export is not valid UTF-8.",
+                }
+            results.append({"data": result_data, "log": log if settings.debug else ""})
+        if checkpoint_token is not None:
+            response["checkpointToken"] = checkpoint_token
+        return {**response, "success": True, "results": results}
+
+
+class Limits:
+    """Concurrency limits per bank type and per bank host."""
+
+    def __init__(self, per_bank: dict[str, int], per_host: int):
+        # Jobs that may run at the same time in total.
+        self.total = sum(per_bank.values())
+        self._banks = {bank: threading.BoundedSemaphore(n) for bank, n in per_bank.items()}
+        self._per_host = per_host
+        self._hosts: dict[str, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+
+    def _host(self, host: str) -> threading.BoundedSemaphore:
+        with self._lock:
+            if host not in self._hosts:
+                self._hosts[host] = threading.BoundedSemaphore(self._per_host)
+            return self._hosts[host]
+
+    def try_acquire(self, job: Job) -> bool:
+        """Takes the job's slots if both are free, without blocking."""
+        bank = self._banks[job.bank_type]
+        if not bank.acquire(blocking=False):
+            return False
+        if not self._host(job.host).acquire(blocking=False):
+            bank.release()
+            return False
+        return True
+
+    def release(self, job: Job) -> None:
+        self._host(job.host).release()
+        self._banks[job.bank_type].release()
+
+
+def run_jobs(raw_jobs: list, settings: Settings, limits: Limits) -> list[dict]:
+    """Runs all jobs concurrently within the limits. Returns their results in order."""
+    start = time.monotonic()
+    results: list[dict | None] = [None] * len(raw_jobs)
+    pending: list[tuple[int, Job]] = []
+    for index, raw in enumerate(raw_jobs):
+        try:
+            pending.append((index, parse_job(raw, index)))
+        except JobError as e:
+            job_id = raw.get("id", index) if isinstance(raw, dict) else index
+            results[index] = {"id": str(job_id), "error": str(e)}
+
+    def run(job: Job) -> dict:
+        """Runs a job whose limits were acquired."""
+        started = time.monotonic()
+        try:
+            logger.info("Job %s: starting %s sync.", job.id, job.bank_type)
+            response = execute(job, settings)
+        except Exception as e:
+            logger.exception("Job %s failed.", job.id)
+            response = {"error": UNKNOWN_ERROR, "errorDetails": f"{type(e).__name__}: {e}"}
+        finally:
+            limits.release(job)
+        duration = time.monotonic() - started
+        logger.info(
+            "Job %s: %s after %.1fs.", job.id, "done" if "success" in response else "failed", duration
+        )
+        timings = {
+            "queued": round(started - start, 3),
+            "duration": round(duration, 3),
+        }
+        if "metrics" in response:
+            timings["metrics"] = response.pop("metrics")
+        return {"id": job.id, **response, "timings": timings}
+
+    # Jobs are only handed to a thread once their limits allow them to start,
+    # in the order of the job file, but skipping jobs that are held back by
+    # their host, so that they do not block jobs for other hosts.
+    with ThreadPoolExecutor(max_workers=max(1, limits.total)) as executor:
+        running: dict[Future, int] = {}
+        while pending:
+            for item in list(pending):
+                if limits.try_acquire(item[1]):
+                    pending.remove(item)
+                    running[executor.submit(run, item[1])] = item[0]
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[running.pop(future)] = future.result()
+        for future, index in running.items():
+            results[index] = future.result()
+    return results
+
+
+def pool_size(browser_pool: str | None) -> int:
+    """Number of browsers in a pool directory (see browser_pool.py)."""
+    if not browser_pool:
+        return 0
+    try:
+        return sum(1 for name in os.listdir(browser_pool) if name.startswith("slot-"))
+    except OSError:
+        return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("jobs", help="JSON job file, or - for stdin.")
+    parser.add_argument("--output", "-o", help="Write the results to this file instead of stdout.")
+    parser.add_argument(
+        "--sparkasse-workers",
+        type=int,
+        default=4,
+        help="Number of Sparkasse jobs that run at the same time.",
+    )
+    parser.add_argument(
+        "--dkb-browsers",
+        type=int,
+        help="Number of DKB jobs that run at the same time, i.e. browsers. "
+        "Defaults to the size of --browser-pool, or 1.",
+    )
+    parser.add_argument(
+        "--per-host",
+        type=int,
+        default=2,
+        help="Number of jobs that talk to the same bank host at the same time.",
+    )
+    parser.add_argument(
+        "--state-dir",
+        help="Banksync state directory (FT_BANKSYNC_STATE_DIR) for checkpoints "
+        "and dedup indexes.",
+    )
+    parser.add_argument("--browser-pool", help="Lease DKB browsers from this pool.")
+    parser.add_argument(
+        "--captcha-xvfb",
+        action="store_true",
+        help="Run DKB browsers inside a virtual framebuffer (xvfb).",
+    )
+    parser.add_argument(
+        "--job-timeout",
+        type=float,
+        default=JOB_TIMEOUT,
+        help="Seconds after which a job that runs as a subprocess is killed, "
+        "or a job on the worker is given up on.",
+    )
+    parser.add_argument(
+        "--debug",
+        action="store_true",
+        help="Include the scripts' logs in the results, like the API in debug mode.",
+    )
+    parser.add_argument("-v", "--verbose", action="store_true", help="Enable verbose logging.")
+    args = parser.parse_args()
+
+    dkb_browsers = args.dkb_browsers or pool_size(args.browser_pool) or 1
+    if min(args.sparkasse_workers, dkb_browsers, args.per_host) < 1:
+        parser.error("Concurrency limits must be at least 1.")
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.INFO,
+        format="[%(levelname)s] %(message)s",
+    )
+
+    if args.jobs == "-":
+        job_file = json.load(sys.stdin)
+    else:
+        with open(args.jobs, encoding="utf-8") as f:
+            job_file = json.load(f)
+    raw_jobs = job_file.get("jobs") if isinstance(job_file, dict) else None
+    if not isinstance(raw_jobs, list):
+        parser.error("The job file must contain a list of jobs.")
+
+    settings = Settings(
+        debug=args.debug,
+        state_dir=args.state_dir,
+        browser_pool=args.browser_pool,
+        captcha_xvfb=args.captcha_xvfb,
+        job_timeout=args.job_timeout,
+    )
+    limits = Limits({"sparkasse": args.sparkasse_workers, "dkb": dkb_browsers}, args.per_host)
+    results = run_jobs(raw_jobs, settings, limits)
+
+    data = json.dumps({"jobs": results})
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(data)
+    else:
+        print(data)
+    failed = sum(1 for r in results if "success" not in r)
+    logger.info("Finished %d jobs, %d failed.", len(results), failed)
+
+
+if __name__ == "__main__":
+    main()
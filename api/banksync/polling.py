@@ -0,0 +1,41 @@
+"""
+Poll schedules for waiting on something outside of our control, e.g. the user
+approving an MFA challenge on their phone.
+
+A schedule maps the time since waiting started to the delay before the next
+attempt. Approvals tend to arrive within the first seconds, so the default
+polls densely at first and backs off the longer it takes.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Protocol
+
+
+class PollSchedule(Protocol):
+    def delay(self, elapsed: float) -> float:
+        """Returns the seconds to wait after an attempt `elapsed` seconds in."""
+        ...
+
+
+@dataclass(frozen=True)
+class FixedSchedule:
+    interval: float
+
+    def delay(self, elapsed: float) -> float:
+        return self.interval
+
+
+@dataclass(frozen=True)
+class StepSchedule:
+    # (until, interval) pairs in ascending order: attempts before `until`
+    # seconds are followed by `interval` seconds of waiting.
+    steps: tuple[tuple[float, float], ...] = ((10.0, 0.5), (30.0, 1.0))
+    # Interval after the last step.
+    final: float = 3.0
+
+    def delay(self, elapsed: float) -> float:
+        for until, interval in self.steps:
+            if elapsed < until:
+                return interval
+        return self.final
@@ -0,0 +1,169 @@
+"""
+Persistent, size-bounded Chrome profiles for the DKB sync.
+
+Without it, DkbBrowser launches Chrome with a fresh profile, so every sync
+downloads DKB's login bundle, the captcha widget's scripts and fonts again. A
+ProfileCache keeps a few profiles in a directory owned by the web server user:
+
+    <cache dir>/slot-<n>/lock       flock()ed while a browser uses the profile
+    <cache dir>/slot-<n>/profile/   the browser's user data dir
+
+Chrome runs at most one browser per profile, so a sync leases a free slot and
+falls back to a fresh temporary profile if all are in use. Only Chrome's
+caches survive a sync: everything else in the profile (cookies, local and
+session storage, IndexedDB, history, ...) is deleted when the slot is leased
+and again after the browser quit. When the slot is released, its caches are
+kept below a size limit by deleting the least recently used files.
+
+Pooled browsers (see browser_pool.py) keep their own profile and do not use
+this.
+"""
+from __future__ import annotations
+
+import fcntl
+import logging
+import os
+import shutil
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 200 * 2**20
+
+# Folders of a profile that survive a sync, relative to the user data dir.
+CACHE_DIRS = (
+    "Default/Cache",
+    "Default/Code Cache",
+    "Default/GPUCache",
+    "GrShaderCache",
+    "ShaderCache",
+)
+# Index files of Chrome's cache backends. They are never evicted: Chrome treats
+# entries whose files are gone as misses.
+_INDEX_NAMES = ("index", "the-real-index")
+
+
+def _wipe(profile_dir: str) -> None:
+    """Deletes everything in a profile but its caches."""
+    parents = {os.path.dirname(d) for d in CACHE_DIRS} - {""}
+
+    def wipe_dir(rel_dir: str) -> None:
+        for entry in os.scandir(os.path.join(profile_dir, rel_dir)):
+            rel_path = os.path.join(rel_dir, entry.name) if rel_dir else entry.name
+            if rel_path in CACHE_DIRS:
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                if rel_path in parents:
+                    wipe_dir(rel_path)
+                else:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+            else:
+                os.unlink(entry.path)
+
+    wipe_dir("")
+
+
+def _cache_files(profile_dir: str) -> list[tuple[float, int, str]]:
+    """Returns (last use, size, path) of the evictable files of the caches."""
+    files = []
+    for cache_dir in CACHE_DIRS:
+        for root, _, names in os.walk(os.path.join(profile_dir, cache_dir)):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path, follow_symlinks=False)
+                except OSError:
+                    continue
+                is_index = name in _INDEX_NAMES or os.path.basename(root) == "index-dir"
+                files.append((max(st.st_atime, st.st_mtime), st.st_size, "" if is_index else path))
+    return files
+
+
+def cache_size(profile_dir: str) -> int:
+    """Total bytes of the caches of a profile."""
+    return sum(size for _, size, _ in _cache_files(profile_dir))
+
+
+def evict(profile_dir: str, max_bytes: int) -> int:
+    """Deletes the least recently used cache files until the caches of a
+    profile fit into max_bytes. Returns the number of bytes deleted."""
+    files = _cache_files(profile_dir)
+    excess = sum(size for _, size, _ in files) - max_bytes
+    deleted = 0
+    for _, size, path in sorted(files):
+        if deleted >= excess:
+            break
+        if not path:
+            continue
+        try:
+            os.unlink(path)
+        except OSError:
+            continue
+        deleted += size
+    return deleted
+
+
+class ProfileLease:
+    """A cached profile, exclusively held until release() is called."""
+
+    def __init__(self, slot_dir: str, lock_fd: int, max_bytes: int):
+        self.slot_dir = slot_dir
+        self.max_bytes = max_bytes
+        self._lock_fd = lock_fd
+        # Size of the caches when leased, i.e. 0 for a cold profile.
+        self.cached_bytes = cache_size(self.profile_dir)
+
+    @property
+    def profile_dir(self) -> str:
+        return os.path.join(self.slot_dir, "profile")
+
+    def release(self) -> None:
+        """Wipes the session and trims the caches. Call after the browser quit."""
+        if self._lock_fd is None:
+            return
+        try:
+            _wipe(self.profile_dir)
+            deleted = evict(self.profile_dir, self.max_bytes)
+            if deleted:
+                logger.debug("Evicted %d bytes from cached profile %s", deleted, self.slot_dir)
+        except OSError:
+            logger.warning("Could not clean up cached profile %s", self.slot_dir, exc_info=True)
+        finally:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+
+class ProfileCache:
+    """Leases the profiles of a cache directory, creating them on first use."""
+
+    def __init__(self, directory: str, max_bytes: int = DEFAULT_MAX_BYTES, slots: int = 2):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.slots = slots
+
+    def acquire(self) -> ProfileLease | None:
+        """Leases a free profile. Returns None if all are in use."""
+        for i in range(self.slots):
+            slot_dir = os.path.join(self.directory, f"slot-{i}")
+            try:
+                os.makedirs(os.path.join(slot_dir, "profile"), mode=0o700, exist_ok=True)
+                lock_fd = os.open(os.path.join(slot_dir, "lock"), os.O_RDWR | os.O_CREAT, 0o600)
+            except OSError:
+                continue
+            try:
+                fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(lock_fd)
+                continue
+            try:
+                # In case the previous sync crashed before cleaning up.
+                _wipe(os.path.join(slot_dir, "profile"))
+                lease = ProfileLease(slot_dir, lock_fd, self.max_bytes)
+            except OSError:
+                logger.warning("Could not prepare cached profile %s", slot_dir, exc_info=True)
+                fcntl.flock(lock_fd, fcntl.LOCK_UN)
+                os.close(lock_fd)
+                continue
+            logger.debug("Leased cached profile %s (%d bytes cached)", slot_dir, lease.cached_bytes)
+            return lease
+        return None
@@ -0,0 +1,263 @@
+"""
+Blocks resources of the DKB login page that the sync does not need.
+
+The login page loads images, fonts, the Usercentrics consent manager (whose
+banner DkbBrowser then clicks away) and analytics scripts, none of which
+matter for us: only DKB's own app, its API and the Friendly Captcha widget
+do. A ResourcePolicy decides per request whether it is loaded, and a
+NetworkFilter applies it to all pages and frames of a browser through CDP
+network interception (the Fetch domain).
+
+The filter uses its own CDP connection, served from a background thread, so
+that paused requests are answered right away, independent of when the
+browser automation runs its event loop. Since it sees all requests anyway, it
+also counts the requests and bytes the pages load.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import threading
+from collections import Counter
+from dataclasses import dataclass, fields
+from fnmatch import fnmatchcase
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+# Hosts of the captcha provider: nothing from them is blocked, so that the
+# widget works as usual. The SDK may also be loaded from jsdelivr.
+DEFAULT_ESSENTIAL_HOSTS = (
+    "friendlycaptcha.com",
+    "*.friendlycaptcha.com",
+    "*.friendlycaptcha.eu",
+    "*.frcapi.com",
+    "cdn.jsdelivr.net",
+)
+# DKB's own hosts: everything but the blocked resource types is loaded.
+DEFAULT_ALLOW_HOSTS = ("dkb.de", "*.dkb.de")
+# The consent manager and known trackers; blocked even on allowed hosts.
+DEFAULT_DENY_HOSTS = (
+    "*.usercentrics.eu",
+    "*.usercentrics.com",
+    "*.google-analytics.com",
+    "*.googletagmanager.com",
+    "*.doubleclick.net",
+    "*.facebook.net",
+    "*.hotjar.com",
+    "*.mouseflow.com",
+    "*.adobedtm.com",
+    "*.demdex.net",
+    "*.omtrdc.net",
+    "*.etracker.com",
+    "*.etracker.de",
+    "*.contentsquare.net",
+)
+# CDP resource types that are never needed to log in.
+DEFAULT_BLOCK_TYPES = ("Image", "Media", "Font")
+
+# Reasons of blocked requests, as counted by NetworkFilter.
+BLOCKED_DENIED = "denied"
+BLOCKED_TYPE = "type"
+BLOCKED_UNLISTED = "unlisted"
+
+# Targets whose requests are intercepted. Others (e.g. workers) are only
+# resumed after being attached to.
+_FILTERED_TARGET_TYPES = ("page", "iframe")
+_AUTO_ATTACH = {"autoAttach": True, "waitForDebuggerOnStart": True, "flatten": True}
+
+
+@dataclass(frozen=True)
+class ResourcePolicy:
+    """Which requests of the pages are loaded. Hosts are glob patterns."""
+
+    essential_hosts: tuple[str, ...] = DEFAULT_ESSENTIAL_HOSTS
+    allow_hosts: tuple[str, ...] = DEFAULT_ALLOW_HOSTS
+    deny_hosts: tuple[str, ...] = DEFAULT_DENY_HOSTS
+    block_types: tuple[str, ...] = DEFAULT_BLOCK_TYPES
+    # Whether requests to hosts in none of the lists are blocked.
+    block_unlisted: bool = True
+
+    @classmethod
+    def allow_all(cls) -> ResourcePolicy:
+        """A policy that blocks nothing, e.g. to only count requests."""
+        return cls((), (), (), (), block_unlisted=False)
+
+    @classmethod
+    def from_file(cls, path: str) -> ResourcePolicy:
+        """Reads a policy from a JSON object with the fields of this class.
+
+        Missing fields keep their defaults."""
+        with open(path, encoding="utf-8") as f:
+            config = json.load(f)
+        names = {f.name for f in fields(cls)}
+        if not isinstance(config, dict) or not set(config) <= names:
+            raise ValueError(f"Resource policy must be an object with the fields {sorted(names)}.")
+        return cls(**{k: v if isinstance(v, bool) else tuple(v) for k, v in config.items()})
+
+    @property
+    def intercepts(self) -> bool:
+        return bool(self.deny_hosts or self.block_types or self.block_unlisted)
+
+    def blocked_reason(self, url: str, resource_type: str) -> str | None:
+        """Returns why a request is blocked, or None if it is loaded."""
+        host = (urlsplit(url).hostname or "").lower()
+        if not host:
+            # data:, blob: and the like never reach the network.
+            return None
+        if _matches(host, self.deny_hosts):
+            return BLOCKED_DENIED
+        if _matches(host, self.essential_hosts):
+            return None
+        if resource_type in self.block_types:
+            return BLOCKED_TYPE
+        if self.block_unlisted and not _matches(host, self.allow_hosts):
+            return BLOCKED_UNLISTED
+        return None
+
+
+def _matches(host: str, patterns: tuple[str, ...]) -> bool:
+    return any(fnmatchcase(host, pattern) for pattern in patterns)
+
+
+class NetworkFilter:
+    """Applies a ResourcePolicy to all pages and frames of a running browser."""
+
+    def __init__(self, policy: ResourcePolicy, host: str, port: int):
+        self.policy = policy
+        self.host = host
+        self.port = port
+        self.requests = 0
+        self.bytes_received = 0
+        self.blocked: Counter[str] = Counter()
+        self._ws = None
+        self._thread: threading.Thread | None = None
+        self._next_id = 0
+        self._setup_pending: set[int] = set()
+        self._auto_attach_id: int | None = None
+        self._ready = threading.Event()
+
+    def start(self, timeout: float = 5.0) -> None:
+        """Connects to the browser and waits until its pages are filtered."""
+        import urllib.request
+
+        # Installed with seleniumbase.
+        from websockets.sync.client import connect
+
+        version_url = f"http://{self.host}:{self.port}/json/version"
+        with urllib.request.urlopen(version_url, timeout=timeout) as response:
+            ws_url = json.load(response)["webSocketDebuggerUrl"]
+        self._ws = connect(ws_url, max_size=None, open_timeout=timeout)
+        # Attaches to existing pages as well as to new ones, which wait until
+        # their requests are intercepted.
+        self._auto_attach_id = self._send("Target.setAutoAttach", _AUTO_ATTACH)
+        self._thread = threading.Thread(target=self._run, name="network-filter", daemon=True)
+        self._thread.start()
+        if not self._ready.wait(timeout):
+            logger.warning("Network filter not confirmed after %.0fs, continuing.", timeout)
+
+    def stop(self) -> None:
+        """Disconnects, which also ends the interception."""
+        if self._ws is not None:
+            self._ws.close()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+        self._ws = None
+        self._thread = None
+
+    def __enter__(self) -> NetworkFilter:
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _send(self, method: str, params: dict | None = None, session_id: str | None = None) -> int:
+        self._next_id += 1
+        message = {"id": self._next_id, "method": method, "params": params or {}}
+        if session_id is not None:
+            message["sessionId"] = session_id
+        self._ws.send(json.dumps(message))
+        return self._next_id
+
+    def _run(self) -> None:
+        from websockets.exceptions import ConnectionClosed
+
+        try:
+            for raw in self._ws:
+                message = json.loads(raw)
+                if "id" in message:
+                    self._on_response(message)
+                else:
+                    self._on_event(message)
+        except ConnectionClosed:
+            pass
+        except Exception:
+            logger.warning("Network filter failed.", exc_info=True)
+        finally:
+            self._ready.set()
+
+    def _on_response(self, message: dict) -> None:
+        if "error" in message:
+            logger.debug("Network filter: command %d failed: %s", message["id"], message["error"])
+        self._setup_pending.discard(message["id"])
+        if message["id"] == self._auto_attach_id:
+            self._auto_attach_id = None
+        if self._auto_attach_id is None and not self._setup_pending:
+            self._ready.set()
+
+    def _on_event(self, message: dict) -> None:
+        method = message.get("method")
+        params = message.get("params", {})
+        session_id = message.get("sessionId")
+        if method == "Fetch.requestPaused":
+            request = params["request"]
+            reason = self.policy.blocked_reason(request["url"], params.get("resourceType", ""))
+            if reason is None:
+                self._send("Fetch.continueRequest", {"requestId": params["requestId"]}, session_id)
+            else:
+                self.blocked[reason] += 1
+                logger.debug("Blocked (%s) %s", reason, request["url"][:200])
+                self._send(
+                    "Fetch.failRequest",
+                    {"requestId": params["requestId"], "errorReason": "BlockedByClient"},
+                    session_id,
+                )
+        elif method == "Network.requestWillBeSent":
+            if urlsplit(params["request"]["url"]).hostname:
+                self.requests += 1
+        elif method == "Network.loadingFinished":
+            self.bytes_received += int(params.get("encodedDataLength", 0))
+        elif method == "Target.attachedToTarget":
+            self._on_attached(params)
+
+    def _on_attached(self, params: dict) -> None:
+        session_id = params["sessionId"]
+        if params["targetInfo"]["type"] in _FILTERED_TARGET_TYPES:
+            if self.policy.intercepts:
+                fetch_id = self._send("Fetch.enable", {"patterns": [{"urlPattern": "*"}]}, session_id)
+                self._setup_pending.add(fetch_id)
+            self._setup_pending.add(self._send("Network.enable", {}, session_id))
+            # Cross-origin frames, e.g. the captcha widget, are separate targets.
+            self._send("Target.setAutoAttach", _AUTO_ATTACH, session_id)
+        if params.get("waitingForDebugger"):
+            self._send("Runtime.runIfWaitingForDebugger", {}, session_id)
+
+    def summary(self) -> str:
+        blocked = sum(self.blocked.values())
+        details = ", ".join(f"{n} {reason}" for reason, n in sorted(self.blocked.items()))
+        return (
+            f"{self.requests} requests, {blocked} blocked"
+            + (f" ({details})" if details else "")
+            + f", {self.bytes_received / 1024:.0f} KiB received"
+        )
+
+
+def from_setting(setting: str) -> ResourcePolicy | None:
+    """Returns the policy for a --resource-policy value: "default", "off" or
+    the path of a JSON file (see ResourcePolicy.from_file)."""
+    if setting == "default":
+        return ResourcePolicy()
+    if setting == "off":
+        return None
+    return ResourcePolicy.from_file(setting)
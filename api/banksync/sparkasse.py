@@ -1,13 +1,36 @@
+from __future__ import annotations
+
 import argparse
+import codecs
+import contextlib
+import csv
 import getpass
+import hashlib
+import io
 import logging
-import random
+import os
 import sys
-import time
-from urllib.parse import urljoin
-
-import requests
-from lxml import html
+import tempfile
+from datetime import date, datetime
+from typing import TYPE_CHECKING, BinaryIO, Iterable, Iterator
+from urllib.parse import urljoin, urlsplit
+
+import dedup
+import imported_rows
+import metrics
+import sparkasse_pages
+from checkpoints import AccountCheckpoint, CheckpointStore, is_token
+from dedup import Deduplicator
+from imported_rows import RowWriter
+from throttle import Throttle, ThrottlePolicy
+from worker_client import forward_cli
+
+# requests and lxml are imported lazily where they are needed, so that argument
+# errors and forwarding to the worker don't pay for them. See
+# benchmarks/import_time.py.
+if TYPE_CHECKING:
+  import requests
+  from lxml import html
 
 # This is the encoding that Sparkasse uses for their CSV files.
 SERVER_FILE_ENCODING = 'windows-1252'
@@ -17,8 +40,19 @@ SERVER_FILE_ENCODING = 'windows-1252'
 OUTPUT_ENCODING = 'utf-8'
 
 EMPTY_RESULT_PLACEHOLDER = '<EMPTY_RESULT_SET>'
-ACCEPTED_EXPORT_BUTTONS = ['Excel (CSV-CAMT V2)', 'Excel (CSV-CAMT)', 'CSV-Export']
-THROTTLE_DELAY_RANGE = (0.5, 1.5)
+EMPTY_RESULT_BYTES = (EMPTY_RESULT_PLACEHOLDER + '\n').encode(OUTPUT_ENCODING)
+# Bytes of the CSV export that are read, transcoded and written at a time.
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+ACCEPTED_EXPORT_BUTTONS = sparkasse_pages.ACCEPTED_EXPORT_BUTTONS
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:84.0) Gecko/20100101 Firefox/84.0'
+# Seconds to wait for connecting to and for each response from the bank.
+REQUEST_TIMEOUT = 60
+# Retries of idempotent requests on connection errors and 429/5xx responses.
+MAX_RETRIES = 3
+
+# Spacing between the steps of the scraper; replaced in main() from the
+# --throttle-* arguments.
+throttle = Throttle(ThrottlePolicy())
 
 def log_result_error(*msg):
   logging.error(' '.join(str(s) for s in msg))
@@ -31,15 +65,70 @@ def log_debug(*msg):
   logging.debug(' '.join(str(s) for s in msg))
 
 
-def wait():
-  log_info('(Throttling ...)')
-  time.sleep(random.uniform(*THROTTLE_DELAY_RANGE))
+def wait(url: str):
+  """Throttles before the next step against the bank at url."""
+  slept = throttle.wait(url)
+  if slept > 0:
+    log_debug('(Throttled for %.2fs)' % slept)
+
+
+def on_response(response: requests.Response, *args, **kwargs):
+  """Response hook that feeds the throttle and the run's metrics."""
+  throttle.record_response(response.url)
+  metrics.count('requests')
+  # Streamed bodies are counted while they are read, see iter_decoded.
+  if not kwargs.get('stream'):
+    metrics.count('bytes_received', len(response.content))
+  metrics.count('network_ms', round(response.elapsed.total_seconds() * 1000))
+
+
+def make_session(timeout: float, max_retries: int) -> requests.Session:
+  """Creates a session with keep-alive connection pooling, a default timeout and
+  bounded retries of idempotent requests."""
+  import requests
+  from requests.adapters import HTTPAdapter
+  from urllib3.util.retry import Retry
+
+  class CountingRetry(Retry):
+    def increment(self, *args, **kwargs):
+      metrics.count('retries')
+      return super().increment(*args, **kwargs)
+
+  class TimeoutAdapter(HTTPAdapter):
+    def send(self, request, **kwargs):
+      if kwargs.get('timeout') is None:
+        kwargs['timeout'] = timeout
+      return super().send(request, **kwargs)
+
+  retry = CountingRetry(
+    total=max_retries,
+    backoff_factor=0.5,
+    status_forcelist=(429, 500, 502, 503, 504),
+    # Never repeat form submissions (POST).
+    allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+    raise_on_status=False,
+  )
+  # The scraper talks to a single host, one request at a time.
+  adapter = TimeoutAdapter(pool_connections=1, pool_maxsize=2, max_retries=retry)
+  session = requests.Session()
+  session.mount('https://', adapter)
+  session.mount('http://', adapter)
+  session.headers.update({'User-Agent': USER_AGENT})
+  session.hooks['response'].append(on_response)
+  return session
+
+
+def log_time_breakdown():
+  run = metrics.run
+  throttled = sum(span['duration'] for span in run.spans if span['name'] == 'throttle')
+  network = run.counters.get('network_ms', 0) / 1000
+  log_info('Took %.1fs: %.1fs throttling, %.1fs waiting for the bank.' % (run.elapsed(), throttled, network))
 
 
 def to_html(response: requests.Response):
-  doc = html.fromstring(response.text)
-  doc.make_links_absolute(response.url)
-  return doc
+  # Form actions resolve against the response URL; links are made absolute
+  # only when they are followed (see sparkasse_pages).
+  return sparkasse_pages.parse(response.text, response.url)
 
 
 def find_form_by_value(doc: html.HtmlElement, value: str) -> html.FormElement:
@@ -62,7 +151,7 @@ def infer_msgerror(doc: html.HtmlElement) -> str:
   """Extract error messages from HTML document, or return a generic error.
   Only use when it is already known that an error occured."""
 
-  errors = [e.text_content() for e in doc.cssselect('.msgerror')]
+  errors = sparkasse_pages.error_messages(doc)
   if not errors:
     return 'Cause unknown!'
   for i in range(len(errors)):
@@ -89,7 +178,7 @@ def do_login(session: requests.Session, base_url: str, user_id: str, user_pass:
       input_elem.value = user_pass
     #log_debug(input_elem.name + ' -> ' + input_elem.value)
   
-  wait()
+  wait(url)
   log_info('Logging in...')
   r = submit_form(session, login_form)
   log_debug('Response URL:', r.url)
@@ -109,22 +198,22 @@ def do_login(session: requests.Session, base_url: str, user_id: str, user_pass:
     return False
 
 
-def do_select_account(session: requests.Session, base_url: str, account_index: int):
-  """Chooses the correct account based on its index and returns the HTML doc of its 'Umsätze' (transactions) page."""
+def do_list_accounts(session: requests.Session, base_url: str):
+  """Loads the account overview and returns the name and URL of each account, in the displayed order."""
 
   log_info('Navigating to account selection page ...')
   url = urljoin(base_url, '/de/home/onlinebanking/nbf/finanzuebersicht.html')
   r = session.get(url)
   doc = to_html(r)
 
-  account_links = doc.cssselect('.mkp-card-bank-account a.mkp-identifier-link')
-  log_debug('List of account names:', [account.text_content().strip() for account in account_links])
-  if account_index >= len(account_links):
-    log_result_error('Tried to access account with index', account_index, ', but found too few accounts:', len(account_links))
-    return None
-  
-  chosen_account_url = account_links[account_index].get('href')
-  r = session.get(chosen_account_url)
+  accounts = sparkasse_pages.account_links(doc)
+  log_debug('List of account names:', [name for name, _ in accounts])
+  return accounts
+
+
+def do_select_account(session: requests.Session, account_url: str):
+  """Opens an account and returns the HTML doc of its 'Umsätze' (transactions) page."""
+  r = session.get(account_url)
   if 'umsaetze.html' in r.url:
     return to_html(r)
   else:
@@ -161,51 +250,218 @@ def do_apply_date_filter(session: requests.Session, transactions_doc: html.HtmlE
   
   log_info('Submitting search for %s - %s ...' % (date_from, date_to))
   r = submit_form(session, search_form)
+  # Decoding is not cached by requests, so only do it once.
+  text = r.text
+  result = sparkasse_pages.classify_search_result(text)
   
   # Special case: Empty result set (export buttin is still there, but would be pointless)
-  if 'Keine Suchergebnisse' in r.text:
+  if result == sparkasse_pages.SEARCH_EMPTY:
     log_info('Detected magic string indicating an empty results page!')
     return EMPTY_RESULT_PLACEHOLDER
   
   # Success!
-  if any([button in r.text for button in ACCEPTED_EXPORT_BUTTONS]):
-    return to_html(r)
+  if result == sparkasse_pages.SEARCH_EXPORTABLE:
+    return sparkasse_pages.parse(text, r.url)
   
   # Error: TAN entry required
-  if 'ssen Sie eine Freigabe erteilen' in r.text:
+  if result == sparkasse_pages.SEARCH_TAN_REQUIRED:
     log_result_error('Bank is asking for TAN verification for this search! You have to export this date range manually.')
     return None
   
   # Other error
-  doc = to_html(r)
+  doc = sparkasse_pages.parse(text, r.url)
   log_result_error('Search did not return the CSV export button unexpectedly!',
       infer_msgerror(doc))
   return None
 
 
-def do_export_csv(session: requests.Session, transactions_doc: html.HtmlElement) -> bytes:
-  export_links = transactions_doc.cssselect('.nbf-druckExportOption a')
-  accepted_export_links = [el for el in export_links \
-    if any(button_text in el.text_content() for button_text in ACCEPTED_EXPORT_BUTTONS)]
+def do_export_csv(session: requests.Session, transactions_doc: html.HtmlElement) -> requests.Response:
+  """Requests the CSV export. Returns the response with its body not read yet, to be streamed with iter_decoded."""
+  export_links = sparkasse_pages.export_links(transactions_doc)
+  accepted_export_links = [(text, href) for text, href in export_links \
+    if any(button_text in text for button_text in ACCEPTED_EXPORT_BUTTONS)]
     
-  log_debug('Available export formats:', [el.text_content().strip() for el in export_links])
-  log_debug('Accepted export formats:', [el.text_content().strip() for el in accepted_export_links])
+  log_debug('Available export formats:', [text for text, _ in export_links])
+  log_debug('Accepted export formats:', [text for text, _ in accepted_export_links])
   
   if len(accepted_export_links) == 0:
     log_result_error('Could not find any supported CSV export format!')
     return None
   
   log_info('Requesting CSV export ...')
-  r = session.get(accepted_export_links[0].get('href'))
+  r = session.get(sparkasse_pages.absolute(transactions_doc, accepted_export_links[0][1]), stream=True)
   log_debug('Response URL: ', r.url)
-  log_debug('Response length: ', len(r.content), 'bytes')
+  log_debug('Response length: ', r.headers.get('Content-Length', 'unknown'), 'bytes')
   if not 'services/download.service' in r.url:
+    metrics.count('bytes_received', len(r.content))
     doc = to_html(r)
     log_result_error('Form did not lead to a download link!', infer_msgerror(doc))
     return None
   
-  # Return raw content to avoid picking any charset. Just return the data as-is.
-  return r.content
+  # Return the raw response to avoid picking any charset; the data is decoded as SERVER_FILE_ENCODING.
+  return r
+
+
+def iter_decoded(response: requests.Response, chunk_size: int = DOWNLOAD_CHUNK_SIZE) -> Iterator[str]:
+  """Reads a streamed response chunk by chunk and decodes it as SERVER_FILE_ENCODING."""
+  decoder = codecs.getincrementaldecoder(SERVER_FILE_ENCODING)()
+  for chunk in response.iter_content(chunk_size):
+    metrics.count('bytes_received', len(chunk))
+    text = decoder.decode(chunk)
+    if text:
+      yield text
+  text = decoder.decode(b'', final=True)
+  if text:
+    yield text
+
+
+def iter_lines(chunks: Iterable[str]) -> Iterator[str]:
+  """Splits text chunks into lines, keeping the line endings like a file opened with newline=''."""
+  pending = ''
+  for chunk in chunks:
+    *lines, pending = (pending + chunk).split('\n')
+    for line in lines:
+      yield line + '\n'
+  if pending:
+    yield pending
+
+
+class OutputWriter:
+  """Writes text to a binary stream, encoded as OUTPUT_ENCODING as it comes."""
+
+  def __init__(self, stream: BinaryIO):
+    self.stream = stream
+    self.encoder = codecs.getincrementalencoder(OUTPUT_ENCODING)()
+    self.bytes_written = 0
+
+  def write(self, text: str):
+    self.write_bytes(self.encoder.encode(text))
+
+  def write_bytes(self, data: bytes):
+    self.stream.write(data)
+    self.bytes_written += len(data)
+
+  def finish(self):
+    self.write_bytes(self.encoder.encode('', final=True))
+    self.stream.flush()
+
+
+def to_iso_date(german_date: str) -> str | None:
+  """Converts DD.MM.YYYY or DD.MM.YY to YYYY-MM-DD. Returns None if invalid."""
+  for date_format in ('%d.%m.%Y', '%d.%m.%y'):
+    try:
+      return datetime.strptime(german_date, date_format).date().isoformat()
+    except ValueError:
+      pass
+  return None
+
+
+def from_iso_date(iso_date: str) -> str:
+  return date.fromisoformat(iso_date).strftime('%d.%m.%Y')
+
+
+def transcode_export(chunks: Iterable[str], writer: OutputWriter, checkpoints: CheckpointStore | None,
+    checkpoint: AccountCheckpoint | None, row_writer: RowWriter | None = None,
+    deduplicator: Deduplicator | None = None):
+  """Writes the decoded CSV export to writer, dropping the rows that were already exported before the checkpoint
+  or that the deduplicator knows.
+
+  Sparkasse exports have no transaction ids, so rows are identified by a hash of
+  their values. Without checkpoints the data is passed through as-is. If a
+  row_writer is given, the rows are written to it instead of as CSV.
+  Returns the number of data rows written and the booked rows as (fingerprint,
+  ISO date) for the next checkpoint. The latter is None if the CSV format is not
+  understood. If all rows are dropped, nothing is written, not even the header."""
+  if checkpoints is None and row_writer is None and deduplicator is None:
+    for chunk in chunks:
+      writer.write(chunk)
+    return None, None
+
+  lines = iter_lines(chunks)
+  # The header has no line breaks in quoted values.
+  header_line = next(lines, '')
+  header = next(csv.reader([header_line], delimiter=';'), None)
+  if not header or 'Buchungstag' not in header:
+    log_info('Unknown CSV format, cannot use checkpoints!')
+    if row_writer is None and deduplicator is None:
+      writer.write(header_line)
+      for line in lines:
+        writer.write(line)
+      return None, None
+    checkpoints = checkpoint = None
+  date_column = header.index('Buchungstag') if checkpoints is not None else None
+  info_column = header.index('Info') if 'Info' in header else None
+
+  since = exported = None
+  if checkpoint is not None:
+    since = checkpoint.since('')
+    exported = set(checkpoint.exported_ids)
+  csv_writer = None
+  if row_writer is None:
+    if checkpoint is None and deduplicator is None:
+      writer.write(header_line)
+      lines = _tee(lines, writer)
+    else:
+      csv_writer = csv.writer(writer, delimiter=';', quoting=csv.QUOTE_ALL, lineterminator='\r\n')
+
+  booked = []
+  row_count = 0
+  for row in csv.reader(lines, delimiter=';'):
+    if not row:
+      continue
+    row_date = None
+    pending = info_column is not None and info_column < len(row) and 'vorgemerkt' in row[info_column]
+    if date_column is not None:
+      fingerprint = hashlib.sha256('\x1f'.join(row).encode('utf-8')).hexdigest()[:32]
+      row_date = to_iso_date(row[date_column]) if date_column < len(row) else None
+      if row_date and not pending:
+        booked.append((fingerprint, row_date))
+    if not (checkpoint is None or pending or not row_date \
+        or (row_date >= since and fingerprint not in exported)):
+      continue
+    values = dict(zip(header, row))
+    if deduplicator is not None and deduplicator.is_known(imported_rows.FILE_FORMAT_SPARKASSE, values):
+      continue
+    row_count += 1
+    if csv_writer is not None:
+      if row_count == 1:
+        csv_writer.writerow(header)
+      csv_writer.writerow(row)
+    elif row_writer is not None:
+      row_writer.write(values)
+  return row_count, booked if date_column is not None else None
+
+
+def _tee(lines: Iterable[str], writer: OutputWriter) -> Iterator[str]:
+  for line in lines:
+    writer.write(line)
+    yield line
+
+
+@contextlib.contextmanager
+def open_output(output_file: str | None) -> Iterator[OutputWriter]:
+  """Opens the output of an account, which is stdout if output_file is None.
+
+  stdout is written to as the export is downloaded, so its reader gets the first rows early; if the download breaks
+  off, the script exits with an error. An output_file is read once the script is done, possibly by someone ignoring
+  that error, so it is written to a temporary file next to it, which only replaces it once the block completes."""
+  if output_file is None:
+    writer = OutputWriter(sys.stdout.buffer)
+    yield writer
+    writer.finish()
+  else:
+    directory, name = os.path.split(os.path.abspath(output_file))
+    fd, temp_file = tempfile.mkstemp(dir=directory, prefix=name + '.', suffix='.part')
+    try:
+      with open(fd, 'wb') as f:
+        writer = OutputWriter(f)
+        yield writer
+        writer.finish()
+      os.replace(temp_file, output_file)
+    except BaseException:
+      os.unlink(temp_file)
+      raise
+  log_info('Done! Written %d bytes to %s.' % (writer.bytes_written, output_file or 'stdout'))
 
 
 def do_logout(session: requests.Session, last_doc: html.HtmlElement):
@@ -217,22 +473,127 @@ def do_logout(session: requests.Session, last_doc: html.HtmlElement):
   log_debug('Post logout URL:', r.url)
 
 
+def export_account(session: requests.Session, base_url: str, account_index: int, account, date_from: str,
+    date_to: str, checkpoints: CheckpointStore | None, incremental: bool, output_file: str | None,
+    output_format: str = 'csv', deduplicator: Deduplicator | None = None):
+  """Exports the transactions of one account from the account overview.
+
+  Writes the CSV data encoded as OUTPUT_ENCODING (or EMPTY_RESULT_PLACEHOLDER) to output_file (or stdout), transcoding it
+  while it is downloaded, or the rows in one of the other imported_rows.OUTPUT_FORMATS. Returns the last loaded page, or None on
+  error."""
+  # The row formats represent an empty result by no rows at all.
+  empty_result = EMPTY_RESULT_BYTES if output_format == 'csv' else b''
+  account_name, account_url = account
+  account_key = sparkasse_pages.account_key(account_name, account_url)
+  log_info('Exporting account %d ...' % account_index)
+  wait(base_url)
+  with metrics.span('transaction_fetch', step='account'):
+    transactions_doc = do_select_account(session, account_url)
+  if transactions_doc is None:
+    return None
+
+  checkpoint = None
+  if checkpoints is not None and incremental:
+    checkpoint = checkpoints.get(account_index, account_key)
+    if checkpoint is not None:
+      date_from = from_iso_date(checkpoint.since(to_iso_date(date_from)))
+      log_info('Incremental export since %s.' % date_from)
+
+  wait(base_url)
+  with metrics.span('transaction_fetch', step='search'):
+    transactions_doc2 = do_apply_date_filter(session, transactions_doc, date_from, date_to)
+  if transactions_doc2 is None:
+    return None
+  if transactions_doc2 == EMPTY_RESULT_PLACEHOLDER:
+    if checkpoints is not None:
+      checkpoints.update(account_index, account_key, [])
+      checkpoints.save()
+    write_result(empty_result, output_file)
+    return transactions_doc
+
+  wait(base_url)
+  with metrics.span('transaction_fetch', step='download'):
+    response = do_export_csv(session, transactions_doc2)
+  if response is None:
+    return None
+
+  # Downloading, transcoding and writing overlap, so they share one span.
+  with metrics.span('export', streamed=True), response, open_output(output_file) as writer:
+    row_writer = None
+    if output_format != 'csv':
+      row_writer = RowWriter(writer.write_bytes, output_format, imported_rows.FILE_FORMAT_SPARKASSE)
+    row_count, booked = transcode_export(iter_decoded(response), writer, checkpoints, checkpoint, row_writer,
+        deduplicator)
+    if (checkpoint is not None or deduplicator is not None) and row_count == 0:
+      log_info('No new transactions since the last sync.')
+      writer.write_bytes(empty_result)
+  if booked is not None:
+    checkpoints.update(account_index, account_key, booked)
+    checkpoints.save()
+  return transactions_doc2
+
+
+def write_result(data: bytes, output_file: str | None):
+  with metrics.span('export'), open_output(output_file) as writer:
+    writer.write_bytes(data)
+
+
+def parse_account_indices(raw: str):
+  """Parses a comma-separated list of account indices. Returns None if invalid."""
+  try:
+    indices = [int(part) for part in raw.split(',')]
+  except ValueError:
+    return None
+  return indices if all(i >= 0 for i in indices) else None
+
+
 def main():
   parser = argparse.ArgumentParser(description='Exports bank statements from Sparkasse online banking.')
   parser.add_argument('--base', required=True, help='Base URL of the Sparkasse website.')
   parser.add_argument('--from', required=True, help='Begin of date range to export in DD.MM.YYYY format.')
   parser.add_argument('--to', required=True, help='End of date range to export in DD.MM.YYYY format.')
   parser.add_argument('-v', '--verbose', action='store_true', help='Enable verbose logging.')
+  parser.add_argument('--checkpoint-dir', help='Directory for sync checkpoints. If given, the newest exported '
+      'transactions are recorded there after every export.')
+  parser.add_argument('--incremental', action='store_true', help='Only export transactions that were not '
+      'exported by a previous sync, based on the checkpoints in --checkpoint-dir.')
+  parser.add_argument('--checkpoint-token', help='Do not update the checkpoints, but record the update as pending '
+      'under this token (32 hex digits), to be committed once the client imported the export (see checkpoints.py).')
+  parser.add_argument('--output', '-o', action='append', help='File to write the export of an account to. Required '
+      'when exporting several accounts; specify it once per account, in the same order. Defaults to stdout.')
+  parser.add_argument('--format', choices=imported_rows.OUTPUT_FORMATS, default='csv', help='Output format: the '
+      'CSV export of the bank (default), or its rows as newline-delimited JSON or length-delimited ImportedRow '
+      'protobuf messages (see imported_rows.py).')
+  parser.add_argument('--timeout', type=float, default=REQUEST_TIMEOUT, help='Timeout for each request in seconds.')
+  parser.add_argument('--throttle-min-spacing', type=float, default=ThrottlePolicy.min_spacing,
+      help='Seconds between a response and the next step, at least. Local work in between counts towards it.')
+  parser.add_argument('--throttle-jitter', type=float, default=ThrottlePolicy.jitter,
+      help='Random extra spacing of up to this many seconds.')
+  parser.add_argument('--throttle-rate', type=float, default=ThrottlePolicy.rate,
+      help='Sustained number of steps per second against the bank.')
+  parser.add_argument('--throttle-burst', type=int, default=ThrottlePolicy.burst,
+      help='Number of steps that may exceed --throttle-rate at once.')
+  dedup.add_arguments(parser)
+  metrics.add_arguments(parser)
 
   args = parser.parse_args()
   base_url = args.base
   date_from = getattr(args, 'from')
   date_to = args.to
+  if to_iso_date(date_from) is None:
+    parser.error('--from must be in DD.MM.YYYY format.')
+  if args.incremental and not args.checkpoint_dir:
+    parser.error('--incremental requires --checkpoint-dir.')
+  if args.checkpoint_token is not None and not is_token(args.checkpoint_token):
+    parser.error('--checkpoint-token must be 32 hex digits.')
+  if min(args.throttle_min_spacing, args.throttle_jitter, args.throttle_rate) < 0 or args.throttle_burst < 1:
+    parser.error('--throttle-* values must not be negative, and the burst must be at least 1.')
 
   logging.basicConfig(
     level=logging.DEBUG if args.verbose else logging.INFO,
     format='[%(levelname)s] %(message)s'
   )
+  metrics.configure('sparkasse', args)
 
   if sys.stderr.isatty():
     # Only print prompts when connected to terminal. Note that we want to print
@@ -241,51 +602,72 @@ def main():
     user_id = input()
     print('Password: ', file=sys.stderr, end='', flush=True)
     user_pass = getpass.getpass('')
-    print('Account index (0=first): ', file=sys.stderr, end='')
-    raw_account_index = input()
+    print('Account indices (0=first, comma-separated): ', file=sys.stderr, end='')
+    raw_account_indices = input()
   else:
     user_id = input()
     user_pass = input()
-    raw_account_index = input()
-  account_index = int(raw_account_index)
-
-
-  user_agent = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:84.0) Gecko/20100101 Firefox/84.0'
-  session = requests.Session()
-  session.headers.update({'User-Agent': user_agent})
-  
-  success = do_login(session, base_url, user_id, user_pass)
-  if not success:
+    raw_account_indices = input()
+  account_indices = parse_account_indices(raw_account_indices)
+  if account_indices is None:
+    log_result_error('Invalid account indices:', raw_account_indices)
     return False
-  
-  wait()
-  transactions_doc = do_select_account(session, base_url, account_index)
-  if transactions_doc is None:
+  output_files = args.output or [None]
+  if len(output_files) != len(account_indices):
+    log_result_error('Number of account indices and output files must match.')
     return False
-  
-  wait()
-  transactions_doc2 = do_apply_date_filter(session, transactions_doc, date_from, date_to)
-  if transactions_doc2 is None:
+  dedup_error = dedup.check_args(args, len(account_indices))
+  if dedup_error is not None:
+    log_result_error(dedup_error)
     return False
-  if transactions_doc2 == EMPTY_RESULT_PLACEHOLDER:
-    print(EMPTY_RESULT_PLACEHOLDER)
-    return True
+
+  global throttle
+  throttle = Throttle(ThrottlePolicy(
+    min_spacing=args.throttle_min_spacing,
+    jitter=args.throttle_jitter,
+    rate=args.throttle_rate,
+    burst=args.throttle_burst,
+  ))
+  session = make_session(args.timeout, MAX_RETRIES)
+  deduplicators = dedup.from_args(args, len(account_indices))
   
-  wait()
-  csv_bytes = do_export_csv(session, transactions_doc2)
-  if csv_bytes is None:
+  with metrics.span('login'):
+    success = do_login(session, base_url, user_id, user_pass)
+  if not success:
     return False
-
-  reencoded_bytes = csv_bytes.decode(SERVER_FILE_ENCODING).encode(OUTPUT_ENCODING)
-  sys.stdout.buffer.write(reencoded_bytes)
-  sys.stdout.buffer.flush()
-  log_info('Done! Written %d bytes to stdout.' % len(csv_bytes))
   
-  wait()
-  do_logout(session, transactions_doc2)
+  wait(base_url)
+  with metrics.span('account_listing'):
+    accounts = do_list_accounts(session, base_url)
+  for account_index in account_indices:
+    if account_index >= len(accounts):
+      log_result_error('Tried to access account with index', account_index, ', but found too few accounts:', len(accounts))
+      return False
+
+  checkpoints = None
+  if args.checkpoint_dir:
+    checkpoints = CheckpointStore(args.checkpoint_dir, 'sparkasse:' + urlsplit(base_url).netloc, user_id,
+        args.checkpoint_token)
+
+  # All accounts are exported in this session, so there is only one login.
+  last_doc = None
+  for account_index, output_file, deduplicator in zip(account_indices, output_files, deduplicators):
+    last_doc = export_account(session, base_url, account_index, accounts[account_index], date_from, date_to,
+        checkpoints, args.incremental, output_file, args.format, deduplicator)
+    if last_doc is None:
+      return False
+  
+  wait(base_url)
+  do_logout(session, last_doc)
   session.close()
+  log_time_breakdown()
   return True
 
 
 if __name__ == "__main__":
-  exit(0 if main() else 2)
+  # Hand the job to a running worker (see worker.py) if one is configured.
+  exit_code = forward_cli('sparkasse')
+  if exit_code is None:
+    exit_code = 0 if main() else 2
+    metrics.flush(exit_code)
+  exit(exit_code)
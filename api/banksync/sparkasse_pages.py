@@ -0,0 +1,120 @@
+"""
+Analysis of the Sparkasse online banking pages that sparkasse.py scrapes.
+
+Pages are parsed once with their URL as base URL, so that form actions resolve
+without rewriting every link in the document; only the links that are
+actually followed are made absolute. Element lookups use XPath expressions
+that are compiled once (the equivalent cssselect() calls translate their CSS
+selector to XPath on every call). Search results are classified with a single
+scan of the response text, and only parsed if they are needed.
+
+lxml is imported on first use, see benchmarks/import_time.py.
+"""
+from __future__ import annotations
+
+import functools
+import re
+from typing import TYPE_CHECKING
+from urllib.parse import urljoin
+
+if TYPE_CHECKING:
+    from lxml import etree, html
+
+# Link texts of the supported CSV exports, in order of preference.
+ACCEPTED_EXPORT_BUTTONS = ["Excel (CSV-CAMT V2)", "Excel (CSV-CAMT)", "CSV-Export"]
+
+# Classes of a search result page, see classify_search_result.
+SEARCH_EMPTY = "empty"
+SEARCH_EXPORTABLE = "exportable"
+SEARCH_TAN_REQUIRED = "tan_required"
+SEARCH_ERROR = "error"
+
+# An IBAN as shown on the account overview, possibly grouped with spaces.
+_IBAN_RE = re.compile(r"\b[A-Z]{2}\d{2}(?: ?[A-Z0-9]{4}){3,7}(?: ?[A-Z0-9]{1,3})?\b")
+
+_EMPTY_MARKER = "Keine Suchergebnisse"
+_TAN_MARKER = "ssen Sie eine Freigabe erteilen"
+_SEARCH_MARKERS = re.compile(
+    "|".join(re.escape(m) for m in [_EMPTY_MARKER, _TAN_MARKER, *ACCEPTED_EXPORT_BUTTONS])
+)
+
+
+def _has_class(name: str) -> str:
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+class _XPaths:
+    """The XPath expressions used on the pages, compiled once."""
+
+    def __init__(self):
+        from lxml import etree
+
+        # .mkp-card-bank-account a.mkp-identifier-link
+        self.account_links = etree.XPath(
+            f"//*[{_has_class('mkp-card-bank-account')}]//a[{_has_class('mkp-identifier-link')}]"
+        )
+        # .nbf-druckExportOption a
+        self.export_links = etree.XPath(f"//*[{_has_class('nbf-druckExportOption')}]//a")
+        # .msgerror
+        self.error_messages = etree.XPath(f"//*[{_has_class('msgerror')}]")
+        self.text = etree.XPath("string()")
+
+
+@functools.cache
+def _xpaths() -> _XPaths:
+    return _XPaths()
+
+
+def parse(text: str, url: str) -> html.HtmlElement:
+    """Parses a page. Form actions and absolute() resolve relative to url."""
+    from lxml import html
+
+    return html.fromstring(text, base_url=url)
+
+
+def absolute(doc: etree._Element, href: str) -> str:
+    """Makes a link found on doc absolute."""
+    return urljoin(doc.getroottree().docinfo.URL or "", href)
+
+
+def _normalized_text(element: etree._Element) -> str:
+    return " ".join(_xpaths().text(element).split())
+
+
+def account_links(doc: html.HtmlElement) -> list[tuple[str, str]]:
+    """Returns the name and absolute URL of each account on the overview page."""
+    return [
+        (_normalized_text(link), absolute(doc, link.get("href")))
+        for link in _xpaths().account_links(doc)
+    ]
+
+
+def account_key(name: str, url: str) -> str:
+    """Returns a stable id of an account of account_links(): its IBAN if the
+    link shows one, otherwise the link target. Unlike the name, it is unique."""
+    match = _IBAN_RE.search(name)
+    if match:
+        return match.group().replace(" ", "")
+    return url
+
+
+def export_links(doc: html.HtmlElement) -> list[tuple[str, str]]:
+    """Returns the text and (still relative) href of each export option."""
+    return [(_normalized_text(link), link.get("href")) for link in _xpaths().export_links(doc)]
+
+
+def error_messages(doc: html.HtmlElement) -> list[str]:
+    return [_xpaths().text(e) for e in _xpaths().error_messages(doc)]
+
+
+def classify_search_result(text: str) -> str:
+    """Tells from the raw text of a search result page what happened."""
+    found = {m.group() for m in _SEARCH_MARKERS.finditer(text)}
+    # The export buttons are still there if nothing was found, but pointless.
+    if _EMPTY_MARKER in found:
+        return SEARCH_EMPTY
+    if found.intersection(ACCEPTED_EXPORT_BUTTONS):
+        return SEARCH_EXPORTABLE
+    if _TAN_MARKER in found:
+        return SEARCH_TAN_REQUIRED
+    return SEARCH_ERROR
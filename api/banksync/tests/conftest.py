@@ -0,0 +1,40 @@
+"""
+Tests of the banksync scripts. Run them from this folder's parent with the
+interpreter of the venv:
+
+    python -m pytest tests
+"""
+import os
+import sys
+import threading
+
+import pytest
+
+BANKSYNC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The scripts import each other as top-level modules; the mock banks of the
+# benchmarks are used as test servers.
+sys.path.insert(0, BANKSYNC_DIR)
+sys.path.insert(1, os.path.join(BANKSYNC_DIR, "benchmarks"))
+
+
+@pytest.fixture
+def mock_dkb():
+    """Starts mock_dkb.py servers in-process: call with the arguments of MockDkb.
+    The returned bank has the API base URL as `base_url`."""
+    from mock_dkb import MockDkb, MockDkbServer
+
+    servers = []
+
+    def start(**kwargs) -> MockDkb:
+        kwargs = {"accounts": 1, "transactions": 20, "days": 30, "mfa_delay": 0, **kwargs}
+        bank = MockDkb(**kwargs)
+        server = MockDkbServer(bank)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        bank.base_url = server.base_url
+        return bank
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,179 @@
+import json
+import os
+import signal
+import subprocess
+from types import SimpleNamespace
+
+import pytest
+
+import browser_pool
+from dkb_captcha import DkbBrowser
+
+needs_proc = pytest.mark.skipif(not os.path.isdir("/proc"), reason="no /proc")
+
+
+def test_chrome_args_are_those_of_uc_mode(tmp_path):
+    from seleniumbase.undetected.cdp_driver.config import Config
+
+    profile_dir = str(tmp_path / "profile")
+    os.makedirs(profile_dir)
+    args = browser_pool.chrome_args("/usr/bin/chrome", profile_dir, 9333, headless=True)
+    expected = Config(
+        user_data_dir=str(tmp_path / "other"),
+        headless=True,
+        browser_executable_path="/usr/bin/chrome",
+        host="127.0.0.1",
+        port=9333,
+    )()
+    assert args[0] == "/usr/bin/chrome"
+    assert args[-1] == "about:blank"
+    assert f"--user-data-dir={profile_dir}" in args
+    assert {"--remote-debugging-port=9333", "--headless=new", "--lang=de"} <= set(args)
+    # Everything else matches what seleniumbase starts Chrome with.
+    assert [a for a in args[1:-1] if not a.startswith("--user-data-dir=")] == [
+        a for a in expected if not a.startswith("--user-data-dir=")
+    ] + browser_pool.EXTRA_CHROME_FLAGS
+    # UC mode's default preferences are written into the profile.
+    assert os.path.exists(os.path.join(profile_dir, "Default", "Preferences"))
+
+
+class _Loop:
+    def run_until_complete(self, result):
+        return result
+
+
+class _Page:
+    def __init__(self):
+        self.commands = []
+
+    def send(self, command):
+        # mycdp commands are generators that first yield the request.
+        self.commands.append(next(command))
+
+
+class _Cdp:
+    def __init__(self, cookie_domains):
+        self.page = _Page()
+        self.loop = _Loop()
+        self.cookie_domains = cookie_domains
+        self.opened = []
+
+    def get_all_cookies(self):
+        return [SimpleNamespace(domain=d) for d in self.cookie_domains]
+
+    def open(self, url):
+        self.opened.append(url)
+
+
+class _Lease:
+    def __init__(self):
+        self.released = []
+
+    def release(self, healthy=True):
+        self.released.append(healthy)
+
+
+def _recycle(cdp) -> _Lease:
+    browser = DkbBrowser()
+    browser.cdp = cdp
+    lease = browser._lease = _Lease()
+    browser._recycle_pooled()
+    assert browser._lease is None
+    return lease
+
+
+def test_recycle_clears_all_storage_of_dkb_origins():
+    cdp = _Cdp([".dkb.de", "banking.dkb.de", "login.dkb.de", "tracker.example", "notdkb.de"])
+    lease = _recycle(cdp)
+    assert lease.released == [True]
+    cleared = [c["params"] for c in cdp.page.commands[:-1]]
+    assert cleared == [
+        {"origin": origin, "storageTypes": "all"}
+        for origin in [
+            "https://banking.dkb.de",
+            "https://www.dkb.de",
+            "https://dkb.de",
+            "https://login.dkb.de",
+        ]
+    ]
+    assert all(c["method"] == "Storage.clearDataForOrigin" for c in cdp.page.commands[:-1])
+    assert cdp.page.commands[-1]["method"] == "Network.clearBrowserCookies"
+    assert cdp.opened == ["about:blank"]
+
+
+def test_recycle_retires_browser_that_cannot_be_cleaned():
+    cdp = _Cdp([])
+
+    def fail(command):
+        raise ConnectionError("gone")
+
+    cdp.page.send = fail
+    assert _recycle(cdp).released == [False]
+
+
+def _leftover_browser(tmp_path, start_time_offset=0):
+    """Starts a process as if an earlier manager had launched it into slot 0."""
+    proc = subprocess.Popen(["sleep", "60"], start_new_session=True)
+    slot_dir = tmp_path / "slot-0"
+    slot_dir.mkdir()
+    state = {
+        "status": browser_pool.STATUS_READY,
+        "pid": proc.pid,
+        "start_time": browser_pool._process_start_time(proc.pid) + start_time_offset,
+    }
+    (slot_dir / "state.json").write_text(json.dumps(state))
+    return proc, slot_dir
+
+
+def _manager(tmp_path):
+    return browser_pool.PoolManager(str(tmp_path), 1, "/usr/bin/chrome")
+
+
+@needs_proc
+def test_leftover_browser_is_stopped(tmp_path):
+    proc, slot_dir = _leftover_browser(tmp_path)
+    _manager(tmp_path)._stop_previous()
+    assert proc.wait(timeout=10) == -signal.SIGTERM
+    assert not (slot_dir / "state.json").exists()
+
+
+@needs_proc
+def test_reused_pid_is_not_killed(tmp_path):
+    proc, slot_dir = _leftover_browser(tmp_path, start_time_offset=-1)
+    try:
+        _manager(tmp_path)._stop_previous()
+        assert proc.poll() is None
+        assert not (slot_dir / "state.json").exists()
+    finally:
+        proc.kill()
+        proc.wait()
+
+
+@needs_proc
+def test_leased_browser_is_kept(tmp_path):
+    proc, slot_dir = _leftover_browser(tmp_path)
+    lock_fd = browser_pool._try_lock(str(slot_dir))
+    try:
+        _manager(tmp_path)._stop_previous()
+        assert proc.poll() is None
+        assert (slot_dir / "state.json").exists()
+    finally:
+        os.close(lock_fd)
+        proc.kill()
+        proc.wait()
+
+
+def test_shutdown_stops_everything_without_state(tmp_path, monkeypatch):
+    manager = _manager(tmp_path)
+    stopped = []
+    procs = {str(tmp_path / f"slot-{i}"): None for i in range(2)}
+    monkeypatch.setattr(manager, "_stop", lambda slot_dir: stopped.append(slot_dir))
+    monkeypatch.setattr(manager, "_stop_previous", lambda: None)
+    monkeypatch.setattr(manager, "maintain", lambda: setattr(manager, "_stopping", True))
+    monkeypatch.setattr(signal, "signal", lambda signum, handler: None)
+    manager._procs = procs
+    manager._xvfb_proc = subprocess.Popen(["sleep", "60"])
+    manager.run(interval=0)
+    # Neither slot has a state.json anymore.
+    assert stopped == list(procs)
+    assert manager._xvfb_proc.returncode == -signal.SIGTERM
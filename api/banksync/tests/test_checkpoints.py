@@ -0,0 +1,154 @@
+import json
+import os
+import time
+from datetime import date, timedelta
+
+import pytest
+
+import checkpoints
+from checkpoints import AccountCheckpoint, CheckpointStore
+
+TOKEN = "0123456789abcdef0123456789abcdef"
+
+
+def _days_ago(days: int) -> str:
+    return (date.today() - timedelta(days=days)).isoformat()
+
+
+def test_since_starts_overlap_before_newest_date():
+    checkpoint = AccountCheckpoint("acc", "2024-05-10")
+    assert checkpoint.since("2024-01-01") == "2024-05-07"
+    # Never earlier than the requested window.
+    assert checkpoint.since("2024-05-09") == "2024-05-09"
+
+
+def test_update_keeps_ids_within_overlap(tmp_path):
+    store = CheckpointStore(str(tmp_path), "dkb", "user")
+    store.update(0, "acc", [("a", "2024-05-01"), ("b", "2024-05-07"), ("c", "2024-05-10")])
+    checkpoint = store.accounts["acc"]
+    assert checkpoint.newest_date == "2024-05-10"
+    assert checkpoint.exported_ids == ["b", "c"]
+
+
+def test_update_never_moves_newest_date_back(tmp_path):
+    store = CheckpointStore(str(tmp_path), "dkb", "user")
+    store.update(0, "acc", [("c", "2024-05-10")])
+    store.update(0, "acc", [("a", "2024-05-01")])
+    assert store.accounts["acc"].newest_date == "2024-05-10"
+
+
+def test_update_without_transactions_keeps_checkpoint(tmp_path):
+    store = CheckpointStore(str(tmp_path), "dkb", "user")
+    store.update(0, "acc", [("c", "2024-05-10")])
+    store.update(0, "acc", [])
+    assert store.accounts["acc"].exported_ids == ["c"]
+
+
+def test_save_and_load(tmp_path):
+    store = CheckpointStore(str(tmp_path), "dkb", "user")
+    store.update(0, "acc", [("c", _days_ago(1))])
+    store.save()
+
+    loaded = CheckpointStore(str(tmp_path), "dkb", "user")
+    assert loaded.get(0, "acc") == store.accounts["acc"]
+    # Other users and banks have their own files.
+    assert CheckpointStore(str(tmp_path), "dkb", "other").get(0, "acc") is None
+    assert CheckpointStore(str(tmp_path), "sparkasse", "user").get(0, "acc") is None
+
+
+def test_save_is_atomic(tmp_path, monkeypatch):
+    store = CheckpointStore(str(tmp_path), "dkb", "user")
+    store.update(0, "acc", [("c", _days_ago(1))])
+    store.save()
+    with open(store.path, encoding="utf-8") as f:
+        before = f.read()
+
+    def failing_dump(data, f):
+        f.write('{"version": 1, "bank": "dkb", "acc')
+        raise OSError("disk full")
+
+    monkeypatch.setattr(checkpoints.json, "dump", failing_dump)
+    store.update(0, "acc", [("d", _days_ago(0))])
+    with pytest.raises(OSError):
+        store.save()
+
+    with open(store.path, encoding="utf-8") as f:
+        assert f.read() == before
+    assert os.listdir(tmp_path) == [os.path.basename(store.path)]
+
+
+def test_get_ignores_reordered_accounts(tmp_path):
+    store = CheckpointStore(str(tmp_path), "dkb", "user")
+    store.update(0, "acc", [("c", _days_ago(1))])
+    assert store.get(0, "other-acc") is None
+
+
+def test_get_ignores_future_checkpoint(tmp_path):
+    store = CheckpointStore(str(tmp_path), "dkb", "user")
+    store.update(0, "acc", [("c", _days_ago(-5))])
+    assert store.get(0, "acc") is None
+
+
+def test_invalid_file_is_ignored(tmp_path):
+    store = CheckpointStore(str(tmp_path), "dkb", "user")
+    with open(store.path, "w", encoding="utf-8") as f:
+        f.write("{not json")
+    assert CheckpointStore(str(tmp_path), "dkb", "user").accounts == {}
+
+
+def test_sync_with_token_only_writes_pending(tmp_path):
+    store = CheckpointStore(str(tmp_path), "dkb", "user", TOKEN)
+    store.update(0, "acc", [("c", _days_ago(1))])
+    store.save()
+
+    assert not os.path.exists(store.path)
+    assert os.path.exists(tmp_path / "pending" / f"{TOKEN}.json")
+    assert CheckpointStore(str(tmp_path), "dkb", "user").get(0, "acc") is None
+
+
+def test_commit_only_advances_confirmed_accounts(tmp_path):
+    store = CheckpointStore(str(tmp_path), "dkb", "user", TOKEN)
+    store.update(0, "acc-0", [("a", _days_ago(1))])
+    store.update(1, "acc-1", [("b", _days_ago(1))])
+    store.save()
+
+    assert checkpoints.commit(str(tmp_path), TOKEN, [1]) == 1
+
+    committed = CheckpointStore(str(tmp_path), "dkb", "user")
+    assert committed.get(0, "acc-0") is None
+    assert committed.get(1, "acc-1").exported_ids == ["b"]
+    # A token can only be committed once.
+    with pytest.raises(FileNotFoundError):
+        checkpoints.commit(str(tmp_path), TOKEN, [0])
+
+
+def test_commit_keeps_newer_checkpoint(tmp_path):
+    older = CheckpointStore(str(tmp_path), "dkb", "user", TOKEN)
+    older.update(0, "acc", [("a", _days_ago(5))])
+    older.save()
+    newer = CheckpointStore(str(tmp_path), "dkb", "user")
+    newer.update(0, "acc", [("b", _days_ago(1))])
+    newer.save()
+
+    checkpoints.commit(str(tmp_path), TOKEN, [0])
+    assert CheckpointStore(str(tmp_path), "dkb", "user").get(0, "acc").exported_ids == ["b"]
+
+
+def test_invalid_token_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        CheckpointStore(str(tmp_path), "dkb", "user", "../../etc/passwd")
+    with pytest.raises(ValueError):
+        checkpoints.commit(str(tmp_path), "../x", [0])
+
+
+def test_stale_pending_files_are_deleted(tmp_path):
+    stale = tmp_path / "pending" / ("f" * 32 + ".json")
+    stale.parent.mkdir()
+    stale.write_text(json.dumps({}))
+    old = time.time() - checkpoints.PENDING_MAX_AGE - 60
+    os.utime(stale, (old, old))
+
+    store = CheckpointStore(str(tmp_path), "dkb", "user", TOKEN)
+    store.update(0, "acc", [])
+    store.save()
+    assert not stale.exists()
@@ -0,0 +1,218 @@
+import argparse
+import gzip
+import struct
+
+import pytest
+
+import dedup
+from dedup import DedupError, Deduplicator, FingerprintIndex
+
+
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    while value >= 0x80:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _len_field(field: int, value: bytes) -> bytes:
+    return _varint(field << 3 | 2) + _varint(len(value)) + value
+
+
+def _varint_field(field: int, value: int) -> bytes:
+    return _varint(field << 3) + _varint(value)
+
+
+def _row(row_id: int, file_format: str, values: dict[str, str]) -> bytes:
+    data = _varint_field(1, row_id) + _len_field(3, file_format.encode())
+    for key, value in values.items():
+        data += _len_field(4, _len_field(1, key.encode()) + _len_field(2, value.encode()))
+    return _len_field(3, data)
+
+
+def _tx_data(account_id: int, row_id: int) -> bytes:
+    return _varint_field(7, account_id) + _varint_field(29, row_id)
+
+
+def _single(account_id: int, row_id: int) -> bytes:
+    return _len_field(2, _len_field(100, _tx_data(account_id, row_id)))
+
+
+def _group(*children: tuple[int, int]) -> bytes:
+    group = b"".join(_len_field(1, _tx_data(*child)) for child in children)
+    return _len_field(2, _len_field(101, group))
+
+
+def _dkb_values(amount: str) -> dict[str, str]:
+    values = dict.fromkeys(dedup.DEDUP_COLUMNS["dkb_custom"], "x")
+    values["amount.value"] = amount
+    return values
+
+
+def _args(**kwargs) -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    dedup.add_arguments(parser)
+    args = parser.parse_args([])
+    vars(args).update(kwargs)
+    return args
+
+
+def test_iter_imported_rows_reads_id_format_and_values():
+    container = _row(7, "dkb_custom", {"a": "1", "b": "ä"})
+    assert list(dedup.iter_imported_rows(container)) == [(7, "dkb_custom", {"a": "1", "b": "ä"})]
+
+
+def test_iter_imported_rows_skips_other_fields_and_wire_types():
+    # last_modified (a message), a fixed64 and a fixed32 field of unknown numbers.
+    container = (
+        _len_field(1, _varint_field(1, 123))
+        + _varint(10 << 3 | 1) + struct.pack("<d", 1.5)
+        + _varint(11 << 3 | 5) + struct.pack("<f", 1.5)
+        + _row(1, "ksk_camt", {})
+    )
+    assert list(dedup.iter_imported_rows(container)) == [(1, "ksk_camt", {})]
+
+
+def test_iter_imported_rows_reads_multibyte_varints():
+    container = _row(300, "", {})
+    assert next(dedup.iter_imported_rows(container))[0] == 300
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        _row(1, "dkb_custom", {"a": "1"})[:-1],  # Value cut off.
+        b"\x1a\x80",  # Length varint cut off.
+    ],
+)
+def test_truncated_data_raises(data):
+    with pytest.raises(DedupError):
+        list(dedup.iter_imported_rows(data))
+
+
+def test_unsupported_wire_type_raises():
+    with pytest.raises(DedupError):
+        list(dedup.iter_imported_rows(_varint(3 << 3 | 3)))
+
+
+def test_row_accounts_reads_single_and_group_transactions():
+    container = _single(1, 10) + _group((2, 11), (3, 10)) + _single(4, 0)
+    assert dedup.row_accounts(container) == {10: {1, 3}, 11: {2}}
+
+
+def test_same_fingerprint_in_two_accounts():
+    # The same transaction was imported into account 1 as row 1 and exists as
+    # row 2 for account 2 as well. A third row only belongs to account 2.
+    values = _dkb_values("-5.00")
+    other = _dkb_values("-7.00")
+    container = (
+        _row(1, "dkb_custom", values)
+        + _row(2, "dkb_custom", values)
+        + _row(3, "dkb_custom", other)
+        + _single(1, 1)
+        + _single(2, 2)
+        + _single(2, 3)
+    )
+    index = FingerprintIndex.build(container)
+    assert index.contains("dkb_custom", values, 1)
+    assert index.contains("dkb_custom", values, 2)
+    # Like the import, rows of other accounts' transactions are not compared.
+    assert not index.contains("dkb_custom", other, 1)
+    assert index.contains("dkb_custom", other, 2)
+    assert not index.contains("dkb_custom", other, 3)
+    assert not index.contains("dkb_custom", other, None)
+
+
+def test_rows_of_other_accounts_are_not_dropped():
+    values = _dkb_values("-5.00")
+    index = FingerprintIndex.build(_row(1, "dkb_custom", values) + _single(1, 1))
+    assert Deduplicator(index, 1).is_known("dkb_custom", values)
+    deduplicator = Deduplicator(index, 2)
+    assert not deduplicator.is_known("dkb_custom", values)
+    assert deduplicator.dropped == 0
+
+
+def test_rows_without_transactions_are_compared_for_every_account():
+    values = _dkb_values("-5.00")
+    # Row 1 is orphaned, the transaction refers to a row that does not exist.
+    index = FingerprintIndex.build(_row(1, "dkb_custom", values) + _single(1, 2))
+    assert index.contains("dkb_custom", values, 1)
+    assert index.contains("dkb_custom", values, 5)
+    assert index.contains("dkb_custom", values, None)
+
+
+def test_row_of_two_accounts_is_compared_for_both():
+    values = _dkb_values("-5.00")
+    index = FingerprintIndex.build(_row(1, "dkb_custom", values) + _group((1, 1), (2, 1)))
+    assert index.contains("dkb_custom", values, 1)
+    assert index.contains("dkb_custom", values, 2)
+    assert not index.contains("dkb_custom", values, 3)
+
+
+def test_compares_regardless_of_existing_row_format():
+    values = _dkb_values("-5.00")
+    index = FingerprintIndex.build(_row(1, "ksk_camt", values))
+    assert index.contains("dkb_custom", values, None)
+    assert not index.contains("unknown", values, None)
+
+
+def test_dump_and_load_roundtrip():
+    values = _dkb_values("-5.00")
+    container = _row(1, "dkb_custom", values) + _row(2, "dkb_custom", _dkb_values("1")) + _single(3, 1)
+    index = FingerprintIndex.build(container)
+    loaded = FingerprintIndex.load(index.dump())
+    assert loaded.fingerprints == index.fingerprints
+
+
+def test_load_rejects_corrupt_index():
+    data = FingerprintIndex.build(_row(1, "dkb_custom", _dkb_values("1"))).dump()
+    with pytest.raises(ValueError):
+        FingerprintIndex.load(data[:-1])
+    with pytest.raises(ValueError):
+        FingerprintIndex.load(data.replace(b'"version": 2', b'"version": 1'))
+
+
+def test_load_container():
+    assert dedup.load_container(gzip.compress(b"abc")) == b"abc"
+    assert dedup.load_container(b"abc") == b"abc"
+    with pytest.raises(DedupError):
+        dedup.load_container(b"FTRACK...")
+
+
+def test_load_index_uses_cache(tmp_path):
+    values = _dkb_values("-5.00")
+    storage = tmp_path / "db.bin"
+    storage.write_bytes(gzip.compress(_row(1, "dkb_custom", values) + _single(1, 1)))
+    cache_dir = tmp_path / "cache"
+    index = dedup.load_index(str(storage), str(cache_dir))
+    assert len(list(cache_dir.glob("*.idx"))) == 1
+    cached = dedup.load_index(str(storage), str(cache_dir))
+    assert cached.fingerprints == index.fingerprints
+    assert cached.contains("dkb_custom", values, 1)
+
+
+def test_from_args_returns_one_deduplicator_per_account(tmp_path):
+    storage = tmp_path / "db.bin"
+    storage.write_bytes(_row(1, "dkb_custom", _dkb_values("1")))
+    args = _args(dedup_storage=str(storage), dedup_account_id=[3, 4])
+    deduplicators = dedup.from_args(args, 2)
+    assert [d.account_id for d in deduplicators] == [3, 4]
+    assert deduplicators[0].index is deduplicators[1].index
+
+    args = _args(dedup_storage=str(storage))
+    assert [d.account_id for d in dedup.from_args(args, 2)] == [None, None]
+
+
+def test_from_args_without_usable_storage(tmp_path):
+    assert dedup.from_args(_args(), 2) == [None, None]
+    storage = tmp_path / "db.bin"
+    storage.write_bytes(b"FTRACK...")
+    assert dedup.from_args(_args(dedup_storage=str(storage)), 1) == [None]
+
+
+def test_check_args():
+    assert dedup.check_args(_args(), 2) is None
+    assert dedup.check_args(_args(dedup_account_id=[1, 2]), 2) is None
+    assert dedup.check_args(_args(dedup_account_id=[1]), 2) is not None
@@ -0,0 +1,60 @@
+import os
+from datetime import date, timedelta
+
+import pytest
+
+import dkb_via_api
+from e2e import ApiClient
+from mock_dkb import MockDkb
+from token_store import TokenStore
+
+USERNAME = "mock-user"
+PASSWORD = "mock-password"
+
+
+@pytest.fixture
+def bank(mock_dkb):
+    return mock_dkb()
+
+
+def _run(bank: MockDkb, tokens: TokenStore | None, output_file: str, monkeypatch) -> bool:
+    """One sync like dkb_via_api.main, with a fresh browser session."""
+    client = ApiClient(bank.base_url)
+    monkeypatch.setattr(dkb_via_api, "browser", client)
+    monkeypatch.setattr(dkb_via_api, "transport", client)
+    token_stored = dkb_via_api.login(USERNAME, PASSWORD, None, tokens)
+    from_date = (date.today() - timedelta(days=30)).isoformat()
+    dkb_via_api.export_accounts([0], [output_file], from_date, batch_size=1)
+    dkb_via_api.logout(revoke=not token_stored)
+    return token_stored
+
+
+def test_stored_token_survives_full_run(bank, tmp_path, monkeypatch):
+    tokens = TokenStore(str(tmp_path / "tokens"))
+    output_file = str(tmp_path / "export.csv")
+
+    assert _run(bank, tokens, output_file, monkeypatch)
+    assert len(bank.mfas) == 1
+    assert tokens.load(USERNAME, PASSWORD) in bank.refresh_tokens
+
+    # The next syncs resume the stored login instead of logging in with MFA.
+    for _ in range(2):
+        assert _run(bank, tokens, output_file, monkeypatch)
+        assert len(bank.mfas) == 1
+        assert tokens.load(USERNAME, PASSWORD) in bank.refresh_tokens
+    assert os.path.getsize(output_file) > 0
+
+
+def test_rejected_token_falls_back_to_full_login(bank, tmp_path, monkeypatch):
+    tokens = TokenStore(str(tmp_path / "tokens"))
+    tokens.save(USERNAME, PASSWORD, {"refresh_token": "unknown"})
+
+    assert _run(bank, tokens, str(tmp_path / "export.csv"), monkeypatch)
+    assert len(bank.mfas) == 1
+    assert tokens.load(USERNAME, PASSWORD) in bank.refresh_tokens
+
+
+def test_session_is_revoked_without_token_store(bank, tmp_path, monkeypatch):
+    assert not _run(bank, None, str(tmp_path / "export.csv"), monkeypatch)
+    assert not bank.sessions
+    assert not bank.refresh_tokens
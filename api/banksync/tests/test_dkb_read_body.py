@@ -0,0 +1,166 @@
+import json
+import shutil
+import subprocess
+
+import pytest
+
+import dkb_captcha
+from dkb_captcha import ApiError, DkbBrowser
+
+# A stand-in for the DKB page: evaluates the in-page JS of dkb_captcha.py in
+# node, with a fetch that answers from `__bodies` (path -> body).
+_PAGE_JS = r"""
+globalThis.window = globalThis;
+globalThis.document = { cookie: '' };
+globalThis.__bodies = {};
+globalThis.fetch = async function (url) {
+  var path = new URL(url).pathname.replace(/^\/api/, '');
+  var body = __bodies[path];
+  return {
+    status: body === undefined ? 404 : 200,
+    headers: { get: function () { return 'application/vnd.api+json'; } },
+    text: async function () { return body === undefined ? '' : body; },
+  };
+};
+var lines = require('readline').createInterface({ input: process.stdin });
+lines.on('line', async function (line) {
+  var value = await (0, eval)(JSON.parse(line));
+  process.stdout.write(JSON.stringify({ value: value === undefined ? null : value }) + '\n');
+});
+"""
+
+NODE = shutil.which("node")
+
+
+class _NodePage:
+    def __init__(self):
+        self.proc = subprocess.Popen(
+            [NODE, "-e", _PAGE_JS],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+            encoding="utf-8",
+        )
+        self.evaluations = 0
+
+    def eval(self, expression: str):
+        self.evaluations += 1
+        self.proc.stdin.write(json.dumps(expression) + "\n")
+        self.proc.stdin.flush()
+        return json.loads(self.proc.stdout.readline())["value"]
+
+    def evaluate(self, script: str, await_promise: bool = False, return_by_value: bool = True):
+        return self.eval(script)
+
+    def close(self):
+        self.proc.stdin.close()
+        self.proc.wait()
+
+
+class _Loop:
+    def run_until_complete(self, result):
+        return result
+
+
+class _Cdp:
+    """The parts of seleniumbase's CDP driver that DkbBrowser.request uses."""
+
+    def __init__(self, page: _NodePage):
+        self.page = page
+        self.loop = _Loop()
+
+    def evaluate(self, expression: str):
+        return self.page.eval(expression)
+
+
+@pytest.fixture
+def page():
+    if NODE is None:
+        pytest.skip("node is not installed")
+    page = _NodePage()
+    yield page
+    page.close()
+
+
+@pytest.fixture
+def browser(page, monkeypatch):
+    # Small chunks, so that the tests need no large bodies.
+    monkeypatch.setattr(dkb_captcha, "BODY_CHUNK_CHARS", 8)
+    browser = DkbBrowser()
+    browser.cdp = _Cdp(page)
+    return browser
+
+
+def _set_bodies(page: _NodePage, bodies: dict[str, str]) -> None:
+    page.eval(f"Object.assign(__bodies, {json.dumps(bodies)}), null")
+    page.evaluations = 0
+
+
+def test_small_body_is_returned_inline(browser, page):
+    _set_bodies(page, {"/a": '{"x": 1}'})
+    response = browser.request("GET", "/a")
+    assert response.json() == {"x": 1}
+    assert page.evaluations == 1
+
+
+def test_large_body_is_reassembled_from_chunks(browser, page):
+    body = json.dumps({"data": [{"id": i, "text": "abc"} for i in range(10)]})
+    _set_bodies(page, {"/a": body})
+    response = browser.request("GET", "/a")
+    assert response.text == body
+    # One evaluation for the fetch, one per chunk.
+    assert page.evaluations == 1 + -(-len(body) // 8)
+    # The body is forgotten in the page after its last chunk.
+    assert page.eval("Object.keys(window.__dkb_bodies)") == ["next"]
+
+
+def test_chunks_never_split_surrogate_pairs(browser, page):
+    # Every other character is outside the BMP, so naive chunk boundaries of
+    # 8 UTF-16 code units would fall within a surrogate pair.
+    body = '"' + "a😀" * 20 + '"'
+    _set_bodies(page, {"/a": body})
+    assert browser.request("GET", "/a").text == body
+
+
+def test_request_many_reads_each_body(browser, page):
+    bodies = {f"/{i}": json.dumps({"i": i, "pad": "x" * (i * 5)}) for i in range(4)}
+    _set_bodies(page, bodies)
+    calls = [{"method": "GET", "path": path} for path in bodies] + [
+        {"method": "GET", "path": "/missing"}
+    ]
+    responses = browser.request_many(calls)
+    assert [r.text for r in responses[:4]] == list(bodies.values())
+    assert isinstance(responses[4], ApiError)
+    assert page.eval("Object.keys(window.__dkb_bodies)") == ["next"]
+
+
+def test_read_body_without_body_id_is_unchanged():
+    result = {"status": 200, "body": "x", "ct": ""}
+    assert DkbBrowser()._read_body(result, "/a") is result
+
+
+def test_missing_chunk_raises():
+    class _GoneCdp:
+        def evaluate(self, expression):
+            return None
+
+    browser = DkbBrowser()
+    browser.cdp = _GoneCdp()
+    with pytest.raises(ApiError):
+        browser._read_body({"status": 200, "body": None, "bodyId": 1, "chunks": 2}, "/a")
+
+
+def test_read_body_joins_chunks_in_order():
+    class _ChunkCdp:
+        def __init__(self):
+            self.expressions = []
+
+        def evaluate(self, expression):
+            self.expressions.append(expression)
+            return ["ab", "cd", "e"][len(self.expressions) - 1]
+
+    browser = DkbBrowser()
+    browser.cdp = _ChunkCdp()
+    result = browser._read_body({"status": 200, "body": None, "bodyId": 7, "chunks": 3}, "/a")
+    assert result["body"] == "abcde"
+    assert all("s[7]" in e for e in browser.cdp.expressions)
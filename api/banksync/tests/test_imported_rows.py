@@ -0,0 +1,93 @@
+import json
+
+import pytest
+
+import dedup
+import imported_rows
+from imported_rows import RowWriter, encode_imported_row
+
+
+@pytest.mark.parametrize(
+    "value, encoded",
+    [(0, b"\x00"), (1, b"\x01"), (127, b"\x7f"), (128, b"\x80\x01"), (300, b"\xac\x02"), (2**21, b"\x80\x80\x80\x01")],
+)
+def test_varint(value, encoded):
+    assert imported_rows._varint(value) == encoded
+
+
+def test_encode_imported_row_golden_bytes():
+    # Field 3 (file_format) and field 4 (a map entry with key 1 and value 2),
+    # all length-delimited (wire type 2).
+    assert encode_imported_row("ksk_camt", {"a": "b"}) == (
+        b"\x1a\x08ksk_camt" + b"\x22\x06" + b"\x0a\x01a" + b"\x12\x01b"
+    )
+
+
+def test_encode_imported_row_empty_values():
+    assert encode_imported_row("dkb_custom", {}) == b"\x1a\x0adkb_custom"
+    assert encode_imported_row("", {"k": ""}) == b"\x1a\x00" + b"\x22\x05\x0a\x01k\x12\x00"
+
+
+def test_encode_imported_row_long_and_non_ascii_values():
+    values = {"Verwendungszweck": "Müller " * 40, "Betrag": "-1234.50"}
+    message = encode_imported_row("ksk_camt", values)
+    # Lengths above 127 bytes take a two-byte varint.
+    assert len(("Müller " * 40).encode("utf-8")) > 127
+    # Decoded by the independent reader of dedup.py, with the row id field added.
+    rows = list(dedup.iter_imported_rows(b"\x1a" + imported_rows._varint(len(message)) + message))
+    assert rows == [(0, "ksk_camt", values)]
+
+
+def _split_delimited(data: bytes) -> list[bytes]:
+    messages = []
+    pos = 0
+    while pos < len(data):
+        size, pos = dedup._read_varint(data, pos)
+        messages.append(data[pos : pos + size])
+        pos += size
+    assert pos == len(data)
+    return messages
+
+
+def test_row_writer_protobuf_is_length_delimited():
+    chunks = []
+    writer = RowWriter(chunks.append, "protobuf", "dkb_custom")
+    rows = [{"amount.value": "-5.00"}, {"description": "x" * 300}]
+    for row in rows:
+        writer.write(row)
+    assert writer.rows_written == 2
+    messages = _split_delimited(b"".join(chunks))
+    assert messages == [encode_imported_row("dkb_custom", row) for row in rows]
+
+
+def test_row_writer_ndjson_is_ascii():
+    chunks = []
+    writer = RowWriter(chunks.append, "ndjson", "ksk_camt")
+    writer.write({"Beguenstigter/Zahlungspflichtiger": "Bäckerei"})
+    line = b"".join(chunks)
+    assert line.endswith(b"\n") and line.isascii()
+    assert json.loads(line) == {
+        "file_format": "ksk_camt",
+        "values": {"Beguenstigter/Zahlungspflichtiger": "Bäckerei"},
+    }
+
+
+def test_row_writer_rejects_csv():
+    with pytest.raises(ValueError):
+        RowWriter(lambda data: None, "csv", "ksk_camt")
+
+
+
+def test_sparkasse_rows_keep_the_raw_values_of_the_csv():
+    import sparkasse
+
+    chunks = []
+    writer = RowWriter(chunks.append, "ndjson", imported_rows.FILE_FORMAT_SPARKASSE)
+    csv_text = 'Buchungstag;Valutadatum;Betrag\r\n"01.05.24";"02.05.24";"-1.234,50"\r\n'
+    row_count, _ = sparkasse.transcode_export([csv_text], None, None, None, writer)
+    assert row_count == 1
+    # As the app's ksk_camt mapping and its stored rows expect them.
+    assert json.loads(b"".join(chunks)) == {
+        "file_format": "ksk_camt",
+        "values": {"Buchungstag": "01.05.24", "Valutadatum": "02.05.24", "Betrag": "-1.234,50"},
+    }
@@ -0,0 +1,33 @@
+import os
+
+import pytest
+
+import metrics
+from metrics import RunMetrics
+
+needs_proc = pytest.mark.skipif(not os.path.exists("/proc/self/statm"), reason="no /proc")
+
+
+@needs_proc
+def test_span_records_current_rss_at_start_and_end():
+    run = RunMetrics()
+    with run.span("grow"):
+        block = bytearray(64 * 1024 * 1024)
+        # Touch every page, so that it is resident.
+        for i in range(0, len(block), 4096):
+            block[i] = 1
+    with run.span("shrink"):
+        del block
+    grow, shrink = run.spans
+    assert grow["rss_end_kb"] - grow["rss_start_kb"] > 32 * 1024
+    # Unlike getrusage()'s peak, the RSS goes down again.
+    assert shrink["rss_end_kb"] < shrink["rss_start_kb"]
+
+
+def test_span_without_proc_has_no_rss(monkeypatch):
+    monkeypatch.setattr(metrics, "_rss_kb", lambda: None)
+    run = RunMetrics()
+    with run.span("a"):
+        pass
+    assert "rss_start_kb" not in run.spans[0]
+    assert "rss_end_kb" not in run.spans[0]
@@ -0,0 +1,141 @@
+import socket
+import threading
+import time
+
+import pytest
+
+import orchestrator
+from orchestrator import Limits, Settings
+
+
+@pytest.fixture(autouse=True)
+def credentials(monkeypatch):
+    monkeypatch.setenv("TEST_LOGIN_NAME", "user")
+    monkeypatch.setenv("TEST_PASSWORD", "secret")
+
+
+def _job(job_id: str, bank_url: str = "https://a.example", **fields) -> dict:
+    return {
+        "id": job_id,
+        "bankType": "sparkasse",
+        "bankUrl": bank_url,
+        "credentials": {"env": "TEST"},
+        "accountIndices": [0],
+        "maxTransactionAge": 30,
+        **fields,
+    }
+
+
+class _Recorder:
+    """Stand-in for execute() that records which jobs run at the same time."""
+
+    def __init__(self, duration: float = 0.05):
+        self.duration = duration
+        self.lock = threading.Lock()
+        self.running: set[str] = set()
+        self.max_running = 0
+        self.threads: set[int] = set()
+        self.started: list[str] = []
+
+    def __call__(self, job, settings):
+        with self.lock:
+            self.running.add(job.id)
+            self.max_running = max(self.max_running, len(self.running))
+            self.threads.add(threading.get_ident())
+            self.started.append(job.id)
+        time.sleep(self.duration)
+        with self.lock:
+            self.running.discard(job.id)
+        return {"success": True, "results": []}
+
+
+def test_threads_are_capped_at_the_total_limit(monkeypatch):
+    recorder = _Recorder()
+    monkeypatch.setattr(orchestrator, "execute", recorder)
+    jobs = [_job(f"job-{i}", f"https://bank{i}.example") for i in range(12)]
+    limits = Limits({"sparkasse": 3, "dkb": 1}, per_host=2)
+    results = orchestrator.run_jobs(jobs, Settings(), limits)
+    assert [r["id"] for r in results] == [f"job-{i}" for i in range(12)]
+    assert all(r["success"] for r in results)
+    assert recorder.max_running == 3
+    assert len(recorder.threads) <= limits.total == 4
+
+
+def test_job_held_back_by_its_host_does_not_block_other_hosts(monkeypatch):
+    recorder = _Recorder()
+    monkeypatch.setattr(orchestrator, "execute", recorder)
+    jobs = [_job("a-1"), _job("a-2"), _job("a-3"), _job("b-1", "https://b.example")]
+    results = orchestrator.run_jobs(jobs, Settings(), Limits({"sparkasse": 2, "dkb": 1}, per_host=1))
+    assert [r["id"] for r in results] == ["a-1", "a-2", "a-3", "b-1"]
+    assert set(recorder.started[:2]) == {"a-1", "b-1"}
+
+
+def test_invalid_jobs_keep_their_place(monkeypatch):
+    monkeypatch.setattr(orchestrator, "execute", _Recorder(0))
+    jobs = [_job("ok-1"), {"id": "bad", "bankType": "unknown"}, "not a job", _job("ok-2")]
+    results = orchestrator.run_jobs(jobs, Settings(), Limits({"sparkasse": 1, "dkb": 1}, per_host=1))
+    assert [r["id"] for r in results] == ["ok-1", "bad", "2", "ok-2"]
+    assert results[1]["error"] == "Unsupported bank type!"
+    assert "success" in results[3]
+
+
+def test_worker_job_times_out(tmp_path, monkeypatch):
+    socket_path = str(tmp_path / "worker.sock")
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(socket_path)
+    # Accepts the connection, but never answers.
+    listener.listen(1)
+
+    def no_subprocess(*args, **kwargs):
+        raise AssertionError("A timed out job must not be run again.")
+
+    monkeypatch.setattr(orchestrator.subprocess, "run", no_subprocess)
+    settings = Settings(worker_socket=socket_path, job_timeout=0.2)
+    job = orchestrator.parse_job(_job("slow"), 0)
+    with listener:
+        start = time.monotonic()
+        response = orchestrator.execute(job, settings)
+    assert time.monotonic() - start < 5
+    assert response == {"error": orchestrator.UNKNOWN_ERROR, "errorDetails": "The sync timed out."}
+
+
+def test_worker_dying_mid_job_is_a_job_error(tmp_path, monkeypatch):
+    socket_path = str(tmp_path / "worker.sock")
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(socket_path)
+    listener.listen(1)
+
+    def hang_up():
+        conn, _ = listener.accept()
+        conn.recv(1024)
+        conn.close()
+
+    def no_subprocess(*args, **kwargs):
+        raise AssertionError("A job that reached the worker must not be run again.")
+
+    monkeypatch.setattr(orchestrator.subprocess, "run", no_subprocess)
+    thread = threading.Thread(target=hang_up)
+    thread.start()
+    with listener:
+        response = orchestrator.execute(orchestrator.parse_job(_job("dies"), 0), Settings(worker_socket=socket_path))
+    thread.join()
+    assert response["error"] == orchestrator.UNKNOWN_ERROR
+    assert "worker failed" in response["errorDetails"]
+
+
+def test_unreachable_worker_falls_back_to_subprocess(tmp_path, monkeypatch):
+    calls = []
+
+    class _Proc:
+        returncode = 0
+        stdout = b""
+        stderr = b""
+
+    def fake_run(command, **kwargs):
+        calls.append(kwargs["timeout"])
+        return _Proc()
+
+    monkeypatch.setattr(orchestrator.subprocess, "run", fake_run)
+    settings = Settings(worker_socket=str(tmp_path / "missing.sock"), job_timeout=7)
+    assert orchestrator.run_script("sparkasse", [], "", settings) == (0, "", "")
+    assert calls == [7]
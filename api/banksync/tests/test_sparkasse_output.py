@@ -0,0 +1,63 @@
+import pytest
+
+import sparkasse
+
+
+class _BrokenDownload(Exception):
+    pass
+
+
+def _chunks(fail: bool):
+    yield "Buchungstag;Betrag\r\n"
+    yield '"01.05.2024";"-1,00"\r\n'
+    if fail:
+        raise _BrokenDownload()
+    yield '"02.05.2024";"Müller"\r\n'
+
+
+def _export(output_file, fail=False):
+    with sparkasse.open_output(output_file) as writer:
+        sparkasse.transcode_export(_chunks(fail), writer, None, None)
+
+
+def test_file_is_written_completely(tmp_path):
+    output_file = tmp_path / "export.csv"
+    _export(str(output_file))
+    assert output_file.read_bytes().decode("utf-8") == "".join(_chunks(False))
+    assert [p.name for p in tmp_path.iterdir()] == ["export.csv"]
+
+
+def test_failed_download_leaves_no_file(tmp_path):
+    output_file = tmp_path / "export.csv"
+    with pytest.raises(_BrokenDownload):
+        _export(str(output_file), fail=True)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_failed_download_keeps_previous_file(tmp_path):
+    output_file = tmp_path / "export.csv"
+    output_file.write_bytes(b"previous")
+    with pytest.raises(_BrokenDownload):
+        _export(str(output_file), fail=True)
+    assert output_file.read_bytes() == b"previous"
+    assert [p.name for p in tmp_path.iterdir()] == ["export.csv"]
+
+
+def test_stdout_is_written_completely(capsysbinary):
+    _export(None)
+    assert capsysbinary.readouterr().out.decode("utf-8") == "".join(_chunks(False))
+
+
+def test_stdout_is_streamed(capsysbinary):
+    seen = []
+
+    def chunks():
+        yield "Buchungstag;Betrag\r\n"
+        yield '"01.05.2024";"-1,00"\r\n'
+        # The rows so far were written before the download went on.
+        seen.append(capsysbinary.readouterr().out)
+        yield '"02.05.2024";"-2,00"\r\n'
+
+    with sparkasse.open_output(None) as writer:
+        sparkasse.transcode_export(chunks(), writer, None, None)
+    assert seen[0].startswith(b"Buchungstag;Betrag\r\n")
@@ -0,0 +1,16 @@
+import sparkasse_pages
+
+
+def test_account_key_is_the_iban():
+    name = "Girokonto DE12 3456 7890 1234 5678 90"
+    assert sparkasse_pages.account_key(name, "https://s.de/a?n=1") == "DE12345678901234567890"
+
+
+def test_accounts_with_the_same_name_get_different_keys():
+    first = sparkasse_pages.account_key("Girokonto DE12345678901234567890", "https://s.de/a?n=1")
+    second = sparkasse_pages.account_key("Girokonto DE98765432109876543210", "https://s.de/a?n=2")
+    assert first != second
+
+
+def test_account_key_falls_back_to_the_link():
+    assert sparkasse_pages.account_key("Kreditkarte", "https://s.de/a?n=3") == "https://s.de/a?n=3"
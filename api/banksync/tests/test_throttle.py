@@ -0,0 +1,103 @@
+import random
+
+import pytest
+
+from throttle import Throttle, ThrottlePolicy
+
+URL = "https://bank.example/login"
+
+
+class _Clock:
+    """Fake monotonic clock; sleeping advances it."""
+
+    def __init__(self):
+        self.now = 100.0
+        self.slept = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+def _throttle(clock: _Clock, **policy) -> Throttle:
+    policy = {"min_spacing": 0.0, "jitter": 0.0, **policy}
+    return Throttle(ThrottlePolicy(**policy), clock=clock, sleep=clock.sleep, rng=random.Random(0))
+
+
+def test_burst_is_free_then_rate_limited():
+    clock = _Clock()
+    throttle = _throttle(clock, rate=2.0, burst=3)
+    assert [throttle.wait(URL) for _ in range(3)] == [0.0, 0.0, 0.0]
+    # The bucket is empty: one step per 1/rate seconds.
+    assert throttle.wait(URL) == pytest.approx(0.5)
+    assert throttle.wait(URL) == pytest.approx(0.5)
+    assert clock.now == pytest.approx(101.0)
+
+
+def test_bucket_refills_up_to_burst():
+    clock = _Clock()
+    throttle = _throttle(clock, rate=1.0, burst=2)
+    throttle.wait(URL)
+    throttle.wait(URL)
+    clock.now += 60
+    # Idle time does not accumulate more than `burst` tokens.
+    assert [throttle.wait(URL) for _ in range(2)] == [0.0, 0.0]
+    assert throttle.wait(URL) == pytest.approx(1.0)
+
+
+def test_partial_refill_shortens_the_wait():
+    clock = _Clock()
+    throttle = _throttle(clock, rate=1.0, burst=1)
+    throttle.wait(URL)
+    clock.now += 0.75
+    assert throttle.delay(URL) == pytest.approx(0.25)
+
+
+def test_zero_rate_disables_the_bucket():
+    clock = _Clock()
+    throttle = _throttle(clock, rate=0.0, burst=1)
+    assert [throttle.wait(URL) for _ in range(5)] == [0.0] * 5
+    assert clock.slept == []
+
+
+def test_spacing_counts_from_last_response():
+    clock = _Clock()
+    throttle = _throttle(clock, min_spacing=1.0, rate=100.0, burst=10)
+    throttle.wait(URL)
+    throttle.record_response(URL)
+    # Local work after the response counts towards the spacing.
+    clock.now += 0.4
+    assert throttle.wait(URL) == pytest.approx(0.6)
+    throttle.record_response(URL)
+    clock.now += 2.0
+    assert throttle.wait(URL) == 0.0
+
+
+def test_jitter_adds_up_to_its_maximum():
+    clock = _Clock()
+    throttle = _throttle(clock, min_spacing=1.0, jitter=0.5, rate=100.0, burst=10)
+    delays = []
+    for _ in range(50):
+        throttle.record_response(URL)
+        delays.append(throttle.delay(URL))
+    assert all(1.0 <= d <= 1.5 for d in delays)
+    assert len(set(delays)) > 1
+
+
+def test_larger_of_both_limits_applies():
+    clock = _Clock()
+    throttle = _throttle(clock, min_spacing=0.2, rate=1.0, burst=1)
+    throttle.wait(URL)
+    throttle.record_response(URL)
+    assert throttle.delay(URL) == pytest.approx(1.0)
+
+
+def test_hosts_are_throttled_separately():
+    clock = _Clock()
+    throttle = _throttle(clock, rate=1.0, burst=1)
+    throttle.wait(URL)
+    assert throttle.delay("https://bank.example/other") > 0
+    assert throttle.wait("https://other.example/") == 0.0
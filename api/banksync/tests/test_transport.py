@@ -0,0 +1,130 @@
+import pytest
+
+import dkb_via_api
+from dkb_captcha import ApiError, _Response
+from e2e import ApiClient
+from transport import FallbackTransport, HttpTransport, WafRejected, select_transport
+
+
+class _FakeTransport:
+    """Answers calls with the given function and records them."""
+
+    def __init__(self, name: str, answer=None):
+        self.name = name
+        self.answer = answer or (lambda path: _Response(200, f'"{name}{path}"', "application/json"))
+        self.calls = []
+
+    def request(self, method, path, data=None, json_body=None):
+        self.calls.append(path)
+        result = self.answer(path)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def request_many(self, calls, max_concurrency=None):
+        results = []
+        for call in calls:
+            self.calls.append(call["path"])
+            results.append(self.answer(call["path"]))
+        return results
+
+
+def _reject(paths):
+    def answer(path):
+        if path in paths:
+            return WafRejected(f"rejected {path}")
+        return _Response(200, f'"primary{path}"', "application/json")
+
+    return answer
+
+
+def test_request_uses_primary_until_rejected():
+    primary = _FakeTransport("primary", _reject({"/b"}))
+    fallback = _FakeTransport("fallback")
+    transport = FallbackTransport(primary, fallback)
+    assert transport.request("GET", "/a").json() == "primary/a"
+    # The rejected call is repeated on the fallback ...
+    assert transport.request("GET", "/b").json() == "fallback/b"
+    # ... which is used for good.
+    assert transport.request("GET", "/a").json() == "fallback/a"
+    assert primary.calls == ["/a", "/b"]
+    assert fallback.calls == ["/b", "/a"]
+
+
+def test_other_errors_do_not_fall_back():
+    primary = _FakeTransport("primary", lambda path: ApiError("404"))
+    fallback = _FakeTransport("fallback")
+    transport = FallbackTransport(primary, fallback)
+    with pytest.raises(ApiError):
+        transport.request("GET", "/a")
+    assert transport.primary is primary
+    assert fallback.calls == []
+
+
+def test_request_many_retries_only_rejected_calls_in_order():
+    primary = _FakeTransport("primary", _reject({"/2", "/4"}))
+    fallback = _FakeTransport("fallback")
+    transport = FallbackTransport(primary, fallback)
+    calls = [{"method": "GET", "path": f"/{i}"} for i in range(5)]
+    responses = transport.request_many(calls)
+    assert [r.json() for r in responses] == [
+        "primary/0", "primary/1", "fallback/2", "primary/3", "fallback/4"
+    ]
+    assert fallback.calls == ["/2", "/4"]
+
+    transport.request_many(calls[:2])
+    assert primary.calls == [f"/{i}" for i in range(5)]
+    assert fallback.calls == ["/2", "/4", "/0", "/1"]
+
+
+def test_request_many_keeps_other_errors():
+    error = ApiError("500")
+    primary = _FakeTransport("primary", lambda path: error)
+    fallback = _FakeTransport("fallback")
+    transport = FallbackTransport(primary, fallback)
+    assert transport.request_many([{"method": "GET", "path": "/a"}]) == [error]
+    assert transport.primary is primary
+
+
+def _logged_in_client(bank, monkeypatch) -> ApiClient:
+    client = ApiClient(bank.base_url)
+    monkeypatch.setattr(dkb_via_api, "browser", client)
+    monkeypatch.setattr(dkb_via_api, "transport", client)
+    dkb_via_api.login("mock-user", "mock-password")
+    return client
+
+
+def test_falls_back_when_the_waf_starts_rejecting(mock_dkb, monkeypatch):
+    # The WAF lets the probe through, then rejects the direct HTTP client.
+    bank = mock_dkb(accounts=2, waf_after=1)
+    client = _logged_in_client(bank, monkeypatch)
+    transport = select_transport(client, base_url=bank.base_url)
+    assert isinstance(transport, FallbackTransport)
+    assert isinstance(transport.primary, HttpTransport)
+
+    expected = client.request("GET", "/accounts/accounts").json()
+    assert transport.request("GET", "/accounts/accounts").json() == expected
+    assert transport.primary is None
+    calls = [{"method": "GET", "path": f"/accounts/accounts/{a}/transactions"} for a in bank.accounts]
+    assert [r.json() for r in transport.request_many(calls)] == [
+        r.json() for r in client.request_many(calls)
+    ]
+
+
+def test_stays_with_browser_if_probe_is_rejected(mock_dkb, monkeypatch):
+    bank = mock_dkb(waf_after=0)
+    client = _logged_in_client(bank, monkeypatch)
+    assert select_transport(client, base_url=bank.base_url) is client
+
+
+def test_http_transport_continues_browser_session(mock_dkb, monkeypatch):
+    bank = mock_dkb()
+    client = _logged_in_client(bank, monkeypatch)
+    cookies, user_agent = client.session_state()
+    http = HttpTransport(cookies, user_agent, bank.base_url)
+    assert http.request("GET", "/accounts/accounts").json() == client.request(
+        "GET", "/accounts/accounts"
+    ).json()
+    with pytest.raises(ApiError) as e:
+        http.request("GET", "/unknown")
+    assert not isinstance(e.value, WafRejected)
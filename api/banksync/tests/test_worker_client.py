@@ -0,0 +1,228 @@
+import base64
+import io
+import json
+import os
+import socket
+import struct
+import sys
+import threading
+import types
+
+import pytest
+
+import worker
+import worker_client
+from worker_client import ProtocolError, WorkerUnavailable, recv_message, send_message
+
+
+class _TrickleSocket:
+    """Returns the given data at most `step` bytes per recv()."""
+
+    def __init__(self, data: bytes, step: int = 1):
+        self.data = data
+        self.step = step
+        self.pos = 0
+
+    def recv(self, size: int) -> bytes:
+        chunk = self.data[self.pos : self.pos + min(size, self.step)]
+        self.pos += len(chunk)
+        return chunk
+
+
+def _frame(payload: bytes) -> bytes:
+    return struct.pack(">I", len(payload)) + payload
+
+
+def test_message_roundtrip():
+    a, b = socket.socketpair()
+    with a, b:
+        message = {"script": "sparkasse", "args": ["--from", "01.01.2024"], "stdin": "ü\n€"}
+        send_message(a, message)
+        assert recv_message(b) == message
+
+
+def test_frame_is_length_prefixed_utf8_json():
+    a, b = socket.socketpair()
+    with a, b:
+        send_message(a, {"x": "ä"})
+        payload = json.dumps({"x": "ä"}).encode("utf-8")
+        assert b.recv(1024) == _frame(payload)
+
+
+def test_consecutive_messages_on_one_connection():
+    a, b = socket.socketpair()
+    with a, b:
+        send_message(a, {"n": 1})
+        send_message(a, {"n": 2})
+        assert recv_message(b) == {"n": 1}
+        assert recv_message(b) == {"n": 2}
+
+
+def test_reassembles_message_from_partial_reads():
+    data = _frame(json.dumps({"stdout": "x" * 1000}).encode("utf-8"))
+    assert recv_message(_TrickleSocket(data, step=7)) == {"stdout": "x" * 1000}
+
+
+@pytest.mark.parametrize("cut", [0, 2, 4, 10])
+def test_truncated_message_raises(cut):
+    data = _frame(b'{"exit_code": 0}')
+    with pytest.raises(ProtocolError):
+        recv_message(_TrickleSocket(data[:cut], step=3))
+
+
+def test_oversized_message_is_rejected_before_reading_it():
+    header = struct.pack(">I", worker_client.MAX_MESSAGE_SIZE + 1)
+    sock = _TrickleSocket(header, step=4)
+    with pytest.raises(ProtocolError, match="too large"):
+        recv_message(sock)
+    assert sock.pos == 4
+
+
+def test_non_object_message_is_rejected():
+    with pytest.raises(ProtocolError):
+        recv_message(_TrickleSocket(_frame(b"[1, 2]"), step=100))
+
+
+def _serve_once(socket_path: str, handler) -> threading.Thread:
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(socket_path)
+    listener.listen(1)
+
+    def serve():
+        with listener:
+            conn, _ = listener.accept()
+            handler(conn)
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    return thread
+
+
+def test_run_job_roundtrip(tmp_path):
+    socket_path = str(tmp_path / "worker.sock")
+    requests = []
+    # Bytes that are not valid UTF-8 must survive the round trip.
+    stdout = b"\xff\xfe csv \r\n"
+
+    def handler(conn):
+        with conn:
+            requests.append(recv_message(conn))
+            send_message(
+                conn,
+                {"exit_code": 2, "stdout": base64.b64encode(stdout).decode("ascii"), "stderr": "err"},
+            )
+
+    thread = _serve_once(socket_path, handler)
+    result = worker_client.run_job(socket_path, "sparkasse", ["-v"], "user\npass\n0\n")
+    thread.join()
+    assert result == (2, stdout, "err")
+    assert requests == [{"script": "sparkasse", "args": ["-v"], "stdin": "user\npass\n0\n"}]
+
+
+def test_run_job_without_worker_raises_worker_unavailable(tmp_path):
+    with pytest.raises(WorkerUnavailable):
+        worker_client.run_job(str(tmp_path / "missing.sock"), "sparkasse", [], "")
+
+
+def _hang_up(conn):
+    # The worker dies in the middle of the job.
+    with conn:
+        recv_message(conn)
+
+
+def test_run_job_failing_after_connect_is_not_worker_unavailable(tmp_path):
+    socket_path = str(tmp_path / "worker.sock")
+    thread = _serve_once(socket_path, _hang_up)
+    with pytest.raises(ProtocolError):
+        worker_client.run_job(socket_path, "sparkasse", [], "")
+    thread.join()
+
+
+@pytest.fixture
+def cli(monkeypatch, tmp_path):
+    socket_path = str(tmp_path / "worker.sock")
+    monkeypatch.setenv(worker_client.SOCKET_ENV_VAR, socket_path)
+    monkeypatch.setenv("FT_CHROME_BINARY", "/opt/chrome")
+    monkeypatch.setattr(sys, "argv", ["sparkasse.py", "-o", "out.csv"])
+    monkeypatch.setattr(sys, "stdin", io.StringIO("user\npass\n0\n"))
+    monkeypatch.chdir(tmp_path)
+    return socket_path
+
+
+def test_forward_cli_sends_cwd_and_environment(cli, tmp_path, capsysbinary):
+    requests = []
+
+    def handler(conn):
+        with conn:
+            requests.append(recv_message(conn))
+            send_message(conn, {"exit_code": 0, "stdout": "b2s=", "stderr": ""})
+
+    thread = _serve_once(cli, handler)
+    assert worker_client.forward_cli("sparkasse") == 0
+    thread.join()
+    assert capsysbinary.readouterr().out == b"ok"
+    (request,) = requests
+    assert request["args"] == ["-o", "out.csv"]
+    assert request["cwd"] == str(tmp_path)
+    assert request["env"]["FT_CHROME_BINARY"] == "/opt/chrome"
+
+
+def test_forward_cli_falls_back_if_worker_is_unavailable(cli):
+    assert worker_client.forward_cli("sparkasse") is None
+    # Stdin is handed back to the local run.
+    assert sys.stdin.read() == "user\npass\n0\n"
+
+
+def test_forward_cli_does_not_fall_back_after_the_job_started(cli, capsys):
+    thread = _serve_once(cli, _hang_up)
+    assert worker_client.forward_cli("sparkasse") == 1
+    thread.join()
+    assert "failed during the job" in capsys.readouterr().err
+
+
+def test_worker_rejects_unknown_script():
+    a, b = socket.socketpair()
+    with a:
+        send_message(a, {"script": "../evil", "args": [], "stdin": ""})
+        worker.handle_connection(b)
+        response = recv_message(a)
+    assert response["exit_code"] == 2
+    assert "Unknown script" in response["stderr"]
+
+
+def test_worker_runs_job_in_the_client_cwd_and_environment(tmp_path, monkeypatch):
+    probe = types.ModuleType("probe")
+    probe.main = lambda: print(
+        json.dumps(
+            {
+                "cwd": os.getcwd(),
+                "x": os.environ.get("X"),
+                "home": os.environ.get("HOME"),
+                "socket": os.environ.get(worker_client.SOCKET_ENV_VAR),
+            }
+        )
+    )
+    monkeypatch.setitem(sys.modules, "probe", probe)
+    monkeypatch.setitem(worker.SCRIPTS, "probe", lambda result: 0)
+    env = {"X": "1", worker_client.SOCKET_ENV_VAR: "/run/worker.sock"}
+
+    # run_script changes process-wide state, so run it in a child like the worker.
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            response = worker.run_script("probe", [], "", str(tmp_path), env)
+            os.write(write_fd, json.dumps(response).encode("utf-8"))
+        finally:
+            os._exit(0)
+    os.close(write_fd)
+    with os.fdopen(read_fd, "rb") as f:
+        response = json.loads(f.read())
+    os.waitpid(pid, 0)
+    assert response["exit_code"] == 0
+    assert json.loads(base64.b64decode(response["stdout"])) == {
+        "cwd": str(tmp_path),
+        "x": "1",
+        "home": None,
+        "socket": None,
+    }
@@ -0,0 +1,101 @@
+"""
+Throttling of requests to a bank's website, so that scraping does not look
+like (or turn into) a flood of requests.
+
+A ThrottlePolicy combines two limits per bank host:
+
+- a minimum spacing (plus random jitter) between the last response from the
+  host and the next request. Since it is measured from the last response,
+  local work in between (parsing HTML, filling in forms) already counts
+  towards it and only the remainder is slept.
+- a token bucket: bursts of up to `burst` steps, refilled at `rate` per
+  second, which caps the sustained request rate of long sessions (e.g. many
+  accounts).
+"""
+from __future__ import annotations
+
+import random
+import time
+from dataclasses import dataclass
+from typing import Callable
+from urllib.parse import urlsplit
+
+import metrics
+
+
+@dataclass(frozen=True)
+class ThrottlePolicy:
+    # Seconds between a response and the next request, at least.
+    min_spacing: float = 0.3
+    # Random extra spacing of up to this many seconds.
+    jitter: float = 0.7
+    # Sustained number of steps per second, and how many may happen at once.
+    rate: float = 1.0
+    burst: int = 3
+
+
+@dataclass
+class _HostState:
+    tokens: float
+    refilled_at: float
+    last_response_at: float | None = None
+
+
+class Throttle:
+    """Applies a ThrottlePolicy, keeping separate state per host."""
+
+    def __init__(
+        self,
+        policy: ThrottlePolicy,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+        rng: random.Random | None = None,
+    ):
+        self.policy = policy
+        self._clock = clock
+        self._sleep = sleep
+        self._rng = rng or random.Random()
+        self._hosts: dict[str, _HostState] = {}
+
+    def _host(self, url: str) -> _HostState:
+        host = urlsplit(url).netloc
+        state = self._hosts.get(host)
+        if state is None:
+            state = _HostState(tokens=float(self.policy.burst), refilled_at=self._clock())
+            self._hosts[host] = state
+        return state
+
+    def _refill(self, state: _HostState, now: float) -> None:
+        elapsed = now - state.refilled_at
+        state.tokens = min(float(self.policy.burst), state.tokens + elapsed * self.policy.rate)
+        state.refilled_at = now
+
+    def delay(self, url: str) -> float:
+        """Seconds to wait before the next step against the host of url."""
+        state = self._host(url)
+        now = self._clock()
+        self._refill(state, now)
+        delay = 0.0
+        if state.tokens < 1 and self.policy.rate > 0:
+            delay = (1 - state.tokens) / self.policy.rate
+        if state.last_response_at is not None:
+            spacing = self.policy.min_spacing + self._rng.uniform(0, self.policy.jitter)
+            delay = max(delay, state.last_response_at + spacing - now)
+        return max(delay, 0.0)
+
+    def wait(self, url: str) -> float:
+        """Sleeps until the next step against the host of url is allowed.
+
+        Returns the seconds slept."""
+        delay = self.delay(url)
+        if delay > 0:
+            with metrics.span("throttle"):
+                self._sleep(delay)
+        state = self._host(url)
+        self._refill(state, self._clock())
+        state.tokens -= 1
+        return delay
+
+    def record_response(self, url: str) -> None:
+        """Notes that a response from the host of url has just arrived."""
+        self._host(url).last_response_at = self._clock()
@@ -0,0 +1,149 @@
+"""
+Encrypted store of DKB refresh tokens, so that repeat syncs skip the login.
+
+A full DKB login needs the captcha and the user's approval of the MFA challenge
+on their phone, which together take tens of seconds. After it, DKB hands out a
+refresh token. Stored here, the next sync of the same user exchanges it for a
+new session (and a new refresh token) instead.
+
+One file per user, named after the sha256 of the user name:
+
+    <store dir>/<sha256>.json   {"version": 1, "salt": ..., "token": ...}
+
+The token is encrypted with Fernet (AES and HMAC) under a key derived with
+scrypt from the user's password and a random salt. The server never stores
+the password, so the stored tokens are useless without it; after a password
+change, the token simply cannot be decrypted anymore and the sync logs in
+fully. `cryptography` is only imported when the store is used.
+"""
+from __future__ import annotations
+
+import argparse
+import base64
+import hashlib
+import importlib.util
+import json
+import logging
+import os
+import tempfile
+import time
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+
+# Used if DKB does not say how long a refresh token is valid.
+DEFAULT_MAX_AGE = 30 * 24 * 3600  # seconds
+# Cost of the key derivation; about 50ms.
+_SCRYPT_N = 2**14
+_SCRYPT_R = 8
+_SCRYPT_P = 1
+_SALT_SIZE = 16
+
+
+def _derive_key(password: str, salt: bytes) -> bytes:
+    from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
+
+    kdf = Scrypt(salt=salt, length=32, n=_SCRYPT_N, r=_SCRYPT_R, p=_SCRYPT_P)
+    return base64.urlsafe_b64encode(kdf.derive(password.encode("utf-8")))
+
+
+class TokenStore:
+    """Refresh tokens of users, encrypted with their passwords."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def _path(self, username: str) -> str:
+        name = hashlib.sha256(username.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, name + ".json")
+
+    def exists(self, username: str) -> bool:
+        """Whether a token is stored for the user, without decrypting it."""
+        return os.path.exists(self._path(username))
+
+    def load(self, username: str, password: str) -> str | None:
+        """Returns the user's refresh token, or None if there is no valid one."""
+        from cryptography.fernet import Fernet, InvalidToken
+
+        path = self._path(username)
+        try:
+            with open(path, encoding="utf-8") as f:
+                stored = json.load(f)
+            if stored.get("version") != FORMAT_VERSION:
+                raise ValueError("Unsupported version.")
+            key = _derive_key(password, base64.b64decode(stored["salt"]))
+            token = json.loads(Fernet(key).decrypt(stored["token"].encode("ascii")))
+        except FileNotFoundError:
+            return None
+        except InvalidToken:
+            logger.info("Stored refresh token cannot be decrypted, e.g. after a password change.")
+            self.delete(username)
+            return None
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning("Ignoring unreadable stored refresh token: %s", e)
+            return None
+        if token["expires_at"] <= time.time():
+            logger.info("Stored refresh token expired.")
+            self.delete(username)
+            return None
+        return token["refresh_token"]
+
+    def save(self, username: str, password: str, token_data: dict) -> bool:
+        """Stores the refresh token of a /token response, if it has one.
+
+        Returns whether a token was stored."""
+        from cryptography.fernet import Fernet
+
+        refresh_token = token_data.get("refresh_token")
+        if not refresh_token:
+            return False
+        max_age = token_data.get("refresh_expires_in") or DEFAULT_MAX_AGE
+        salt = os.urandom(_SALT_SIZE)
+        payload = json.dumps(
+            {"refresh_token": refresh_token, "expires_at": time.time() + float(max_age)}
+        )
+        stored = {
+            "version": FORMAT_VERSION,
+            "salt": base64.b64encode(salt).decode("ascii"),
+            "token": Fernet(_derive_key(password, salt))
+            .encrypt(payload.encode("utf-8"))
+            .decode("ascii"),
+        }
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        # Write atomically, so that a concurrent sync never reads a partial file.
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".token-")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(stored, f)
+            os.replace(tmp_path, self._path(username))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        return True
+
+    def delete(self, username: str) -> None:
+        try:
+            os.unlink(self._path(username))
+        except FileNotFoundError:
+            pass
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--token-store",
+        default=os.environ.get("FT_BANKSYNC_TOKEN_STORE"),
+        help="Directory to keep the user's refresh token in, encrypted with "
+        "the password. Later syncs then skip the captcha and MFA while it is "
+        "valid. Defaults to the FT_BANKSYNC_TOKEN_STORE env var.",
+    )
+
+
+def from_args(args: argparse.Namespace) -> TokenStore | None:
+    """Returns the store given with --token-store, if any and usable."""
+    if not args.token_store:
+        return None
+    if importlib.util.find_spec("cryptography") is None:
+        logger.warning("Not using the token store: the 'cryptography' package is missing.")
+        return None
+    return TokenStore(args.token_store)
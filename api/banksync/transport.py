@@ -0,0 +1,208 @@
+"""
+Transports for the DKB API calls of dkb_via_api.py after the login.
+
+DKB's MyraSecurity WAF rejects plain HTTP clients, so the login runs through
+DkbBrowser, which issues every API call as an in-page fetch injected via CDP.
+That costs CDP round trips and pushes each response body through the page,
+which adds up for large transaction downloads. Once logged in, a plain HTTP
+client that carries the browser's cookies, XSRF token and user agent may be
+accepted by the WAF as well. select_transport() probes that with one request
+and returns the fastest transport that works.
+
+A transport has the interface of DkbBrowser:
+
+- request(method, path, data=None, json_body=None) returns a response with
+  status_code, text, content_type and json(), and raises ApiError or
+  TimeoutError.
+- request_many(calls, max_concurrency=None) returns one response or exception
+  per call.
+
+HttpTransport needs `requests`, which is only imported when it is used.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote, urlencode
+
+import metrics
+from dkb_captcha import API_BASE_URL, ApiError, _Response
+
+logger = logging.getLogger(__name__)
+
+API_TRANSPORT_AUTO = "auto"
+API_TRANSPORT_BROWSER = "browser"
+API_TRANSPORTS = (API_TRANSPORT_AUTO, API_TRANSPORT_BROWSER)
+
+# Cheap authenticated call used to check whether the WAF accepts the client.
+PROBE_PATH = "/accounts/accounts"
+XSRF_COOKIE = "__Host-xsrf"
+
+
+class WafRejected(ApiError):
+    """Raised when a response comes from the WAF instead of the API, e.g. a
+    "503 Security Check" interstitial."""
+
+
+class HttpTransport:
+    """Issues API calls with a pooled HTTP client that continues the session of
+    a browser."""
+
+    def __init__(
+        self,
+        cookies: list[dict],
+        user_agent: str,
+        base_url: str = API_BASE_URL,
+        max_concurrency: int = 4,
+        timeout: float = 60,
+    ):
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.base_url = base_url
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update(
+            {"User-Agent": user_agent, "Accept": "application/json, text/plain, */*"}
+        )
+        for cookie in cookies:
+            self.session.cookies.set(
+                cookie["name"],
+                cookie["value"],
+                domain=cookie.get("domain", ""),
+                path=cookie.get("path") or "/",
+            )
+
+    def request(
+        self, method: str, path: str, data: dict | None = None, json_body: dict | None = None
+    ) -> _Response:
+        import requests
+
+        headers = {}
+        body = None
+        if json_body is not None:
+            body = json.dumps(json_body)
+            # The server chokes on a plain application/json content type.
+            headers["Content-Type"] = "application/vnd.api+json"
+        elif data is not None:
+            body = urlencode(data)
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        # Like the in-page fetch, echo the XSRF cookie on every call.
+        xsrf = self.session.cookies.get(XSRF_COOKIE)
+        if xsrf:
+            headers["x-xsrf-token"] = unquote(xsrf)
+
+        start = time.monotonic()
+        try:
+            r = self.session.request(
+                method.upper(),
+                self.base_url + path,
+                data=body,
+                headers=headers,
+                timeout=self.timeout,
+            )
+        except requests.Timeout as e:
+            raise TimeoutError(f"HTTP request to {path} timed out") from e
+        except requests.RequestException as e:
+            raise ApiError(f"HTTP request to {path} failed: {e}") from e
+        # Without a charset, requests would guess the encoding of large bodies.
+        r.encoding = r.encoding or "utf-8"
+        text = r.text
+        content_type = r.headers.get("Content-Type", "")
+        metrics.count("requests")
+        metrics.count("bytes_sent", len(body or ""))
+        metrics.count("bytes_received", len(text))
+        logger.debug(
+            "Response: %s - %s (%.0f ms via http)",
+            r.status_code,
+            text[:100],
+            (time.monotonic() - start) * 1000,
+        )
+
+        # The API answers in JSON (or with an empty body), the WAF with HTML.
+        ok = 200 <= r.status_code < 300
+        if "html" in content_type or (not ok and "json" not in content_type):
+            raise WafRejected(f"Rejected by the WAF for {path}: {r.status_code} - {text[:200]}")
+        if not ok:
+            raise ApiError(
+                f"Unsuccessful response code for {path}: {r.status_code} - {text[:200]}"
+            )
+        return _Response(r.status_code, text, content_type)
+
+    def request_many(
+        self, calls: list[dict], max_concurrency: int | None = None
+    ) -> list[_Response | Exception]:
+        """Issues several independent API calls at once, see DkbBrowser.request_many."""
+
+        def call(kwargs: dict) -> _Response | Exception:
+            try:
+                return self.request(**kwargs)
+            except (ApiError, TimeoutError) as e:
+                return e
+
+        limit = max(1, max_concurrency or self.max_concurrency)
+        with ThreadPoolExecutor(limit) as executor:
+            return list(executor.map(call, calls))
+
+
+class FallbackTransport:
+    """Uses a primary transport until the WAF rejects it, then the fallback for
+    good. Rejected calls are repeated on the fallback: the WAF answers before
+    they reach the API, so this is safe even for POSTs."""
+
+    def __init__(self, primary, fallback):
+        self.primary = primary
+        self.fallback = fallback
+
+    def _fall_back(self, error: Exception) -> None:
+        if self.primary is not None:
+            logger.warning("Direct HTTP client rejected (%s), back to the browser.", error)
+            metrics.event("transport_fallback", reason=str(error)[:200])
+            self.primary = None
+
+    def request(self, *args, **kwargs) -> _Response:
+        if self.primary is not None:
+            try:
+                return self.primary.request(*args, **kwargs)
+            except WafRejected as e:
+                self._fall_back(e)
+        return self.fallback.request(*args, **kwargs)
+
+    def request_many(
+        self, calls: list[dict], max_concurrency: int | None = None
+    ) -> list[_Response | Exception]:
+        if self.primary is None:
+            return self.fallback.request_many(calls, max_concurrency)
+        responses = self.primary.request_many(calls, max_concurrency)
+        rejected = [i for i, r in enumerate(responses) if isinstance(r, WafRejected)]
+        if rejected:
+            self._fall_back(responses[rejected[0]])
+            retried = self.fallback.request_many([calls[i] for i in rejected], max_concurrency)
+            for i, response in zip(rejected, retried):
+                responses[i] = response
+        return responses
+
+
+def select_transport(browser, max_concurrency: int = 4, base_url: str = API_BASE_URL):
+    """Returns the transport for the API calls after the login: a direct HTTP
+    client if the WAF accepts a probe request through it, otherwise the
+    browser itself."""
+    with metrics.span("transport_probe") as span:
+        try:
+            cookies, user_agent = browser.session_state()
+            http = HttpTransport(cookies, user_agent, base_url, max_concurrency)
+            http.request("GET", PROBE_PATH)
+        except Exception as e:  # pylint: disable=broad-except
+            # E.g. rejected by the WAF, or requests is not installed.
+            logger.info("Direct HTTP client not usable (%s), staying with the browser.", e)
+            span["transport"] = API_TRANSPORT_BROWSER
+            return browser
+        span["transport"] = "http"
+    logger.info("Using a direct HTTP client for the remaining API calls.")
+    return FallbackTransport(http, browser)
@@ -0,0 +1,276 @@
+#!/usr/bin/python3
+"""
+Long-lived banksync worker that keeps the heavy bank-scraping modules loaded.
+
+Running ``sparkasse.py`` or ``dkb_via_api.py`` as a fresh subprocess pays for
+interpreter startup and for importing requests, lxml, pandas and seleniumbase
+on every sync. The worker imports all of that once and then pre-forks a small
+pool of child processes that accept jobs on a Unix socket (protocol: see
+``worker_client.py``).
+
+Each child handles exactly one job and then exits; the parent immediately forks
+a replacement. Forking from the warm parent is cheap (copy-on-write) and gives
+every job a clean process: the scripts change the working directory, $HOME,
+logging config and module globals, none of which may leak between users.
+
+Usage:
+
+    python worker.py --socket /run/ft-banksync/worker.sock --processes 4
+
+and point the PHP API (and the CLIs) at it via ``FT_BANKSYNC_SOCKET``.
+"""
+from __future__ import annotations
+
+import argparse
+import base64
+import importlib
+import io
+import logging
+import os
+import signal
+import socket
+import sys
+import traceback
+
+import metrics
+from worker_client import SOCKET_ENV_VAR, recv_message, send_message
+
+logger = logging.getLogger("worker")
+
+# Scripts the worker is allowed to run, mapped to a function that turns the
+# return value of their main() into a process exit code, mirroring their
+# `if __name__ == "__main__"` blocks.
+SCRIPTS = {
+    "sparkasse": lambda result: 0 if result else 2,
+    "dkb_via_api": lambda result: 0,
+    "checkpoints": lambda result: 0 if result else 2,
+}
+
+# Third-party modules that are imported ahead of time in the parent, so that
+# forked children find them in sys.modules. Missing ones are skipped, e.g. on a
+# server that only syncs Sparkasse accounts.
+PRELOAD_MODULES = [
+    "requests",
+    "lxml.html",
+    "cssselect",
+    "pandas",
+    "seleniumbase",
+    "cryptography.fernet",
+]
+
+
+def preload() -> None:
+    for name in PRELOAD_MODULES + list(SCRIPTS):
+        try:
+            importlib.import_module(name)
+            logger.debug("Preloaded %s", name)
+        except ImportError as e:
+            logger.warning("Could not preload %s: %s", name, e)
+
+
+def run_script(
+    script: str,
+    args: list[str],
+    stdin: str,
+    cwd: str | None = None,
+    env: dict[str, str] | None = None,
+) -> dict:
+    """Runs a script's main() in this process with redirected standard streams,
+    in the client's working directory and environment if given.
+
+    Only call this in a disposable (forked) process."""
+    stdout = io.TextIOWrapper(io.BytesIO(), encoding="utf-8", write_through=True)
+    stderr = io.TextIOWrapper(io.BytesIO(), encoding="utf-8", write_through=True)
+    sys.stdin = io.StringIO(stdin)
+    sys.stdout = stdout
+    sys.stderr = stderr
+    sys.argv = [script + ".py"] + args
+
+    # The scripts configure logging themselves via basicConfig, which is a
+    # no-op if the worker's own handlers are still installed.
+    worker_handlers = logging.root.handlers[:]
+    worker_level = logging.root.level
+    for handler in worker_handlers:
+        logging.root.removeHandler(handler)
+
+    try:
+        if cwd is not None:
+            os.chdir(cwd)
+        if env is not None:
+            os.environ.clear()
+            # The script must not forward the job back to the worker.
+            os.environ.update((k, v) for k, v in env.items() if k != SOCKET_ENV_VAR)
+        metrics.reset()
+        module = importlib.import_module(script)
+        exit_code = SCRIPTS[script](module.main())
+    except SystemExit as e:
+        # argparse errors, explicit exit() calls.
+        if e.code is None:
+            exit_code = 0
+        elif isinstance(e.code, int):
+            exit_code = e.code
+        else:
+            print(e.code, file=sys.stderr)
+            exit_code = 1
+    except BaseException:
+        traceback.print_exc()
+        exit_code = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        sys.stdin, sys.stdout, sys.stderr = sys.__stdin__, sys.__stdout__, sys.__stderr__
+        for handler in logging.root.handlers[:]:
+            logging.root.removeHandler(handler)
+        for handler in worker_handlers:
+            logging.root.addHandler(handler)
+        logging.root.setLevel(worker_level)
+    # The child exits via os._exit, which skips the atexit handler.
+    metrics.flush(exit_code)
+
+    return {
+        "exit_code": exit_code,
+        "stdout": base64.b64encode(stdout.buffer.getvalue()).decode("ascii"),
+        "stderr": stderr.buffer.getvalue().decode("utf-8", errors="replace"),
+    }
+
+
+def handle_connection(conn: socket.socket) -> None:
+    with conn:
+        request = recv_message(conn)
+        script = request.get("script")
+        if script not in SCRIPTS:
+            send_message(
+                conn,
+                {"exit_code": 2, "stdout": "", "stderr": f"Unknown script: {script!r}"},
+            )
+            return
+        args = [str(a) for a in request.get("args") or []]
+        cwd = request.get("cwd")
+        env = request.get("env")
+        if env is not None:
+            env = {str(k): str(v) for k, v in env.items()}
+        logger.info("Running job: %s", script)
+        response = run_script(
+            script,
+            args,
+            str(request.get("stdin") or ""),
+            str(cwd) if cwd is not None else None,
+            env,
+        )
+        logger.info("Job finished: %s (exit code %d)", script, response["exit_code"])
+        send_message(conn, response)
+
+
+def child_main(listener: socket.socket) -> None:
+    """Entry point of a forked child: handles exactly one job, then exits."""
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    # Never let a job prompt on the worker's terminal (see get_password()).
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    os.close(devnull)
+
+    exit_code = 0
+    try:
+        conn, _ = listener.accept()
+        handle_connection(conn)
+    except Exception:
+        logger.exception("Failed to handle job")
+        exit_code = 1
+    finally:
+        # Skip atexit handlers and buffered writes inherited from the parent.
+        os._exit(exit_code)
+
+
+def spawn_child(listener: socket.socket) -> int:
+    pid = os.fork()
+    if pid == 0:
+        child_main(listener)
+    return pid
+
+
+def serve(socket_path: str, processes: int) -> None:
+    preload()
+
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(socket_path)
+    # Only the owner (the web server user) and its group may submit jobs.
+    os.chmod(socket_path, 0o660)
+    listener.listen(processes * 4)
+    logger.info("Listening on %s with %d processes", socket_path, processes)
+
+    children: set[int] = set()
+    shutting_down = False
+
+    def on_terminate(signum, frame):
+        nonlocal shutting_down
+        shutting_down = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, on_terminate)
+    signal.signal(signal.SIGINT, on_terminate)
+
+    try:
+        while not shutting_down:
+            while len(children) < processes:
+                children.add(spawn_child(listener))
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                continue
+            children.discard(pid)
+            if os.waitstatus_to_exitcode(status) not in (0, -signal.SIGTERM):
+                logger.warning("Child %d exited with status %d", pid, status)
+        while children:
+            pid, _ = os.wait()
+            children.discard(pid)
+    finally:
+        listener.close()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+    logger.info("Shut down.")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serves banksync jobs from a pool of pre-forked, warm processes."
+    )
+    parser.add_argument(
+        "--socket",
+        default=os.environ.get("FT_BANKSYNC_SOCKET"),
+        help="Path of the Unix socket to listen on. Defaults to the "
+        "FT_BANKSYNC_SOCKET env var.",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=2,
+        help="Number of jobs that can run concurrently.",
+    )
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        action="store_true",
+        help="Enable verbose logging.",
+    )
+    args = parser.parse_args()
+    if not args.socket:
+        parser.error("--socket is required if FT_BANKSYNC_SOCKET is not set.")
+    if args.processes < 1:
+        parser.error("--processes must be at least 1.")
+
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.INFO,
+        format="[%(levelname)s] %(name)s: %(message)s",
+    )
+    serve(args.socket, args.processes)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+Client side of the banksync worker protocol (see ``worker.py``).
+
+Messages are UTF-8 encoded JSON objects, each prefixed with its length as a
+4-byte big-endian unsigned integer. A job is one request followed by one
+response on a fresh connection:
+
+    request:  {"script": "sparkasse", "args": [...], "stdin": "...",
+               "cwd": "/path", "env": {"NAME": "value", ...}}
+    response: {"exit_code": 0, "stdout": "<base64>", "stderr": "..."}
+
+``stdout`` is base64 encoded so that the exact bytes written by the script
+survive the round trip, just like when it is run as a subprocess. ``cwd`` and
+``env`` are optional; if given, the job runs in that working directory and with
+exactly that environment, like a subprocess of the client would.
+
+Only a failed connect means that the job did not start. Once the request is
+sent, the job may have reached the bank, so any later failure must be reported
+instead of running the job again elsewhere.
+
+This module deliberately only uses the standard library, so the CLIs can
+forward to a running worker without paying for any heavy imports.
+"""
+from __future__ import annotations
+
+import base64
+import io
+import json
+import os
+import socket
+import struct
+import sys
+
+# Environment variable pointing at the Unix socket of a running worker.
+SOCKET_ENV_VAR = "FT_BANKSYNC_SOCKET"
+
+_HEADER = struct.Struct(">I")
+MAX_MESSAGE_SIZE = 256 * 1024 * 1024
+
+
+class ProtocolError(Exception):
+    """Raised when the peer sends a malformed or truncated message."""
+
+
+class WorkerUnavailable(Exception):
+    """Raised when the worker cannot be connected to, i.e. the job never started."""
+
+
+def send_message(sock: socket.socket, message: dict) -> None:
+    payload = json.dumps(message).encode("utf-8")
+    sock.sendall(_HEADER.pack(len(payload)) + payload)
+
+
+def _recv_exactly(sock: socket.socket, size: int) -> bytes:
+    chunks = []
+    remaining = size
+    while remaining > 0:
+        chunk = sock.recv(min(remaining, 1024 * 1024))
+        if not chunk:
+            raise ProtocolError("Connection closed in the middle of a message")
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b"".join(chunks)
+
+
+def recv_message(sock: socket.socket) -> dict:
+    (size,) = _HEADER.unpack(_recv_exactly(sock, _HEADER.size))
+    if size > MAX_MESSAGE_SIZE:
+        raise ProtocolError(f"Message too large: {size} bytes")
+    try:
+        message = json.loads(_recv_exactly(sock, size).decode("utf-8"))
+    except ValueError as e:
+        raise ProtocolError(f"Invalid JSON: {e}") from e
+    if not isinstance(message, dict):
+        raise ProtocolError("Expected a JSON object")
+    return message
+
+
+def run_job(
+    socket_path: str,
+    script: str,
+    args: list[str],
+    stdin: str,
+    timeout: float | None = None,
+    cwd: str | None = None,
+    env: dict[str, str] | None = None,
+) -> tuple[int, bytes, str]:
+    """Runs a job on the worker and returns (exit_code, stdout, stderr).
+
+    Raises WorkerUnavailable if the worker cannot be reached; only then may
+    the caller run the job elsewhere. Once connected, raises OSError if the
+    connection fails, socket.timeout (an OSError as well) if a send or
+    receive, e.g. waiting for the job to finish, takes longer than `timeout`
+    seconds, and ProtocolError for a malformed response."""
+    request: dict = {"script": script, "args": args, "stdin": stdin}
+    if cwd is not None:
+        request["cwd"] = cwd
+    if env is not None:
+        request["env"] = env
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        try:
+            sock.connect(socket_path)
+        except OSError as e:
+            raise WorkerUnavailable(str(e)) from e
+        send_message(sock, request)
+        response = recv_message(sock)
+    try:
+        return (
+            int(response["exit_code"]),
+            base64.b64decode(response.get("stdout") or ""),
+            response.get("stderr") or "",
+        )
+    except (KeyError, TypeError, ValueError) as e:
+        raise ProtocolError(f"Invalid response: {e}") from e
+
+
+def forward_cli(script: str) -> int | None:
+    """Forwards the current CLI invocation to a running worker, if configured.
+
+    Returns the exit code of the job, or None if the invocation should be
+    handled locally (no worker configured, worker unreachable, or interactive
+    use where the script needs to prompt on the terminal). The job runs in
+    this process's working directory and environment, so that relative paths
+    and per-call settings such as FT_CHROME_BINARY apply as they would
+    locally."""
+    socket_path = os.environ.get(SOCKET_ENV_VAR)
+    if not socket_path or sys.stdin.isatty():
+        return None
+
+    stdin = sys.stdin.read()
+    try:
+        exit_code, stdout, stderr = run_job(
+            socket_path, script, sys.argv[1:], stdin, cwd=os.getcwd(), env=dict(os.environ)
+        )
+    except WorkerUnavailable:
+        # Fall back to running in-process. Stdin was already consumed, so hand
+        # it back to the local run.
+        sys.stdin = io.StringIO(stdin)
+        return None
+    except (OSError, ProtocolError) as e:
+        # The job may have reached the bank already: don't run it again.
+        print(f"The banksync worker failed during the job: {e}", file=sys.stderr)
+        return 1
+
+    sys.stdout.buffer.write(stdout)
+    sys.stdout.buffer.flush()
+    sys.stderr.write(stderr)
+    sys.stderr.flush()
+    return exit_code
@@ -13,3 +13,22 @@ if ($pythonVenvDir && is_dir($pythonVenvDir)) {
 } else {
   define('PYTHON_EXECUTABLE', 'python3');
 }
+
+// Optional: Unix socket of a running banksync worker (banksync/worker.py).
+// If set, sync jobs are sent to the warm worker instead of spawning Python.
+$banksyncSocket = getenv('FT_BANKSYNC_SOCKET');
+if ($banksyncSocket && file_exists($banksyncSocket)) {
+  define('BANKSYNC_WORKER_SOCKET', $banksyncSocket);
+} else {
+  define('BANKSYNC_WORKER_SOCKET', null);
+}
+
+// Optional: writable directory where banksync keeps state between runs
+// (e.g. checkpoints for incremental syncs). Features relying on it are
+// disabled if unset.
+$banksyncStateDir = getenv('FT_BANKSYNC_STATE_DIR');
+if ($banksyncStateDir && is_dir($banksyncStateDir)) {
+  define('BANKSYNC_STATE_DIR', rtrim($banksyncStateDir, '/'));
+} else {
+  define('BANKSYNC_STATE_DIR', null);
+}
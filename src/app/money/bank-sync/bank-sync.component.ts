@@ -7,13 +7,8 @@ import { RequiredProto } from 'src/app/core/proto-util';
 import { Account, BankSyncSettings, IBankSyncSettings } from 'src/proto/model';
 import { DataService } from '../data.service';
 import { DialogService } from '../dialog.service';
-import { BankSyncRequest, BankSyncResult, BankSyncService, BankType } from './bank-sync.service';
-
-/**
- * Since the sync script reencodes all CSV files as UTF-8, we want to override
- * the account's default setting upon import.
- */
-const FORCED_IMPORT_ENCODING = 'utf-8';
+import { ALL_FILE_FORMATS, ImportFileFormat } from '../import/mappings';
+import { BankSyncRequest, BankSyncResult, BankSyncService, BankType, parseNdjsonRows } from './bank-sync.service';
 
 const HARDCODED_DKB_BANK_URL = 'https://www.dkb.de/';
 
@@ -124,6 +119,8 @@ export class BankSyncComponent implements OnInit {
       loginPassword: data.loginPassword,
       maxTransactionAge: data.maxTransactionAgeDays,
       accountIndices: accountMappings.map(mapping => mapping.bankAccountIndex),
+      // Rows with the file format of the import, so they need no CSV parsing.
+      outputFormat: 'ndjson',
     };
 
     this.showLog('Starting bank sync ...');
@@ -140,9 +137,9 @@ export class BankSyncComponent implements OnInit {
           response = { success: undefined, error: 'Empty response received!' };
         }
         if (response.success) {
-          this.showLog(`Success! Received ${response.results.length} CSV files.`);
+          this.showLog(`Success! Received ${response.results.length} results.`);
           this.lastSyncSuccess = true;
-          this.processResults(response.results, accountMappings);
+          this.processResults(response.results, accountMappings, response.checkpointToken);
         } else {
           this.showLog('Unsuccessful!');
           this.showLog();
@@ -160,7 +157,7 @@ export class BankSyncComponent implements OnInit {
       });
   }
 
-  private async processResults(results: BankSyncResult[], accountMappings: AccountMapping[]) {
+  private async processResults(results: BankSyncResult[], accountMappings: AccountMapping[], checkpointToken?: string) {
     const syncId = moment().format('YYYY-MM-DD-HH-mm-ss');
 
     if (results.length !== accountMappings.length) {
@@ -169,24 +166,47 @@ export class BankSyncComponent implements OnInit {
       alert(msg);
     }
 
+    // Bank account indices whose results were imported (or empty).
+    const importedIndices: number[] = [];
     for (let i = 0; i < results.length; i++) {
-      const csvString = results[i].data;
+      const rowsString = results[i].data;
       const targetAccountId = accountMappings[i].localAccountId;
       const targetAccount = this.dataService.getAccountById(targetAccountId);
-      if (csvString === null) {
+      if (rowsString === null) {
         // TODO: Replace with nicer message dialog.
         alert(`Account: ${targetAccount.name}\n\nThe sync was successful, but there are no transactions in the given date range.`);
         this.showLog(`Import into ${targetAccount.name}: EMPTY`);
+        importedIndices.push(accountMappings[i].bankAccountIndex);
         continue;
       }
 
-      const name = `autosync_${syncId}_acc${accountMappings[i].bankAccountIndex}.csv`;
-      const csvFile = new File([csvString], name, { type: 'application/octet-stream' });
-      const dialog = this.dialogService.openAccountImport(targetAccount, csvFile, FORCED_IMPORT_ENCODING);
+      const rows = parseNdjsonRows(rowsString);
+      const fileFormat = rows[0].file_format;
+      if (!ALL_FILE_FORMATS.includes(fileFormat)) {
+        this.showLog(`Import into ${targetAccount.name}: FAILED, unknown file format ${fileFormat}`);
+        continue;
+      }
+      const fileName = `autosync_${syncId}_acc${accountMappings[i].bankAccountIndex}`;
+      const dialog = this.dialogService.openAccountImport(targetAccount, undefined, undefined, {
+        fileName,
+        fileFormat: <ImportFileFormat>fileFormat,
+        rows: rows.map(row => row.values),
+      });
 
       // Delay next import until dialog is closed.
       const result = await dialog.afterClosed().toPromise();
       this.showLog(`Import into ${targetAccount.name}: ${result ? 'DONE' : 'CANCELLED'}`);
+      if (result) {
+        importedIndices.push(accountMappings[i].bankAccountIndex);
+      }
+    }
+
+    if (checkpointToken) {
+      // Only now may the next incremental sync skip what was imported.
+      const response = await this.bankSyncService.commitCheckpoint(checkpointToken, importedIndices).toPromise();
+      if (!response.success) {
+        this.showLog(`Could not save the sync progress: ${response.error}`);
+      }
     }
   }
 
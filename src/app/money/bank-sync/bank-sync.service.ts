@@ -4,6 +4,18 @@ import { Observable } from "rxjs";
 import { environment } from "src/environments/environment";
 
 export type BankType = 'sparkasse' | 'dkb';
+/**
+ * Format of the result data: the bank's CSV export, or its rows mapped onto
+ * ImportedRow (file format and the raw values of the CSV), as newline-delimited
+ * JSON or base64-encoded length-delimited protobuf messages.
+ */
+export type BankSyncOutputFormat = 'csv' | 'ndjson' | 'protobuf';
+
+/** One line of a result in the 'ndjson' output format. */
+export interface BankSyncRow {
+  file_format: string;
+  values: { [column: string]: string };
+}
 
 export interface BankSyncRequest {
   bankType: BankType;
@@ -12,6 +24,21 @@ export interface BankSyncRequest {
   loginPassword: string;
   maxTransactionAge: number;
   accountIndices: number[];
+  /** Only request transactions that were not returned by a previous sync. */
+  incremental?: boolean;
+  /**
+   * Storage id (dataKey) of the user's database. If it is stored unencrypted,
+   * transactions that were already imported into it are not returned.
+   */
+  dedupStorageId?: string;
+  /**
+   * Ids of the local accounts that the accounts are imported into, in the
+   * order of accountIndices. Like the import, deduplication only compares
+   * rows that belong to the target account (or to no transaction at all).
+   */
+  dedupAccountIds?: number[];
+  /** Defaults to 'csv'. */
+  outputFormat?: BankSyncOutputFormat;
   verbose?: boolean;
 }
 
@@ -22,6 +49,12 @@ export interface BankSyncResult {
 export interface BankSyncSuccessResponse {
   success: true;
   results: BankSyncResult[];
+  /**
+   * Set for incremental syncs. Pass it to commitCheckpoint() with the accounts
+   * whose results were imported, so that the next incremental sync continues
+   * after them. Results that are not confirmed are returned again.
+   */
+  checkpointToken?: string;
 }
 export interface BankSyncErrorResponse {
   success: undefined;
@@ -29,6 +62,14 @@ export interface BankSyncErrorResponse {
   errorDetails?: string;
 }
 export type BankSyncResponse = BankSyncSuccessResponse | BankSyncErrorResponse;
+export type BankSyncCommitResponse = { success: true } | BankSyncErrorResponse;
+
+/** Parses the data of a result in the 'ndjson' output format. */
+export function parseNdjsonRows(data: string): BankSyncRow[] {
+  return data.split('\n')
+    .filter(line => line.trim() !== '')
+    .map(line => JSON.parse(line) as BankSyncRow);
+}
 
 @Injectable({
   providedIn: 'root'
@@ -44,4 +85,8 @@ export class BankSyncService {
     }
     return this.httpClient.post<BankSyncResponse>('/api/banksync', request);
   }
+
+  commitCheckpoint(checkpointToken: string, accountIndices: number[]): Observable<BankSyncCommitResponse> {
+    return this.httpClient.post<BankSyncCommitResponse>('/api/banksync/checkpoint', { checkpointToken, accountIndices });
+  }
 }
\ No newline at end of file
@@ -8,7 +8,7 @@ import { AccountEditComponent, AccountEditConfig } from './accounts/account-edit
 import { BalancesComponent } from './accounts/balances/balances.component';
 import { DialogLabelDominanceComponent, LabelDominanceOrder } from './analytics/dialog-label-dominance/dialog-label-dominance.component';
 import { DialogStaleDataComponent } from './dialog-stale-data/dialog-stale-data.component';
-import { ImportDialogData, ImportFileComponent, ImportFileEncoding } from './import/import-file.component';
+import { ImportDialogData, ImportFileComponent, ImportFileEncoding, ImportRows } from './import/import-file.component';
 import { RuleEditComponent, RuleEditConfig } from './rules/rule-edit/rule-edit.component';
 import { DialogDeleteWithOrphansComponent } from './transactions/dialog-delete-with-orphans/dialog-delete-with-orphans.component';
 import { DialogSplitTransactionComponent } from './transactions/dialog-split-transaction/dialog-split-transaction.component';
@@ -48,10 +48,11 @@ export class DialogService {
   openAccountImport(
     account: Account | null,
     file?: File,
-    forcedEncoding?: ImportFileEncoding
+    forcedEncoding?: ImportFileEncoding,
+    rows?: ImportRows
   ): ConfirmableDialogRef<ImportFileComponent> {
     return this.openConfirmable(ImportFileComponent, {
-      data: <ImportDialogData>{ account, file, forcedEncoding },
+      data: <ImportDialogData>{ account, file, forcedEncoding, rows },
     });
   }
 
@@ -15,10 +15,19 @@ import { ALL_FILE_FORMATS, ImportFileFormat, MAPPINGS_BY_FORMAT } from './mappin
 export const ALL_FILE_ENCODINGS = ['windows-1252', 'utf-8'];
 export type ImportFileEncoding = 'windows-1252' | 'utf-8';
 
+/** Rows that were already read from a file, e.g. by the bank sync. */
+export interface ImportRows {
+  fileName: string;
+  fileFormat: ImportFileFormat;
+  rows: { [column: string]: string }[];
+}
+
 export interface ImportDialogData {
   account: Account | null;
   file?: File;
   forcedEncoding?: ImportFileEncoding;
+  /** Imports these rows instead of parsing a file. */
+  rows?: ImportRows;
 }
 
 @Component({
@@ -31,6 +40,8 @@ export class ImportFileComponent implements OnInit {
 
   forcedFileName: string | null = null;
   isEncodingForced = false;
+  isFormatForced = false;
+  private readonly rows: ImportRows | null = null;
 
   // Form data.
   private _file: File | null = null;
@@ -76,6 +87,13 @@ export class ImportFileComponent implements OnInit {
       this.forcedFileName = data.file.name;
     }
 
+    if (data.rows) {
+      this.rows = data.rows;
+      this.forcedFileName = data.rows.fileName;
+      this.fileFormat = data.rows.fileFormat;
+      this.isFormatForced = true;
+    }
+
     if (data.forcedEncoding) {
       this.fileEncoding = data.forcedEncoding;
       this.isEncodingForced = true;
@@ -84,7 +102,7 @@ export class ImportFileComponent implements OnInit {
     else if (this.targetAccount && ALL_FILE_ENCODINGS.includes(this.targetAccount.preferredFileEncoding)) {
       this.fileEncoding = <ImportFileEncoding>this.targetAccount.preferredFileEncoding;
     }
-    if (this.targetAccount && ALL_FILE_FORMATS.includes(this.targetAccount.preferredFileFormat)) {
+    if (!this.isFormatForced && this.targetAccount && ALL_FILE_FORMATS.includes(this.targetAccount.preferredFileFormat)) {
       this.fileFormat = <ImportFileFormat>this.targetAccount.preferredFileFormat;
     }
   }
@@ -115,7 +133,9 @@ export class ImportFileComponent implements OnInit {
     this.loggerService.log(`Imported ${entries.length} transactions.`);
 
     // Update account default file format & encoding.
-    this.targetAccount.preferredFileFormat = this.fileFormat;
+    if (!this.isFormatForced) {
+      this.targetAccount.preferredFileFormat = this.fileFormat;
+    }
     if (!this.isEncodingForced) {
       this.targetAccount.preferredFileEncoding = this.fileEncoding;
     }
@@ -151,7 +171,7 @@ export class ImportFileComponent implements OnInit {
 
   private updateFilePreview() {
     this.resetPreview();
-    if (!this.file) {
+    if (!this.file && !this.rows) {
       return;
     }
 
@@ -161,7 +181,14 @@ export class ImportFileComponent implements OnInit {
       return;
     }
 
-    const file = this.file;
+    if (this.rows) {
+      // Already split into columns, no need to parse a CSV file.
+      const fields = this.rows.rows.length > 0 ? Object.keys(this.rows.rows[0]) : [];
+      this.processRows(this.rows.fileName, mapping, fields, this.rows.rows);
+      return;
+    }
+
+    const file = this.file!;
     this.papaService.parse(file, {
       beforeFirstChunk: firstChunk => {
         if (!mapping.startPattern) return firstChunk;
@@ -183,8 +210,11 @@ export class ImportFileComponent implements OnInit {
 
   private processFileContents(fileName: string, mapping: FormatMapping, csvData: ParseResult) {
     this.loggerService.debug('csvData', csvData);
+    this.processRows(fileName, mapping, csvData.meta.fields, csvData.data);
+  }
 
-    if (!this.validateRequiredColumns(csvData.meta.fields, mapping)) {
+  private processRows(fileName: string, mapping: FormatMapping, fields: string[], rows: any[]) {
+    if (!this.validateRequiredColumns(fields, mapping)) {
       return;
     }
 
@@ -196,8 +226,8 @@ export class ImportFileComponent implements OnInit {
     const existingRows = this.findRelevantExistingRows();
 
     // Process rows.
-    for (let i = 0; i < csvData.data.length; i++) {
-      const row = csvData.data[i] as { [column: string]: string };
+    for (let i = 0; i < rows.length; i++) {
+      const row = rows[i] as { [column: string]: string };
 
       if (mapping.rowFilter && !mapping.rowFilter(row)) {
         continue;
@@ -214,7 +244,7 @@ export class ImportFileComponent implements OnInit {
         sourceFileName: fileName,
         fileFormat: this.fileFormat,
       });
-      for (let field of csvData.meta.fields) {
+      for (let field of fields) {
         importedRow.values[field] = row[field];
       }
 